@@ -11,4 +11,20 @@ $$ LANGUAGE plpgsql;
 
 -- LOAD  'age';
 -- SET search_path = ag_catalog, "$user", public;
--- SELECT create_graph('funkybrain');
\ No newline at end of file
+-- SELECT create_graph('funkybrain');
+
+--the queue of pending embedding jobs (see funkyprompt.services.data.embedding_queue)
+
+CREATE SCHEMA IF NOT EXISTS core;
+CREATE TABLE IF NOT EXISTS core.embedding_queue (
+    id BIGSERIAL PRIMARY KEY,
+    table_name VARCHAR NOT NULL,
+    key_field VARCHAR NOT NULL,
+    record_id VARCHAR NOT NULL,
+    field VARCHAR NOT NULL,
+    provider VARCHAR,
+    enqueued_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    attempts INTEGER DEFAULT 0,
+    last_error TEXT,
+    UNIQUE (table_name, record_id, field)
+);
@@ -10,15 +10,32 @@ class LanguageModelProvider(Enum):
     cerebras = "cerebras"
     
 import typing
-from funkyprompt.core.agents import CallingContext
-from funkyprompt.core import AbstractModel
-from funkyprompt import entities
+import importlib
+
+"""the top level package imports nothing heavy - the agents and services (and their clients) are imported on first use.
+this keeps the cli and workers quick to start"""
+_LAZY_ATTRIBUTES = {
+    "entities": ("funkyprompt.entities", None),
+    "CallingContext": ("funkyprompt.core.agents", "CallingContext"),
+    "AbstractModel": ("funkyprompt.core", "AbstractModel"),
+}
+
+
+def __getattr__(name: str):
+    if name not in _LAZY_ATTRIBUTES:
+        raise AttributeError(f"module 'funkyprompt' has no attribute '{name}'")
+    module, attribute = _LAZY_ATTRIBUTES[name]
+    value = importlib.import_module(module)
+    if attribute:
+        value = getattr(value, attribute)
+    globals()[name] = value
+    return value
 
 
 def run(
     questions: str | typing.List[str],
-    context: CallingContext = None,
-    model: AbstractModel = None,
+    context: "CallingContext" = None,
+    model: "AbstractModel" = None,
 ):
     """entry point into the runner for convenience
     - direct questions can be asked butthen the simple `ask` method would suffice
@@ -62,7 +79,7 @@ def ask(question, context=None, **kwargs):
     return model(question, context=context, **kwargs)
 
 
-def summarize(text:str, context:str, model:AbstractModel=None):
+def summarize(text:str, context:str, model:"AbstractModel"=None):
     """
     This is a handy summarization method but we can evolve it
     its not that different to ask but would some bias   
@@ -4,7 +4,6 @@ simple cli
 
 import typer
 import funkyprompt
-from funkyprompt.core.agents import CallingContext
 import typing
 
 app = typer.Typer()
@@ -18,6 +17,8 @@ def ask(query: typing.Optional[str] = typer.Option(None, "--query", "-q"),
     run a query
     """
 
+    from funkyprompt.core.agents import CallingContext
+
     # todo proper loader by name - this assumes default namespace and instruct embedding
     def callback(s):
         print(s, end="")
@@ -25,4 +26,38 @@ def ask(query: typing.Optional[str] = typer.Option(None, "--query", "-q"),
     query = query or "tell the user welcome to funkyprompt - run ask -q your question"
     response = funkyprompt.ask(query, context=CallingContext(response_callback=callback))
     
-    print(response)
\ No newline at end of file
+    print(response)
+
+@app.command("embed")
+def embed(workers: int = typer.Option(4, "--workers", "-w"),
+          batch_size: int = typer.Option(64, "--batch-size", "-b"),
+          drain: bool = typer.Option(False, "--drain", help="process what is queued and exit")
+          ):
+    """
+    run embedding workers that drain the embedding queue
+    """
+    import time
+    from funkyprompt.services.data.embedding_queue import EmbeddingQueue, EmbeddingWorkerPool
+
+    queue = EmbeddingQueue()
+    queue._create_queue()
+    if drain:
+        print(f"processed {queue.drain(batch_size=batch_size)} embedding jobs")
+        return
+
+    pool = EmbeddingWorkerPool(workers=workers, batch_size=batch_size, queue=queue).start()
+    try:
+        while True:
+            time.sleep(30)
+            print(pool.metrics())
+    except KeyboardInterrupt:
+        pool.stop()
+
+@app.command("manifest")
+def manifest(path: typing.Optional[str] = typer.Option(None, "--path", "-p")):
+    """
+    rebuild the entity manifest that is read at startup instead of discovering entities
+    """
+    from funkyprompt.entities.manifest import write_manifest
+
+    print(f"wrote {write_manifest(path)}")
@@ -15,6 +15,7 @@ from fastapi import (
 from http import HTTPStatus
 from starlette.responses import HTMLResponse
 from fastapi.responses import StreamingResponse
+from starlette.concurrency import run_in_threadpool
 from funkyprompt.core.agents import ApiCallingContext, Runner
 import typing
 from pathlib import Path
@@ -96,9 +97,9 @@ async def ask(
     """
 
     try:
-        """interact and respond"""
+        """interact and respond - the runner (llm calls and the sync stores its functions use) blocks so it runs in a worker thread and not on the event loop"""
         r = Runner()
-        stream = r(question=question, context=response_context)
+        stream = await run_in_threadpool(r, question=question, context=response_context)
 
         def iterate_s():
             """this is a bit of a hack because i cannot ensure yet that i am streaming non null things from above"""
@@ -116,6 +117,23 @@ async def ask(
 
         raise HTTPException(status_code=500, detail=str(ex))
     
+@app.get("/search/{entity}")
+async def search(entity: str, question: str, limit: int = 7):
+    """
+    vector search over an entity type e.g. public.project on the async store so concurrent searches share the event loop
+    """
+    from funkyprompt.entities import entity_registry
+    from funkyprompt.services import async_entity_store
+
+    model = entity_registry.resolve(entity)
+    if model is None:
+        raise HTTPException(status_code=404, detail=f"There is no entity type {entity}")
+    try:
+        return await async_entity_store(model).avector_search(question, limit=limit)
+    except Exception as ex:
+        raise HTTPException(status_code=500, detail=str(ex))
+
+
 def start():
     import uvicorn
 
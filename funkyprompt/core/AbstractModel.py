@@ -281,15 +281,15 @@ class AbstractModel(BaseModel):
 
     @classmethod
     def sql(cls) -> SqlHelper:
-        """reference the sql helper"""
+        """reference the sql helper - compiled once per model type"""
 
-        return SqlHelper(cls)
+        return SqlHelper.for_model(cls)
 
     @classmethod
     def cypher(cls) -> CypherHelper:
-        """reference the cypher helper"""
+        """reference the cypher helper - one per model type"""
 
-        return CypherHelper(cls)
+        return CypherHelper.for_model(cls)
 
     def db_dump(self):
         """serialize complex types as we need for DBs/Postgres
@@ -298,12 +298,11 @@ class AbstractModel(BaseModel):
         - embedding are added async on a new table in our model
 
         """
-        from funkyprompt.core.types.sql import SqlHelper
         import json
 
         data = vars(self)
-        """control selectable fields by exclude or other attributes"""
-        fields = SqlHelper.select_fields(self)
+        """control selectable fields by exclude or other attributes - from the compiled helper rather than per record"""
+        fields = self.sql().field_set
 
         def check_complex(v):
             if isinstance(v, dict):# or isinstance(v, list):
@@ -335,6 +334,16 @@ class AbstractModel(BaseModel):
                 needs_embeddings[k] = f"{k}_embedding"
         return needs_embeddings
 
+    @classmethod
+    def get_embedding_providers(cls) -> typing.Dict[str, str]:
+        """returns the embedding provider (registry name) for each field that has embeddings"""
+        providers = {}
+        for k, v in cls.model_fields.items():
+            extras = getattr(v, "json_schema_extra", {}) or {}
+            if extras.get("embedding_provider"):
+                providers[k] = extras["embedding_provider"]
+        return providers
+
     @classmethod
     def _get_child_models(cls) -> typing.List["AbstractModel"]:
         """
@@ -393,10 +402,17 @@ class AbstractModel(BaseModel):
 
     @classmethod
     def _register(cls):
-        """a not to be abused but convenient self-register in the core entity store"""
+        """a not to be abused but convenient self-register in the core entity store
+        entities are also added to the entity registry so they can be resolved e.g. from graph labels
+        """
         from funkyprompt.services import entity_store
 
-        return entity_store(cls)._create_model()
+        result = entity_store(cls)._create_model()
+        if issubclass(cls, AbstractEntity):
+            from funkyprompt.entities import register
+
+            register(cls)
+        return result
     
     @classmethod
     def _ask(cls, question:str, raw_results:bool=False, review_messages:bool=False):
@@ -640,7 +656,8 @@ class AbstractEntity(AbstractModel):
             except:
                 raise ValueError(f"You have supplied a value {data_delta} that is not compatible with the type schema for {cls.get_model_fullname()}")
        
-        response =  store.update_records(cls(**existing))
+        """we validate the response as the model so ask for all of the model fields back (not just the keys)"""
+        response =  store.update_records(cls(**existing), returning=cls.sql().select_list)
         if response:
             """assumed contract on update one"""
             response = response[0]
@@ -122,13 +122,9 @@ class FunctionManager:
         Args:
             function_names (dict): provide a map of the function and the entity it belongs to. if the function is prefixed with a verb such as get or post, please retain it in the name
         """
-        from funkyprompt.entities import load_entities
+        from funkyprompt.entities import entity_registry
         
         function_names = unqual(function_names)
-        
-        """this will become smarter and faster"""
-        entities = load_entities()
-        entities = {e.get_model_fullname():e for e in entities}
  
         for f, entity_name in function_names.items():
             #temp hack - we want to have multiple ways to add functions - this is a universal api naming thing
@@ -144,9 +140,9 @@ class FunctionManager:
                 alias = str(f).replace('.','_')
                 f = f.replace(f"{entity_name}", '').lstrip('_').lstrip('.')
                 
-                entity = entities.get(entity_name)
+                entity = entity_registry.resolve(entity_name)
                 if entity is None:
-                    raise Exception(f"The entity {entity_name} does not exist or cannot be loaded from {entities}")
+                    raise Exception(f"The entity {entity_name} does not exist or cannot be loaded from {[e.get_model_fullname() for e in entity_registry.entities()]}")
                 self.add_function(getattr(entity,f), alias=alias)
                 print('added', alias)
             
@@ -160,8 +160,8 @@ class Plan(AbstractEntity):
 
         def describe_available_entity_functions()->dict:
             """entities are loaded from the library for now but could be from elsewhere"""
-            from funkyprompt.entities import load_entities
-            return {e.get_model_fullname(): e._describe_model() for e in load_entities()}
+            from funkyprompt.entities import entity_registry
+            return entity_registry.describe()
 
         return f"""
 ## Available entity functions
@@ -1,5 +1,12 @@
 from funkyprompt.core import AbstractModel, Field
+from funkyprompt.core.utils import logger
+from collections import OrderedDict
+import threading
+import weakref
+import hashlib
 import typing
+import time
+import re
 
 DESCRIPTION = f"""The query classifier is used to determine the nature of a natural language query.
 1. If entities are mentioned, then it could be a key look therefore extract entities in the question is important
@@ -26,6 +33,152 @@ DESCRIPTION = f"""The query classifier is used to determine the nature of a natu
 
 # Notes: a big part of this is lowering the confidence on SQL
 
+"""schema hashes by model type with the fields they were taken from - the model prompt is only rebuilt when the model changes"""
+_SCHEMA_HASHES: "weakref.WeakKeyDictionary[type, typing.Tuple[typing.Any, str]]" = weakref.WeakKeyDictionary()
+
+
+class ClassificationCache:
+    """classifications are cached by (model fullname, model schema hash, normalised question) so that repeated questions skip the LLM.
+    the schema hash is taken over the model prompt the classifier sees so that changing the model invalidates its entries.
+    entries expire after `ttl` seconds and the least recently used are evicted past `max_size`.
+    with a `similarity_threshold` near-duplicate questions for the same model also hit - the questions are embedded
+    (which is cheap and cached) and compared to the cached questions for the model
+    """
+
+    def __init__(
+        self,
+        max_size: int = 1024,
+        ttl: float = 3600,
+        similarity_threshold: float = None,
+        embedding_provider: str = "openai",
+    ):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.similarity_threshold = similarity_threshold
+        self.embedding_provider = embedding_provider
+        self._entries: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+        self._counters = {"hits": 0, "semantic_hits": 0, "misses": 0}
+
+    @staticmethod
+    def normalise(question: str) -> str:
+        return re.sub(r"\s+", " ", str(question).strip().lower()).rstrip("?.! ")
+
+    @staticmethod
+    def schema_hash(model: AbstractModel) -> str:
+        """memoized per model type (like `SqlHelper.for_model`) so that cache hits do not rebuild the model prompt"""
+        model = model if isinstance(model, type) else type(model)
+        fields = getattr(model, "model_fields", None)
+        memo = _SCHEMA_HASHES.get(model)
+        if memo is None or memo[0] is not fields:
+            memo = (fields, hashlib.sha256(model.get_model_as_prompt().encode("utf-8")).hexdigest()[:16])
+            _SCHEMA_HASHES[model] = memo
+        return memo[1]
+
+    def _embed(self, question: str):
+        """the unit question vector or None if it cannot be embedded - the cache is an optimisation and never fails a classification"""
+        import numpy as np
+        from funkyprompt.core.utils.embeddings import embed_collection
+
+        try:
+            v = np.array(embed_collection([question], provider=self.embedding_provider)[0])
+        except Exception as ex:
+            logger.warning(f"Failed to embed the question for the classification cache - {ex}")
+            return None
+        return v / (np.linalg.norm(v) or 1)
+
+    def _expired(self, entry) -> bool:
+        return self.ttl is not None and time.monotonic() - entry["at"] > self.ttl
+
+    def get(self, model: AbstractModel, question: str) -> typing.Optional["QueryClassifier"]:
+        scope = (model.get_model_fullname(), ClassificationCache.schema_hash(model))
+        normalised = ClassificationCache.normalise(question)
+        key = scope + (normalised,)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and self._expired(entry):
+                self._entries.pop(key)
+                entry = None
+            if entry:
+                self._entries.move_to_end(key)
+                self._counters["hits"] += 1
+                return entry["value"].model_copy(deep=True)
+            candidates = [
+                (k, e)
+                for k, e in self._entries.items()
+                if k[:2] == scope and e.get("vector") is not None and not self._expired(e)
+            ]
+
+        vector = self._embed(normalised) if self.similarity_threshold and candidates else None
+        if vector is not None:
+            best_key, best = max(candidates, key=lambda c: float(c[1]["vector"] @ vector))
+            similarity = float(best["vector"] @ vector)
+            if similarity >= self.similarity_threshold:
+                logger.debug(f"classification cache matched {normalised!r} to {best_key[-1]!r} ({similarity:.3f})")
+                with self._lock:
+                    if best_key in self._entries:
+                        self._entries.move_to_end(best_key)
+                    self._counters["semantic_hits"] += 1
+                return best["value"].model_copy(deep=True)
+
+        with self._lock:
+            self._counters["misses"] += 1
+        return None
+
+    def put(self, model: AbstractModel, question: str, classification: "QueryClassifier"):
+        normalised = ClassificationCache.normalise(question)
+        key = (model.get_model_fullname(), ClassificationCache.schema_hash(model), normalised)
+        vector = None
+        if self.similarity_threshold:
+            vector = self._embed(normalised)
+            if vector is None:
+                """without a vector the entry could not match near duplicates so we skip the write"""
+                return
+        with self._lock:
+            self._entries[key] = {
+                "value": classification.model_copy(deep=True),
+                "vector": vector,
+                "at": time.monotonic(),
+            }
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = sum(self._counters.values())
+            hits = self._counters["hits"] + self._counters["semantic_hits"]
+            return {
+                **self._counters,
+                "size": len(self._entries),
+                "hit_rate": hits / total if total else 0.0,
+            }
+
+
+_classification_cache: ClassificationCache = None
+
+
+def get_classification_cache() -> ClassificationCache:
+    """the process-wide classification cache configured from the env"""
+    from funkyprompt.core.utils.env import (
+        CLASSIFIER_CACHE_SIZE,
+        CLASSIFIER_CACHE_TTL,
+        CLASSIFIER_SIMILARITY_THRESHOLD,
+    )
+
+    global _classification_cache
+    if _classification_cache is None:
+        _classification_cache = ClassificationCache(
+            max_size=CLASSIFIER_CACHE_SIZE,
+            ttl=CLASSIFIER_CACHE_TTL,
+            similarity_threshold=CLASSIFIER_SIMILARITY_THRESHOLD,
+        )
+    return _classification_cache
+
 
 class QueryClassifier(AbstractModel):
     class Config:
@@ -72,6 +225,7 @@ class QueryClassifier(AbstractModel):
         question: str,
         preview: bool = False,
         return_model: bool = True,
+        use_cache: bool = True,
     ) -> "QueryClassifier":
         """Used to classify a question based on a model semantics.
         use the preview flag to see the prompt markdown
@@ -82,8 +236,13 @@ class QueryClassifier(AbstractModel):
             question: the user's question tp classify
             preview: this shows the generated prompt (best viewed as Markdown)
             return_model: the default returns the pydantic object for the classification and asks the language model for JSON
+            use_cache: use (and update) the classification cache - see `ClassificationCache`
         """
 
+        use_cache = use_cache and return_model and not preview
+        if use_cache and (cached := get_classification_cache().get(model, question)):
+            return cached
+
         from funkyprompt.services.models import language_model_client_from_context
         from funkyprompt.core.agents import LanguageModel, CallingContext
 
@@ -116,5 +275,8 @@ _(Use this entity model to construct a specific query classification for the mod
         data = lm_client(plan, context=CallingContext(prefer_json=return_model))
 
         if return_model:
-            return cls.model_validate_json(data)
+            classification = cls.model_validate_json(data)
+            if use_cache:
+                get_classification_cache().put(model, question, classification)
+            return classification
         return data
@@ -3,7 +3,6 @@ The runner can call the LLM in a loop and manage the stack of messages and funct
 """
 
 from funkyprompt.core import AbstractModel
-from funkyprompt.services.models import language_model_client_from_context
 from funkyprompt.core import utils
 from funkyprompt.core.agents import (
     CallingContext,
@@ -12,7 +11,6 @@ from funkyprompt.core.agents import (
 )
 import json 
 from funkyprompt.core import ConversationModel
-from funkyprompt.services import entity_store
 from . import MessageStack
 from . import FunctionCall, FunctionManager, Function
 import typing
@@ -221,6 +219,8 @@ class Runner:
     def run(self, question: str, context: CallingContext, limit: int = None):
         """Ask a question to kick of the agent loop"""
 
+        from funkyprompt.services.models import language_model_client_from_context
+
         """setup all the bits before running the loop"""
         lm_client: LanguageModel = language_model_client_from_context(context)
         self._context = context
@@ -284,6 +284,8 @@ class Runner:
             """dumpy state"""
             response = response.model_dump_json()
 
+        from funkyprompt.services import entity_store
+
         try:
             entity_store(ConversationModel).update_records(
                 ConversationModel(
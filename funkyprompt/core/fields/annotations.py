@@ -48,6 +48,16 @@ def OpenAIEmbeddingField():
     return partial(Field, embedding_provider="openai")
 
 
+def LocalEmbeddingField():
+    """text content that is embedded in process (hashed n-grams) - no api needed e.g. for tests and offline indexing"""
+    return partial(Field, embedding_provider="local")
+
+
+def EmbeddingField(provider: str):
+    """text content embedded with any provider in the embedding provider registry"""
+    return partial(Field, embedding_provider=provider)
+
+
 def CLIPEmbeddingField():
     """it is common to have text content or image content that can be embedded - clip will use system defaults"""
     return partial(Field, embedding_provider="clip")
@@ -63,6 +73,7 @@ By partially invoking we recover the doc string for the Fields that can be used
 """
 KeyField = KeyField()
 OpenAIEmbeddingField = OpenAIEmbeddingField()
+LocalEmbeddingField = LocalEmbeddingField()
 CLIPEmbeddingField = CLIPEmbeddingField()
 RelationshipField = RelationshipField()
 
@@ -14,7 +14,17 @@ This helps agents find things it would otherwise lose
 """
 
 import typing
+import weakref
+from funkyprompt.core.utils.env import GRAPH_UPSERT_BATCH_SIZE
 
+def _chunks(rows: list, batch_size: int = None):
+    batch_size = batch_size or GRAPH_UPSERT_BATCH_SIZE
+    for i in range(0, len(rows), batch_size):
+        yield rows[i : i + batch_size]
+
+
+"""helpers by model type - see `CypherHelper.for_model`"""
+_HELPERS: "weakref.WeakKeyDictionary[type, CypherHelper]" = weakref.WeakKeyDictionary()
 
 
 class CypherHelper:
@@ -27,6 +37,15 @@ class CypherHelper:
         from funkyprompt.core import AbstractEntity
 
         self.model: AbstractEntity = model
+        self.label = model.get_model_fullname().replace(".", "_")
+
+    @classmethod
+    def for_model(cls, model) -> "CypherHelper":
+        """the (shared) helper for the model type"""
+        helper = _HELPERS.get(model)
+        if helper is None:
+            helper = _HELPERS[model] = cls(model)
+        return helper
         
     @classmethod
     def query_path_n_from_node(cls, entity, n=1):
@@ -56,7 +75,7 @@ class CypherHelper:
 
     def create_script(self):
         """create the node - may well be a no-op but we register anyway"""
-        label = self.model.get_model_fullname().replace(".", "_")
+        label = self.label
         q = f"""
         """
         return None
@@ -67,90 +86,113 @@ class CypherHelper:
         """
         return None
     
-    def upsert_nodes_statement(self, nodes, label:str=None, has_full_entity:bool=False):
-        """
-        create a node upsert query - any attributes can be upserted
-        but labeled nodes are supposed to be unique by name
-        
+    def upsert_nodes_batches(
+        self, nodes, label: str = None, has_full_entity: bool = False, batch_size: int = None
+    ) -> typing.List[typing.Tuple[str, dict]]:
+        """create node upserts as (cypher, params) pairs with the nodes sent as a $rows parameter and merged with UNWIND
+        labeled nodes are supposed to be unique by name and labels cannot be parameters so there is one statement per label (and chunk)
+
         Args:
-            nodes: a list of entities 
-            label: its assumed the label is based on the model but can be anything
-            has_full_entity: a tracker to see if we are also adding the entity or just making a relationship to a node 
+            nodes: a list of entities or Nodes
+            label: its assumed the label is based on the model but nodes can have their own node_type
+            has_full_entity: a tracker to see if we are also adding the entity or just making a relationship to a node
+            batch_size: the nodes per statement (GRAPH_UPSERT_BATCH_SIZE by default)
         """
-
         if not isinstance(nodes, list):
             nodes = [nodes]
-
-        label = label or self.model.get_model_fullname().replace(".", "_")
-        
-        cypher_queries = []
-
-        i = 0
-        for i,n in enumerate(nodes):
-            """any nodes can be added for any time but often we do a batch based on the source model
-            see Edge and Node types to understand the interface for getting node_type
-            """
-            applied_label = getattr(n, 'node_type', label).replace('.','_')
-            """we may set some attributes like descriptions and stuff"""
-            cypher_queries.append(
-                f"""MERGE (n{i}:{applied_label} {{name: '{n.name}'}})
-                { self.get_graph_model_attribute_setter(n, alias=f"n{i}", has_full_entity=has_full_entity)  }
-               """
+        label = label or self.label
+        groups = {}
+        for n in nodes:
+            applied_label = getattr(n, "node_type", label).replace(".", "_")
+            groups.setdefault(applied_label, {})[n.name] = {"name": n.name}
+
+        setter = "SET n.entity = 1" if has_full_entity else ""
+        return [
+            (
+                f"""UNWIND $rows AS r
+                MERGE (n:{applied_label} {{name: r.name}})
+                {setter}
+                RETURN count(n)""",
+                {"rows": chunk},
             )
+            for applied_label, rows in groups.items()
+            for chunk in _chunks(list(rows.values()), batch_size)
+        ]
 
-        """for now block them up but we investigate a more efficient notation
-           we generally expect low cardinality upserts for entity types in practice
+    def upsert_edges_batches(self, edges, batch_size: int = None) -> typing.List[typing.Tuple[str, dict]]:
+        """create edge upserts as (cypher, params) pairs - one statement per (source label, edge type, target label, attributes) and chunk.
+        the node name is the key and attributes are upserted on the name of the edge
         """
-        if cypher_queries:
-            """fetch a sample"""
-            return "\n".join(cypher_queries) + f" RETURN n{i}"
+        from funkyprompt.core.utils.dates import utc_now
+
+        groups = {}
+        timestamp = utc_now().isoformat()
+        for e in edges or []:
+            attributes = e.attributes if isinstance(e.attributes, dict) and e.attributes else {"description": e.description}
+            key = (e.source_node.node_type, e.type, e.target_node.node_type, tuple(sorted(attributes)))
+            groups.setdefault(key, []).append(
+                {
+                    "source": e.source_node.name,
+                    "target": e.target_node.name,
+                    "edge_name": e.edge_name,
+                    "attributes": {**attributes, "timestamp": timestamp},
+                }
+            )
 
-    def upsert_edges_statement(self, edges):
-        """
-        create a batch upsert that returns the last one sample
+        statements = []
+        for (source, edge_type, target, keys), rows in groups.items():
+            assignments = ", ".join(f"e.{k} = r.attributes.{k}" for k in keys + ("timestamp",))
+            for chunk in _chunks(rows, batch_size):
+                statements.append(
+                    (
+                        f"""UNWIND $rows AS r
+                        MERGE (a:{source} {{name: r.source}})-[e:{edge_type} {{name: r.edge_name}}]->(b:{target} {{name: r.target}})
+                        SET {assignments}
+                        RETURN count(e)""",
+                        {"rows": chunk},
+                    )
+                )
+        return statements
+
+    @staticmethod
+    def path_rows(entities) -> typing.Dict[str, typing.List[dict]]:
+        """the tag paths a/b of the entities as rows {name, b, c} by entity label - duplicates removed.
+        a path without a category is tagged NONE
         """
-        if edges:
-           return "\n".join([e.make_edge_upsert_query_fragment(index=i) for i, e in enumerate(edges)]) + f" RETURN e{len(edges)-1}"
-       
-    def upsert_path_statements(self, entities, path_node:str="Resource"):
+        groups = {}
+        for e in entities or []:
+            for value in getattr(e, "graph_paths", None) or []:
+                parts = value.split("/")
+                if len(parts) == 1:
+                    parts.append("NONE")
+                label = e.get_model_fullname().replace(".", "_")
+                groups.setdefault(label, {})[(e.name, parts[0], parts[1])] = {
+                    "name": e.name,
+                    "b": parts[0],
+                    "c": parts[1],
+                }
+        return {label: list(rows.values()) for label, rows in groups.items()}
+
+    def upsert_path_batches(self, entities, batch_size: int = None) -> typing.List[typing.Tuple[str, dict]]:
+        """(cypher, params) pairs that merge the tag paths a/b of the entities as (entity)-[:TAG]->(a)-[:TAG]->(b).
+        the paths are sent as a $rows parameter and merged with UNWIND - one statement per entity label and chunk of `batch_size` paths
+        rather than a MERGE block per path. duplicate paths are only sent once
         """
-        The template for this is below, and we need it to batch, ensure no duplicate edges on paths
-                
-        
-        MERGE (a:NodeLabel {name: "NodeA"})
-        MERGE (b:NodeLabel {name: "NodeB"})
-        MERGE (c:NodeLabel {name: "NodeC"})
-        MERGE (a)-[:REL_TYPE]->(b)  
-        MERGE (b)-[:REL_TYPE]->(c)
+        return [
+            (
+                f"""UNWIND $rows AS r
+                MERGE (a:{label} {{name: r.name}})
+                MERGE (b {{name: r.b}})
+                MERGE (c {{name: r.c}})
+                MERGE (a)-[:TAG]->(b)
+                MERGE (b)-[:TAG]->(c)
+                RETURN count(a)""",
+                {"rows": chunk},
+            )
+            for label, rows in self.path_rows(entities).items()
+            for chunk in _chunks(rows, batch_size)
+        ]
 
-        """
-        
-        from funkyprompt.core.AbstractModel import Node, Edge
-        from funkyprompt.core import AbstractEntity
-        from funkyprompt.core.fields.annotations import AnnotationHelper
-        
-        """conventional experiment to add paths a/b/c/d"""
-        gpaths = []
-        for e  in entities:
-            #a = AnnotationHelper(e)
-            paths = getattr(e,'graph_paths', [])
-            if paths:
-                for value in paths:
-                    parts = value.split('/')
-                    if len(parts) == 1:
-                        parts.append('NONE')
-                    label = e.get_model_fullname().replace(".", "_")
-                    i = len(gpaths)
-                    template = f"""MERGE (a{i}:{label} {{name: "{e.name}"}})
-                    MERGE (b{i}{{name: "{parts[0]}"}})
-                    MERGE (c{i}{{name: "{parts[1]}"}})
-                    MERGE (a{i})-[:TAG]->(b{i})  
-                    MERGE (b{i})-[:TAG]->(c{i})
-                    """
-                    gpaths.append(template)
-                    
-        return "\n".join(gpaths)
-            
     def distinct_edges(self, entities: typing.List[typing.Any]):
         """
         uses the model annotation conventions to extract nodes related to item.
@@ -225,30 +267,23 @@ class CypherHelper:
     #         return "\n".join(paths)
     
         
-    def upsert_relationships_queries(self, entities):
+    def upsert_relationships_batches(self, entities, batch_size: int = None) -> typing.List[typing.Tuple[str, dict]]:
         """
         relationships register nodes that do not exist and add relationships between the source and target nodes
-        this is how we create graph bottoms and its ok for them to be not fully connected
+        this is how we create graph bottoms and its ok for them to be not fully connected.
+        the node batches come first so the edges can match their targets - run them with `PostgresService.execute_graph_batches`
         """
-        
+
         from funkyprompt.core.AbstractModel import Edge
-            
+
         """extract the nodes and the edges from the entities"""
-        
         edges: typing.List[Edge] = self.distinct_edges(entities)
         """get distinct nodes used in the relationships"""
-        new_nodes = list({e.target_node.key : e.target_node for e in edges}.values())        
-        edges_query = self.upsert_edges_statement(edges)
-        node_query = self.upsert_nodes_statement(new_nodes)
-        
-        """return both queries for execution"""
-        return node_query,edges_query
-        
-
+        new_nodes = list({e.target_node.key: e.target_node for e in edges}.values())
+        return self.upsert_nodes_batches(new_nodes, batch_size=batch_size) + self.upsert_edges_batches(
+            edges, batch_size=batch_size
+        )
 
-       
-        
-        
 
 class _GraphStatistics:
     """some helpers (WIP) - most of these are aspirational from neo4j that wed like to support"""
@@ -1,10 +1,17 @@
 from uuid import UUID
-from funkyprompt.core.types import EMBEDDING_LENGTH_OPEN_AI
 import typing
+import io
+import json
+import datetime
+import struct
 import psycopg2.extras
+import psycopg2.extensions
 import uuid
+import weakref
 from . import some_default_for_type
 from typing import get_type_hints
+from funkyprompt.core.utils.embeddings import get_provider, has_provider
+from funkyprompt.core.utils.env import EMBEDDINGS_INLINE
 from enum import Enum
 
 """special postgres attributes on pydantic fields
@@ -58,6 +65,165 @@ class VectorSearchOperator(Enum):
     COSINE = "<=>"
 
 
+class PgVector:
+    """wraps an embedding so it is bound as a pgvector value - plain lists would be adapted as postgres arrays.
+    the sync driver renders the vector once as a compact literal and the async driver sends it in pgvector's binary format
+    """
+
+    __slots__ = ("values",)
+
+    def __init__(self, values: typing.Iterable[float]):
+        self.values = values
+
+    def __len__(self):
+        return len(self.values)
+
+    def text(self) -> str:
+        """9 significant digits round trip the float32 values pgvector stores"""
+        return "[" + ",".join("%.9g" % v for v in self.values) + "]"
+
+    def binary(self) -> bytes:
+        """pgvector's binary (recv) format - dimensions, an unused flag and the big-endian float32 values"""
+        n = len(self.values)
+        return struct.pack(f">HH{n}f", n, 0, *self.values)
+
+
+psycopg2.extensions.register_adapter(
+    PgVector, lambda v: psycopg2.extensions.AsIs(f"'{v.text()}'::vector")
+)
+
+
+"""ANN indexes
+the index operator class must match the operator used in the search for the planner to use the index
+"""
+VECTOR_INDEX_OPS = {
+    VectorSearchOperator.INNER_PRODUCT: "vector_ip_ops",
+    VectorSearchOperator.L2: "vector_l2_ops",
+    VectorSearchOperator.COSINE: "vector_cosine_ops",
+    VectorSearchOperator.L1: "vector_l1_ops",
+}
+
+"""models can override any of these with e.g. `vector_index = {'method': 'ivfflat', 'lists': 1000}` on their Config.
+method is hnsw, ivfflat or None for no index - m and ef_construction are hnsw build parameters and lists is for ivfflat
+"""
+DEFAULT_VECTOR_INDEX = {
+    "method": "hnsw",
+    "operator": VectorSearchOperator.INNER_PRODUCT,
+    "m": 16,
+    "ef_construction": 64,
+    "lists": 100,
+    "quantization": None,
+    "rerank": 4,
+}
+
+"""Quantized indexes
+the index (and the candidate scan) can use a compressed vector - halfvec (16 bit floats, half the size) or binary (one bit per dimension, 1/32 the size).
+the full precision vectors are kept in the table and the top `rerank` x k candidates are re-ranked by their exact distance.
+set e.g. `vector_index = {'quantization': 'binary', 'rerank': 10}` on the model Config or a mode per field `{'quantization': {'description': 'halfvec'}}`
+- hnsw.ef_search should be at least the number of candidates
+"""
+QUANTIZED_INDEX_OPS = {
+    "halfvec": {
+        VectorSearchOperator.INNER_PRODUCT: "halfvec_ip_ops",
+        VectorSearchOperator.L2: "halfvec_l2_ops",
+        VectorSearchOperator.COSINE: "halfvec_cosine_ops",
+        VectorSearchOperator.L1: "halfvec_l1_ops",
+    },
+    "binary": {op: "bit_hamming_ops" for op in VectorSearchOperator},
+}
+
+
+"""Full text search
+a generated tsvector column over the text fields (by default the fields that we embed) with a GIN index
+models can choose the fields with e.g. `full_text_fields = ['name', 'description']` on their Config or [] for none
+"""
+FULL_TEXT_COLUMN = "search_tsv"
+FULL_TEXT_CONFIG = "english"
+
+
+"""COPY support
+psycopg2 has no binary COPY encoders for arrays, json and uuids so bulk loads use the csv format.
+Values are rendered the same way postgres would render them as text so COPY and INSERT paths store the same thing
+"""
+
+_ARRAY_SPECIAL_CHARS = set('{}",\\ \t\n\r')
+
+
+def _array_element(e) -> str:
+    """render an array element the way postgres array_out does - only quote when we need to"""
+    if e is None:
+        return "NULL"
+    if isinstance(e, (list, tuple)):
+        return pg_array_literal(e)
+    if isinstance(e, bool):
+        return "t" if e else "f"
+    if isinstance(e, dict):
+        e = json.dumps(e)
+    e = str(e)
+    if e == "" or e.upper() == "NULL" or any(ch in _ARRAY_SPECIAL_CHARS for ch in e):
+        return '"' + e.replace("\\", "\\\\").replace('"', '\\"') + '"'
+    return e
+
+
+def pg_array_literal(items: typing.Iterable) -> str:
+    """a postgres array literal e.g. ['a', 'b c'] -> {a,"b c"}"""
+    return "{" + ",".join(_array_element(e) for e in items) + "}"
+
+
+def copy_csv_value(v) -> str:
+    """render a python value for COPY ... (FORMAT csv) where the unquoted empty string is NULL and everything else is quoted"""
+    if v is None:
+        return ""
+    if isinstance(v, bool):
+        v = "true" if v else "false"
+    elif isinstance(v, (list, tuple)):
+        v = pg_array_literal(v)
+    elif isinstance(v, dict):
+        v = json.dumps(v)
+    elif isinstance(v, (datetime.date, datetime.datetime)):
+        v = v.isoformat()
+    else:
+        v = str(v)
+    return '"' + v.replace('"', '""') + '"'
+
+
+def copy_csv_row(values: typing.Iterable) -> str:
+    """a line of csv for COPY"""
+    return ",".join(copy_csv_value(v) for v in values) + "\n"
+
+
+class CopyStream(io.TextIOBase):
+    """a file-like object that renders csv lines lazily for `cursor.copy_expert`
+    so we never hold the full payload in memory on top of the records
+    """
+
+    def __init__(self, lines: typing.Iterable[str]):
+        self._lines = iter(lines)
+        self._buffer = ""
+
+    def readable(self):
+        return True
+
+    def read(self, size: int = -1) -> str:
+        chunks, length = [self._buffer], len(self._buffer)
+        while size is None or size < 0 or length < size:
+            line = next(self._lines, None)
+            if line is None:
+                break
+            chunks.append(line)
+            length += len(line)
+        data = "".join(chunks)
+        if size is None or size < 0:
+            self._buffer = ""
+            return data
+        self._buffer = data[size:]
+        return data[:size]
+
+
+"""compiled helpers by model type - see `SqlHelper.for_model`"""
+_COMPILED: "weakref.WeakKeyDictionary[type, SqlHelper]" = weakref.WeakKeyDictionary()
+
+
 class SqlHelper:
 
     def __init__(cls, model):
@@ -66,9 +232,272 @@ class SqlHelper:
         cls.model: AbstractModel = model
         cls.table_name = cls.model.get_model_fullname()
         cls.field_names = SqlHelper.select_fields(model)
+        cls.field_set = frozenset(cls.field_names)
+        cls.select_list = ",".join(cls.field_names)
         cls.id_field = cls.model.get_model_key_field() or "id"
         cls.embedding_fields = list(cls.model.get_embedding_fields().values())
+        """the source field for each embedding column e.g. description_embedding -> description"""
+        cls.embedding_sources = {v: k for k, v in cls.model.get_embedding_fields().items()}
+        inline = getattr(getattr(model, "Config", None), "embeddings_inline", None)
+        cls.embeddings_inline = EMBEDDINGS_INLINE if inline is None else inline
+        """the side table layout - one row per record and embedded field and a view that looks like the inline table"""
+        cls.embedding_table_name = f"{cls.table_name}_embeddings"
+        cls.embedding_view_name = f"{cls.table_name}_with_embeddings"
+        """upserts return the key and the sources of the embeddings i.e. what embedding the result needs but not the vectors"""
+        cls.upsert_returning = cls.returning_columns(
+            [cls.id_field] + [f for f in cls.model.get_embedding_fields() if f in cls.field_set]
+        )
         cls.metadata = {}
+        """the model fields we compiled from - a rebuilt model has new fields and gets a new helper"""
+        cls._compiled_from = getattr(model, "model_fields", None)
+        cls._dummies: dict = None
+        cls._queries: typing.Dict[tuple, str] = {}
+
+    def returning_columns(cls, returning: str | typing.List[str] = None) -> str:
+        """the RETURNING projection - columns or a list of columns, * for everything (including vectors) or by default the narrow `upsert_returning`"""
+        if returning is None:
+            return cls.upsert_returning
+        if isinstance(returning, (list, tuple)):
+            return ", ".join(dict.fromkeys(returning))
+        return returning
+
+    @classmethod
+    def for_model(cls, model) -> "SqlHelper":
+        """the helper for the model type - compiled once (field lists, dummy row and generated queries) and reused by every caller.
+        helpers are shared so treat them as read only
+        """
+        helper = _COMPILED.get(model)
+        if helper is None or helper._compiled_from is not getattr(model, "model_fields", None):
+            helper = cls(model)
+            _COMPILED[model] = helper
+        return helper
+
+    @staticmethod
+    def clear_compiled(model=None):
+        """drop the compiled helper for one model type or for all of them"""
+        if model is None:
+            _COMPILED.clear()
+        else:
+            _COMPILED.pop(model, None)
+
+    @property
+    def vector_index(cls) -> dict:
+        """the ann index config for the embedding columns from the model Config (merged with the defaults)"""
+        config = dict(DEFAULT_VECTOR_INDEX)
+        config.update(getattr(getattr(cls.model, "Config", None), "vector_index", None) or {})
+        if isinstance(config["operator"], str):
+            config["operator"] = VectorSearchOperator[config["operator"].upper()]
+        return config
+
+    def quantization(cls, field: str = None, quantization: str = None) -> typing.Optional[str]:
+        """the compressed representation searched for the embedding column - None for full precision, halfvec or binary.
+        the model config can set one mode for all fields or a mode per (source) field e.g. `{'quantization': {'description': 'binary'}}`
+        an explicit `quantization` (none for full precision) overrides the config
+        """
+        field = field or cls.embedding_fields[0]
+        if quantization is None:
+            quantization = cls.vector_index.get("quantization")
+            if isinstance(quantization, dict):
+                quantization = quantization.get(cls.embedding_sources.get(field, field))
+        if quantization in (None, "none", "full"):
+            return None
+        if quantization not in QUANTIZED_INDEX_OPS:
+            raise ValueError(f"Unknown quantization {quantization} - use halfvec, binary or none")
+        return quantization
+
+    def quantized_expression(cls, expression: str, field: str = None, quantization: str = None) -> str:
+        """the compressed form of a vector expression (a column or a parameter) - the same expression is indexed and searched"""
+        quantization = cls.quantization(field, quantization)
+        dimensions = cls.embedding_dimensions(field or cls.embedding_fields[0])
+        if quantization == "halfvec":
+            return f"({expression})::halfvec({dimensions})"
+        if quantization == "binary":
+            return f"binary_quantize({expression})::bit({dimensions})"
+        return expression
+
+    def vector_index_scripts(cls, concurrently: bool = True, quantization: str = None) -> typing.List[str]:
+        """one index per embedding column - concurrent builds do not block writes but cannot run in a transaction
+        quantized indexes are expression indexes on the compressed vector - the full precision vectors are kept for re-ranking
+        """
+        config = cls.vector_index
+        method = config["method"]
+        if not method:
+            return []
+        if method == "hnsw":
+            params = f"m = {config['m']}, ef_construction = {config['ef_construction']}"
+        elif method == "ivfflat":
+            params = f"lists = {config['lists']}"
+        else:
+            raise ValueError(f"Unknown vector index method {method} - use hnsw or ivfflat")
+
+        concurrently = "CONCURRENTLY " if concurrently else ""
+        scripts = []
+        for field in cls.embedding_fields:
+            mode = cls.quantization(field, quantization)
+            ops = QUANTIZED_INDEX_OPS[mode][config["operator"]] if mode else VECTOR_INDEX_OPS[config["operator"]]
+            name = cls.vector_index_name(field, quantization).split(".")[-1]
+            expression = cls.quantized_expression(cls.embedding_expression(field), field, mode or "none")
+            if cls.embeddings_inline:
+                """a plain column index or an expression index on the compressed column"""
+                expression = f"({expression})" if mode else expression
+                scripts.append(
+                    f"""CREATE INDEX {concurrently}IF NOT EXISTS {name}
+                ON {cls.table_name} USING {method} ({expression} {ops}) WITH ({params});"""
+                )
+            elif cls.embedding_dimensions(field):
+                """the embedding table holds fields of different sizes so each field has a partial index on the sized vector"""
+                scripts.append(
+                    f"""CREATE INDEX {concurrently}IF NOT EXISTS {name}
+            ON {cls.embedding_table_name} USING {method} (({expression}) {ops}) WITH ({params})
+            WHERE field = '{cls.embedding_sources[field]}';"""
+                )
+        return scripts
+
+    def vector_index_name(cls, field: str = None, quantization: str = None) -> str:
+        """the (schema qualified) name of the ann index for the embedding column and quantization"""
+        field = field or cls.embedding_fields[0]
+        mode = cls.quantization(field, quantization)
+        suffix = f"{mode}_{cls.vector_index['method']}" if mode else cls.vector_index["method"]
+        schema = cls.table_name.split(".")[0]
+        if cls.embeddings_inline:
+            return f"{schema}.{cls.table_name.replace('.', '_')}_{field}_{suffix}_idx"
+        return f"{schema}.{cls.embedding_table_name.replace('.', '_')}_{cls.embedding_sources[field]}_{suffix}_idx"
+
+    def embedding_dimensions(cls, field: str) -> typing.Optional[int]:
+        """the vector size of the embedding column from the provider of its source field"""
+        provider = cls.model.get_embedding_providers().get(cls.embedding_sources.get(field))
+        if provider and has_provider(provider):
+            return get_provider(provider).dimensions
+
+    def embedding_expression(cls, field: str = None, alias: str = None) -> str:
+        """the expression for an embedding column in the searched table - the side table vector is cast to its size to match the field index"""
+        field = field or cls.embedding_fields[0]
+        alias = f"{alias}." if alias else ""
+        if cls.embeddings_inline:
+            return f"{alias}{field}"
+        return f"{alias}embedding::vector({cls.embedding_dimensions(field)})"
+
+    def nearest_query(
+        cls,
+        vector: str,
+        search_operator: VectorSearchOperator = None,
+        limit: int | str = "%(limit)s",
+        fields: typing.List[str] = None,
+        field: str = None,
+        quantization: str = None,
+    ) -> str:
+        """the top k records nearest to the vector (a parameter or a column reference) with their `distances` - the inner query of the vector searches.
+        in the side table layout the embedding table is searched and joined to the narrow entity table.
+        with a quantized index the candidates (k times the `rerank` factor) are found with the compressed vectors and re-ranked by the full precision distance
+        """
+        search_operator = search_operator or cls.vector_index["operator"]
+        field = field or cls.embedding_fields[0]
+        fields = fields or cls.field_names
+        alias = "t" if cls.embeddings_inline else "e"
+        embedding = cls.embedding_expression(field, alias)
+        source = f"FROM {cls.table_name} t"
+        if not cls.embeddings_inline:
+            source = f"""FROM {cls.embedding_table_name} e JOIN {cls.table_name} t ON t.{cls.id_field} = e.{cls.id_field}
+                WHERE e.field = '{cls.embedding_sources[field]}'"""
+
+        mode = cls.quantization(field, quantization)
+        if not mode:
+            return f"""SELECT {",".join(f"t.{f}" for f in fields)},
+                ({embedding} {search_operator.value} {vector}) AS distances
+                {source}
+                ORDER BY distances ASC LIMIT {limit}"""
+
+        """the compressed search operator - binary vectors are compared by hamming distance"""
+        operator = "<~>" if mode == "binary" else search_operator.value
+        return f"""SELECT {",".join(f"c.{f}" for f in fields)},
+                (c._embedding {search_operator.value} {vector}) AS distances FROM (
+                SELECT {",".join(f"t.{f}" for f in fields)}, {embedding} AS _embedding
+                {source}
+                ORDER BY {cls.quantized_expression(embedding, field, mode)} {operator} {cls.quantized_expression(vector, field, mode)}
+                LIMIT {limit} * {int(cls.vector_index['rerank'])}
+            ) c ORDER BY distances ASC LIMIT {limit}"""
+
+    @property
+    def full_text_fields(cls) -> typing.List[str]:
+        """the fields that are indexed for lexical search"""
+        fields = getattr(getattr(cls.model, "Config", None), "full_text_fields", None)
+        if fields is None:
+            fields = list(cls.model.get_embedding_fields())
+        return fields
+
+    def full_text_column_definition(cls) -> str:
+        """the generated column - weighted so that matches in earlier fields rank higher"""
+        weights = "ABCD"
+        parts = [
+            f"setweight(to_tsvector('{FULL_TEXT_CONFIG}', coalesce({f}::text, '')), '{weights[min(i, 3)]}')"
+            for i, f in enumerate(cls.full_text_fields)
+        ]
+        return f"{FULL_TEXT_COLUMN} tsvector GENERATED ALWAYS AS ({' || '.join(parts)}) STORED"
+
+    def full_text_index_script(cls, add_column: bool = False) -> str:
+        """the GIN index for the generated column - optionally adding the column to an existing table"""
+        if not cls.full_text_fields:
+            return ""
+        script = ""
+        if add_column:
+            script = f"ALTER TABLE {cls.table_name} ADD COLUMN IF NOT EXISTS {cls.full_text_column_definition()};\n"
+        return (
+            script
+            + f"CREATE INDEX IF NOT EXISTS {cls.table_name.replace('.', '_')}_{FULL_TEXT_COLUMN}_idx ON {cls.table_name} USING GIN ({FULL_TEXT_COLUMN});"
+        )
+
+    def hybrid_search_query(
+        cls,
+        search_operator: VectorSearchOperator = None,
+        vector: bool = True,
+        lexical: bool = True,
+    ) -> str:
+        """one query that ranks the nearest vectors and the best lexical matches (websearch syntax) and fuses the two
+        rankings with reciprocal rank fusion - score = sum(1 / (rrf_k + rank)) over the rankings a record appears in.
+        params are vec, question, candidates (per ranking), rrf_k and limit
+        """
+        id_field = cls.id_field
+        rankings = []
+        if vector and cls.embedding_fields:
+            search_operator = search_operator or cls.vector_index["operator"]
+            rankings.append(
+                f"""SELECT {id_field}, row_number() OVER (ORDER BY distances) AS rank FROM (
+                {cls.nearest_query('%(vec)s', search_operator, limit='%(candidates)s', fields=[id_field])}
+            ) v"""
+            )
+        if lexical and cls.full_text_fields:
+            rankings.append(
+                f"""SELECT {id_field}, row_number() OVER (ORDER BY lexical_rank DESC) AS rank FROM (
+                SELECT {id_field}, ts_rank_cd({FULL_TEXT_COLUMN}, q) AS lexical_rank
+                FROM {cls.table_name}, websearch_to_tsquery('{FULL_TEXT_CONFIG}', %(question)s) q
+                WHERE {FULL_TEXT_COLUMN} @@ q ORDER BY lexical_rank DESC LIMIT %(candidates)s
+            ) l"""
+            )
+        if not rankings:
+            raise ValueError(
+                f"{cls.table_name} has neither embedding nor full text fields to search"
+            )
+        rankings = "\n            UNION ALL\n            ".join(rankings)
+        select_fields = ",".join(f"t.{f}" for f in cls.field_names)
+        return f"""WITH rankings AS (
+            {rankings}
+        ), fused AS (
+            SELECT {id_field}, sum(1.0 / (%(rrf_k)s + rank)) AS hybrid_score, count(*) AS matched_rankings
+            FROM rankings GROUP BY {id_field}
+        )
+        SELECT {select_fields}, fused.hybrid_score, fused.matched_rankings
+        FROM fused JOIN {cls.table_name} t ON t.{id_field} = fused.{id_field}
+        ORDER BY fused.hybrid_score DESC LIMIT %(limit)s"""
+
+    @staticmethod
+    def vector_search_settings(ef_search: int = None, probes: int = None) -> str:
+        """per query index tuning - more candidates trades latency for recall. SET LOCAL only lasts for the transaction"""
+        settings = ""
+        if ef_search:
+            settings += f"SET LOCAL hnsw.ef_search = {int(ef_search)};"
+        if probes:
+            settings += f"SET LOCAL ivfflat.probes = {int(probes)};"
+        return settings
 
     @classmethod
     def select_fields(cls, model):
@@ -87,15 +516,18 @@ class SqlHelper:
     def select_fields_with_dummies(cls):
         """selects the database fields but uses dummy values. this is to allow for some upsert modes (small hack/trick)"""
 
-        fields = cls.select_fields(cls.model)
-        model_fields = get_type_hints(cls.model)
+        if cls._dummies is None:
+            """the template is computed once - the type hints are expensive to resolve per row"""
+            model_fields = get_type_hints(cls.model)
+
+            def dummy_value(field_name):
+                ftype = model_fields[field_name] 
 
-        def dummy_value(field_name):
-            ftype = model_fields[field_name] 
+                return some_default_for_type(ftype)
 
-            return some_default_for_type(ftype)
+            cls._dummies = {f: dummy_value(f) for f in cls.field_names}
 
-        return {f: dummy_value(f) for f in fields}
+        return dict(cls._dummies)
 
     def partial_model_tuple(cls, data: dict) -> tuple:
         """
@@ -135,7 +567,6 @@ class SqlHelper:
         
         """im not sure what i need to do this yet"""
         d = {}
-        import json
         for k,v in data.items():
             if hasattr(v,'model_dump'):
               v = v.model_dump()
@@ -162,22 +593,95 @@ class SqlHelper:
 
         return type_mapping.get(t, "TEXT")
 
-    @classmethod
-    def _create_embedding_table_script(cls, entity_model, existing_columns=None):
-        """for a separate embedding table
-        if we have the connection we can check for a diff and create an alter statement, otherwise we must to the update
+    def _column_type(cls, field_type) -> str:
+        """the postgres type for a field type hint"""
+        if typing.get_origin(field_type) is typing.Union and UUID in typing.get_args(
+            field_type
+        ):
+            return "UUID"
+        return SqlHelper.pydantic_to_postgres_type(field_type)
+
+    def _create_embedding_table_script(cls, existing_columns=None):
+        """for a separate embedding table - one row per record and embedded field keyed by (id, field)
+        the vector is not sized so that fields embedded by different providers can share the table - see `vector_index_scripts`
         we do not remove columns, but we can add
         """
-        pass
+        if not cls.embedding_fields:
+            return ""
+        id_type = cls._column_type(typing.get_type_hints(cls.model)[cls.id_field])
+        return f"""
+        CREATE TABLE IF NOT EXISTS {cls.embedding_table_name} (
+            {cls.id_field} {id_type} NOT NULL REFERENCES {cls.table_name} ({cls.id_field}) ON DELETE CASCADE,
+            field VARCHAR NOT NULL,
+            embedding vector NOT NULL,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY ({cls.id_field}, field)
+        );
+        """
 
-    @classmethod
-    def _create_view_script(cls, entity_model):
+    def _create_view_script(cls):
         """
         create or alter the view to select all columns from the join possibly with system columns
+        the view has the shape of the inline layout i.e. a {field}_embedding column per embedded field
+        """
+        if not cls.embedding_fields:
+            return ""
+        columns, joins = [], []
+        for i, field in enumerate(cls.embedding_fields):
+            columns.append(f"e{i}.embedding AS {field}")
+            joins.append(
+                f"LEFT JOIN {cls.embedding_table_name} e{i} ON e{i}.{cls.id_field} = t.{cls.id_field} AND e{i}.field = '{cls.embedding_sources[field]}'"
+            )
+        joins = "\n        ".join(joins)
+        return f"""
+        CREATE OR REPLACE VIEW {cls.embedding_view_name} AS
+        SELECT t.*, {", ".join(columns)}
+        FROM {cls.table_name} t
+        {joins};
         """
-        pass
 
-    def create_script(cls, embeddings_inline: bool = True, connection=None):
+    def embedding_table_migration_script(cls) -> str:
+        """move inline embeddings to the side table layout - the inline columns are dropped so the view can take their names"""
+        copies = "".join(
+            f"""
+        INSERT INTO {cls.embedding_table_name} ({cls.id_field}, field, embedding)
+        SELECT {cls.id_field}, '{cls.embedding_sources[field]}', {field} FROM {cls.table_name} WHERE {field} IS NOT NULL
+        ON CONFLICT DO NOTHING;
+        ALTER TABLE {cls.table_name} DROP COLUMN IF EXISTS {field};"""
+            for field in cls.embedding_fields
+        )
+        return cls._create_embedding_table_script() + copies + cls._create_view_script()
+
+    def embedding_table_upsert_query(cls, row_placeholders: bool = False, returning: str = None) -> str:
+        """write (id, field, vector) rows to the embedding table - see `embedding_table_rows`"""
+        values = "(%s, %s, %s)" if row_placeholders else "%s"
+        return f"""INSERT INTO {cls.embedding_table_name} ({cls.id_field}, field, embedding)
+        VALUES {values}
+        ON CONFLICT ({cls.id_field}, field) DO UPDATE
+        SET embedding = EXCLUDED.embedding, updated_at = CURRENT_TIMESTAMP
+        RETURNING {returning or cls.id_field};"""
+
+    def embedding_table_rows(cls, embedded: typing.List[dict]) -> typing.List[tuple]:
+        """(id, field, vector) rows for the embedding table from embedded records (see `embed_frame`)"""
+        return [
+            (r[cls.id_field], cls.embedding_sources[field], PgVector(r[field]))
+            for r in embedded
+            for field in cls.embedding_fields
+            if r.get(field) is not None
+        ]
+
+    def embedding_update(
+        cls, embedded: typing.List[dict], row_placeholders: bool = False
+    ) -> typing.Tuple[str, typing.List[tuple]]:
+        """the query and rows that write embedded records - to the inline columns or to the embedding table"""
+        if cls.embeddings_inline:
+            query = cls.embedding_fields_partial_update_query(
+                batch_size=len(embedded), row_placeholders=row_placeholders
+            )
+            return query, [cls.partial_model_tuple(e) for e in embedded]
+        return cls.embedding_table_upsert_query(row_placeholders), cls.embedding_table_rows(embedded)
+
+    def create_script(cls, embeddings_inline: bool = None, connection=None):
         """
 
         (WIP) generate tables for entities -> short term we do a single table with now schema management
@@ -195,6 +699,8 @@ class SqlHelper:
 
         """
         entity_model = cls.model
+        if embeddings_inline is None:
+            embeddings_inline = cls.embeddings_inline
 
         def is_optional(field):
             return typing.get_origin(field) is typing.Union and type(
@@ -213,12 +719,7 @@ class SqlHelper:
         columns = []
         for field_name, field_type in fields.items():
             """handle uuid option"""
-            if typing.get_origin(
-                field_type
-            ) is typing.Union and UUID in typing.get_args(field_type):
-                postgres_type = "UUID"
-            else:
-                postgres_type = SqlHelper.pydantic_to_postgres_type(field_type)
+            postgres_type = cls._column_type(field_type)
 
             field_desc = field_descriptions[field_name]
             column_definition = f"{field_name} {postgres_type}"
@@ -234,14 +735,19 @@ class SqlHelper:
             """check should add embedding vector for any columns"""
             metadata = field_descriptions.get(field_name)
             extras = getattr(metadata, "json_schema_extra", {}) or {}
-            if extras.get("embedding_provider", "").replace("_", "") == "openai":
-                columns.append(
-                    f"{field_name}_embedding vector({EMBEDDING_LENGTH_OPEN_AI}) NULL"
-                )
+            if embeddings_inline and extras.get("embedding_provider") and has_provider(
+                extras["embedding_provider"]
+            ):
+                """the vector size is determined by the provider in the registry"""
+                dimensions = get_provider(extras["embedding_provider"]).dimensions
+                columns.append(f"{field_name}_embedding vector({dimensions}) NULL")
 
             """add system fields - created at and updated at fields"""
             # TODO
 
+        if cls.full_text_fields:
+            columns.append(cls.full_text_column_definition())
+
         """add system fields"""
         columns.append("created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP")
         columns.append("updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP")
@@ -258,14 +764,19 @@ class SqlHelper:
         FOR EACH ROW
         EXECUTE FUNCTION update_updated_at_column();
 
+        {cls.full_text_index_script()}
         """
+        if not embeddings_inline:
+            """the narrow entity table plus the embedding table and the view joining them"""
+            create_table_script += cls._create_embedding_table_script() + cls._create_view_script()
         return create_table_script
 
     def upsert_query(
         cls,
         batch_size: int,
-        returning="*",  # ID, * etc.
+        returning: str | typing.List[str] = None,  # ID, * etc. - defaults to upsert_returning
         restricted_update_fields: str = None,
+        row_placeholders: bool = False,
         # records: typing.List[typing.Any],
         # TODO return * or just id for performance
     ):
@@ -294,8 +805,20 @@ class SqlHelper:
         if restricted_update_fields is not None and not len(restricted_update_fields):
             raise ValueError('You provided an empty list of restricted field')
 
-        """TODO: the return can be efficient * for example pulls back embeddings which is almost never what you want"""
-        field_list = cls.field_names
+        returning = cls.returning_columns(returning)
+
+        """the statement does not depend on the batch size so it is generated once per shape"""
+        key = (
+            "upsert",
+            returning,
+            tuple(restricted_update_fields) if restricted_update_fields is not None else None,
+            row_placeholders,
+        )
+        if key in cls._queries:
+            return cls._queries[key]
+
+        """copy - the helper is shared and the field names must not grow"""
+        field_list = list(cls.field_names)
         """conventionally add in order anything that is added in upsert and missing"""
         for c in restricted_update_fields or []:
             if c not in field_list:
@@ -303,7 +826,6 @@ class SqlHelper:
 
         non_id_fields = [f for f in field_list if f != cls.id_field]
         insert_columns = ", ".join(field_list)
-        insert_values = ", ".join([f"%({field})s" for field in field_list])
 
         """restricted updated fields are powerful for updates 
            we can ignore the other columns in the inserts and added place holder values in the update
@@ -315,12 +837,11 @@ class SqlHelper:
             ]
         )
 
-        value_placeholders = ", ".join(
-            [f"({insert_values})" for _ in range(batch_size)]
-        )
-
-        # ^old school way but for psycopg2.extras.execute_values below is good
+        """psycopg2.extras.execute_values expands the single placeholder into the batch"""
         value_placeholders = "%s"
+        if row_placeholders:
+            """drivers without execute_values (e.g. async psycopg) run the statement once per row"""
+            value_placeholders = f"({', '.join(['%s' for _ in field_list])})"
 
         """batch insert with conflict - prefix with a delete statement that sets items to deleted"""
         upsert_statement = f"""
@@ -332,10 +853,36 @@ class SqlHelper:
         RETURNING {returning};
         """
 
-        return upsert_statement.strip()
+        cls._queries[key] = upsert_statement.strip()
+        return cls._queries[key]
+
+    def copy_staging_script(cls, staging_table: str) -> str:
+        """a temp table shaped like the model table for bulk (COPY) loads.
+        the ordinal records the load order so we can keep the last write when a key appears more than once
+        """
+        return f"""CREATE TEMP TABLE {staging_table} (LIKE {cls.table_name} INCLUDING DEFAULTS) ON COMMIT DROP;
+        ALTER TABLE {staging_table} ADD COLUMN _funky_ordinal BIGSERIAL;"""
+
+    def copy_query(cls, staging_table: str) -> str:
+        """stream csv rows (see `copy_csv_row`) into the staging table"""
+        return f"""COPY {staging_table} ({", ".join(cls.field_names)}) FROM STDIN WITH (FORMAT csv)"""
+
+    def merge_from_staging_query(cls, staging_table: str, returning: str | typing.List[str] = None) -> str:
+        """a single upsert from the staging table into the model table - this pairs with `copy_query`"""
+        returning = cls.returning_columns(returning)
+        columns = ", ".join(cls.field_names)
+        update_set = ", ".join(
+            [f"{field} = EXCLUDED.{field}" for field in cls.field_names if field != cls.id_field]
+        )
+        return f"""INSERT INTO {cls.table_name} ({columns})
+        SELECT DISTINCT ON ({cls.id_field}) {columns} FROM {staging_table}
+        ORDER BY {cls.id_field}, _funky_ordinal DESC
+        ON CONFLICT ({cls.id_field}) DO UPDATE
+        SET {update_set}
+        RETURNING {returning};"""
 
     def embedding_fields_partial_update_query(
-        cls, batch_size: int, returning: str = "*"
+        cls, batch_size: int, returning: str | typing.List[str] = None, row_placeholders: bool = False
     ):
         """for now using a convention but this should be determined from the model
         we have added a convention on the restricted fields for now to reuse the partial update
@@ -345,14 +892,23 @@ class SqlHelper:
         we build this into the SQL adapters and postgres client
         """
 
-        """notice we apply a convention for embedding fields"""
+        """notice we apply a convention for embedding fields
+        only the key comes back by default - returning the vectors we just sent would be the bulk of the payload
+        """
         return cls.partial_update_query(
             field_names=[f for f in cls.embedding_fields],
             batch_size=batch_size,
-            returning=returning,
+            returning=returning or cls.id_field,
+            row_placeholders=row_placeholders,
         )
 
-    def partial_update_query(cls, field_names, batch_size: int, returning: str = "*"):
+    def partial_update_query(
+        cls,
+        field_names,
+        batch_size: int,
+        returning: str | typing.List[str] = None,
+        row_placeholders: bool = False,
+    ):
         """
         this is just a slight mod on the other one - we could refactor to just have a field restriction
         """
@@ -361,6 +917,7 @@ class SqlHelper:
             batch_size=batch_size,
             returning=returning,
             restricted_update_fields=field_names,
+            row_placeholders=row_placeholders,
         )
 
     def query_from_natural_language(
@@ -1,24 +1,594 @@
+import os
+import time
 import typing
+import sqlite3
+import hashlib
+import threading
+from array import array
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from funkyprompt.core.utils import logger
 
 DEFAULT_EMBEDDING_MODEL = "text-embedding-ada-002"
 
 
-def embed_collection(c: typing.List[str], provider="open_ai"):
-    """get an embedding using the default embedding model"""
-    from openai import OpenAI
+"""
+Embedding cache
+embeddings are content addressed by (provider, model, sha256(text)) so re-ingesting unchanged text costs nothing.
+there is an in-memory LRU in front of a persistent store which is either a local sqlite file or a postgres table
+"""
 
-    r = OpenAI().embeddings.create(input=c, model=DEFAULT_EMBEDDING_MODEL)
-    return [e.embedding for e in r.data]
+
+def _pack(vector: typing.List[float]) -> bytes:
+    return array("f", vector).tobytes()
+
+
+def _unpack(data: bytes) -> typing.List[float]:
+    a = array("f")
+    a.frombytes(data)
+    return a.tolist()
+
+
+class SqliteEmbeddingStore:
+    """a local file store for cached embeddings (float32)"""
+
+    def __init__(self, path: str):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, embedding BLOB NOT NULL)"
+        )
+        self._conn.commit()
+
+    def get_many(self, keys: typing.List[str]) -> typing.Dict[str, typing.List[float]]:
+        found = {}
+        with self._lock:
+            """keep under the sqlite variable limit"""
+            for i in range(0, len(keys), 500):
+                chunk = keys[i : i + 500]
+                rows = self._conn.execute(
+                    f"SELECT key, embedding FROM embeddings WHERE key IN ({','.join('?' * len(chunk))})",
+                    chunk,
+                ).fetchall()
+                found.update({k: _unpack(v) for k, v in rows})
+        return found
+
+    def put_many(self, items: typing.Dict[str, typing.List[float]]):
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, embedding) VALUES (?, ?)",
+                [(k, _pack(v)) for k, v in items.items()],
+            )
+            self._conn.commit()
+
+
+class PostgresEmbeddingStore:
+    """a shared store for cached embeddings so that all workers benefit - uses the pooled connections"""
+
+    def __init__(self, table_name: str = "core.embedding_cache"):
+        self.table_name = table_name
+        self._created = False
+
+    def _ensure_table(self, conn):
+        if not self._created:
+            c = conn.cursor()
+            c.execute(
+                f"""CREATE TABLE IF NOT EXISTS {self.table_name} (
+                    key VARCHAR PRIMARY KEY,
+                    embedding REAL[] NOT NULL,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )"""
+            )
+            conn.commit()
+            self._created = True
+
+    def get_many(self, keys: typing.List[str]) -> typing.Dict[str, typing.List[float]]:
+        from funkyprompt.services.data.pool import get_pool
+
+        with get_pool().connection() as conn:
+            self._ensure_table(conn)
+            c = conn.cursor()
+            c.execute(
+                f"SELECT key, embedding FROM {self.table_name} WHERE key = ANY(%s)",
+                (keys,),
+            )
+            found = dict(c.fetchall())
+            conn.commit()
+        return found
+
+    def put_many(self, items: typing.Dict[str, typing.List[float]]):
+        import psycopg2.extras
+        from funkyprompt.services.data.pool import get_pool
+
+        with get_pool().connection() as conn:
+            self._ensure_table(conn)
+            psycopg2.extras.execute_values(
+                conn.cursor(),
+                f"INSERT INTO {self.table_name} (key, embedding) VALUES %s ON CONFLICT (key) DO NOTHING",
+                list(items.items()),
+            )
+            conn.commit()
+
+
+class EmbeddingCache:
+    """a content addressed embedding cache - an in-memory LRU in front of an optional persistent store
+
+    Examples:
+
+        ```python
+        cache = EmbeddingCache(store=SqliteEmbeddingStore('/tmp/embeddings.db'))
+        vectors = cache.embed(texts, provider='openai', model=DEFAULT_EMBEDDING_MODEL, embed_fn=my_embedder)
+        cache.stats()
+        ```
+    """
+
+    def __init__(self, store=None, max_memory_items: int = 50000):
+        self.store = store
+        self.max_memory_items = max_memory_items
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._counters = {"hits": 0, "misses": 0}
+
+    @staticmethod
+    def key(provider: str, model: str, text: str) -> str:
+        return f"{provider}:{model}:{hashlib.sha256(text.encode('utf-8')).hexdigest()}"
+
+    def _remember(self, items: typing.Dict[str, typing.List[float]]):
+        with self._lock:
+            for k, v in items.items():
+                self._memory[k] = v
+                self._memory.move_to_end(k)
+            while len(self._memory) > self.max_memory_items:
+                self._memory.popitem(last=False)
+
+    def get_many(self, keys: typing.List[str]) -> typing.Dict[str, typing.List[float]]:
+        found = {}
+        with self._lock:
+            for k in keys:
+                if k in self._memory:
+                    self._memory.move_to_end(k)
+                    found[k] = self._memory[k]
+        missing = [k for k in keys if k not in found]
+        if missing and self.store is not None:
+            stored = self.store.get_many(missing)
+            self._remember(stored)
+            found.update(stored)
+        return found
+
+    def put_many(self, items: typing.Dict[str, typing.List[float]]):
+        self._remember(items)
+        if self.store is not None and items:
+            self.store.put_many(items)
+
+    def embed(
+        self,
+        texts: typing.List[str],
+        provider: str,
+        model: str,
+        embed_fn: typing.Callable[[typing.List[str]], typing.List[typing.List[float]]],
+    ) -> typing.List[typing.List[float]]:
+        """embed texts in order, only calling `embed_fn` for distinct texts that are not cached"""
+        keys = [EmbeddingCache.key(provider, model, t) for t in texts]
+        found = self.get_many(list(dict.fromkeys(keys)))
+
+        missing = {}
+        for k, t in zip(keys, texts):
+            if k not in found:
+                missing.setdefault(k, t)
+        if missing:
+            vectors = embed_fn(list(missing.values()))
+            new_items = dict(zip(missing.keys(), vectors))
+            self.put_many(new_items)
+            found.update(new_items)
+
+        with self._lock:
+            self._counters["misses"] += len(missing)
+            self._counters["hits"] += len(texts) - len(missing)
+        return [found[k] for k in keys]
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self._counters["hits"] + self._counters["misses"]
+            return {
+                **self._counters,
+                "hit_rate": self._counters["hits"] / total if total else 0.0,
+                "memory_items": len(self._memory),
+            }
+
+
+_cache: EmbeddingCache = None
+_cache_lock = threading.Lock()
+
+
+def get_embedding_cache() -> typing.Optional[EmbeddingCache]:
+    """the process-wide embedding cache configured by `FUNKY_EMBEDDING_CACHE` (local|postgres|memory|none)"""
+    from funkyprompt.core.utils.env import EMBEDDING_CACHE, STORE_ROOT
+
+    global _cache
+    if EMBEDDING_CACHE == "none":
+        return None
+    with _cache_lock:
+        if _cache is None:
+            store = None
+            if EMBEDDING_CACHE == "local":
+                store = SqliteEmbeddingStore(f"{STORE_ROOT}/cache/embeddings.db")
+            elif EMBEDDING_CACHE == "postgres":
+                store = PostgresEmbeddingStore()
+            _cache = EmbeddingCache(store=store)
+    return _cache
+
+
+"""
+Embedding client
+inputs are packed into batches by estimated token count (the provider limits tokens per request) and
+batches are sent concurrently - bounded by a semaphore shared by all callers and a request rate limiter.
+transient failures (rate limits, timeouts, 5xx) are retried with backoff and the output order is always the input order
+"""
+
+
+def estimate_tokens(text: str) -> int:
+    """a cheap token estimate - roughly 4 bytes per token for english text and code"""
+    return len(text.encode("utf-8")) // 4 + 1
+
+
+class RateLimiter:
+    """spaces out requests to at most `requests_per_minute` across threads"""
+
+    def __init__(self, requests_per_minute: int):
+        self.interval = 60.0 / requests_per_minute if requests_per_minute else 0
+        self._next = 0.0
+        self._lock = threading.Lock()
+
+    def wait(self):
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next)
+            self._next = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+class EmbeddingClient:
+    """a batching, concurrent and retrying client for the openai embeddings api (or anything that speaks it)
+
+    Examples:
+
+        ```python
+        client = EmbeddingClient(max_concurrency=8)
+        vectors = client.embed(texts)
+        client.stats()
+
+        #a local stand in server
+        client = EmbeddingClient(base_url='http://localhost:8000/v1', api_key='test')
+        ```
+    """
+
+    def __init__(
+        self,
+        model: str = DEFAULT_EMBEDDING_MODEL,
+        max_tokens_per_batch: int = None,
+        max_inputs_per_batch: int = 2048,
+        max_concurrency: int = None,
+        requests_per_minute: int = None,
+        max_retries: int = 5,
+        backoff: float = 0.5,
+        **client_kwargs,
+    ):
+        """
+        Args:
+            model: the embedding model
+            max_tokens_per_batch: estimated tokens packed into one request
+            max_inputs_per_batch: the provider limit on inputs per request
+            max_concurrency: requests in flight at once across all callers of this client
+            requests_per_minute: the request rate limit
+            max_retries: attempts for transient failures
+            backoff: the initial backoff in seconds which doubles on each retry
+            client_kwargs: passed to the OpenAI client e.g. base_url, api_key
+        """
+        from funkyprompt.core.utils.env import (
+            EMBEDDING_BATCH_TOKENS,
+            EMBEDDING_MAX_CONCURRENCY,
+            EMBEDDING_REQUESTS_PER_MINUTE,
+        )
+
+        self.model = model
+        self.max_tokens_per_batch = max_tokens_per_batch or EMBEDDING_BATCH_TOKENS
+        self.max_inputs_per_batch = max_inputs_per_batch
+        self.max_concurrency = max_concurrency or EMBEDDING_MAX_CONCURRENCY
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self._client_kwargs = client_kwargs
+        self._client = None
+        self._semaphore = threading.BoundedSemaphore(self.max_concurrency)
+        self._rate_limiter = RateLimiter(
+            requests_per_minute
+            if requests_per_minute is not None
+            else EMBEDDING_REQUESTS_PER_MINUTE
+        )
+        self._lock = threading.Lock()
+        self._counters = {
+            "requests": 0,
+            "inputs": 0,
+            "estimated_tokens": 0,
+            "retries": 0,
+            "failures": 0,
+            "elapsed": 0.0,
+        }
+
+    @property
+    def client(self):
+        if self._client is None:
+            from openai import OpenAI
+
+            """we do our own retries"""
+            self._client = OpenAI(max_retries=0, **self._client_kwargs)
+        return self._client
+
+    def batches(self, texts: typing.List[str]) -> typing.List[typing.Tuple[int, int]]:
+        """the (start, end) ranges of the batches - contiguous so that results can be stitched back in order"""
+        ranges, start, tokens = [], 0, 0
+        for i, t in enumerate(texts):
+            n = estimate_tokens(t)
+            if i > start and (
+                tokens + n > self.max_tokens_per_batch
+                or i - start >= self.max_inputs_per_batch
+            ):
+                ranges.append((start, i))
+                start, tokens = i, 0
+            tokens += n
+        if start < len(texts):
+            ranges.append((start, len(texts)))
+        return ranges
+
+    @staticmethod
+    def _is_transient(ex: Exception) -> bool:
+        import openai
+
+        if isinstance(
+            ex,
+            (openai.APIConnectionError, openai.RateLimitError, openai.InternalServerError),
+        ):
+            return True
+        return isinstance(ex, openai.APIStatusError) and ex.status_code in [408, 409, 429]
+
+    def _embed_batch(self, batch: typing.List[str]) -> typing.List[typing.List[float]]:
+        for attempt in range(self.max_retries + 1):
+            self._rate_limiter.wait()
+            try:
+                with self._semaphore:
+                    r = self.client.embeddings.create(
+                        input=batch, model=self.model, encoding_format="float"
+                    )
+                with self._lock:
+                    self._counters["requests"] += 1
+                return [e.embedding for e in sorted(r.data, key=lambda e: e.index)]
+            except Exception as ex:
+                if attempt == self.max_retries or not EmbeddingClient._is_transient(ex):
+                    with self._lock:
+                        self._counters["failures"] += 1
+                    raise
+                with self._lock:
+                    self._counters["retries"] += 1
+                delay = self.backoff * 2**attempt
+                logger.debug(f"retrying embedding batch of {len(batch)} in {delay}s - {ex}")
+                time.sleep(delay)
+
+    def embed(self, texts: typing.List[str]) -> typing.List[typing.List[float]]:
+        """embed the texts - the result is in the same order as the input"""
+        if not texts:
+            return []
+        started = time.monotonic()
+        ranges = self.batches(texts)
+        if len(ranges) == 1:
+            results = [self._embed_batch(texts)]
+        else:
+            with ThreadPoolExecutor(
+                max_workers=min(self.max_concurrency, len(ranges))
+            ) as executor:
+                results = list(
+                    executor.map(lambda r: self._embed_batch(texts[r[0] : r[1]]), ranges)
+                )
+
+        with self._lock:
+            self._counters["inputs"] += len(texts)
+            self._counters["estimated_tokens"] += sum(estimate_tokens(t) for t in texts)
+            self._counters["elapsed"] += time.monotonic() - started
+        return [v for batch in results for v in batch]
+
+    def stats(self) -> dict:
+        """counters and the throughput achieved while embedding"""
+        with self._lock:
+            elapsed = self._counters["elapsed"]
+            return {
+                **self._counters,
+                "inputs_per_second": self._counters["inputs"] / elapsed if elapsed else 0.0,
+                "tokens_per_second": (
+                    self._counters["estimated_tokens"] / elapsed if elapsed else 0.0
+                ),
+            }
+
+
+_client: EmbeddingClient = None
+
+
+def get_embedding_client() -> EmbeddingClient:
+    """the process-wide embedding client so that concurrency and rate limits are shared"""
+    global _client
+    with _cache_lock:
+        if _client is None:
+            _client = EmbeddingClient()
+    return _client
+
+
+"""
+Embedding providers
+fields name their provider e.g. `OpenAIEmbeddingField` or `LocalEmbeddingField` and the provider registry knows
+the model and dimensions for each so that tables, embedding and search agree.
+the local provider hashes byte n-grams and projects them with numpy - it needs no network and is fast enough for CI and load tests.
+numpy is an optional dependency (`pip install "funkyprompt[local]"`) and is only imported when the local provider first embeds
+"""
+
+
+class EmbeddingProvider:
+    """the provider interface - a name, a model, the vector dimensions and a batch embed function"""
+
+    name: str = None
+    model: str = None
+    dimensions: int = None
+    """computing is cheaper than caching for in-process providers"""
+    cacheable: bool = True
+
+    def embed(self, texts: typing.List[str]) -> typing.List[typing.List[float]]:
+        raise NotImplementedError
+
+    def __repr__(self):
+        return f"{type(self).__name__}(name={self.name}, model={self.model}, dimensions={self.dimensions})"
+
+
+class OpenAIEmbeddingProvider(EmbeddingProvider):
+    """openai embeddings via the shared batching client"""
+
+    name = "openai"
+    model = DEFAULT_EMBEDDING_MODEL
+    dimensions = 1536
+
+    def embed(self, texts: typing.List[str]) -> typing.List[typing.List[float]]:
+        return get_embedding_client().embed(texts)
+
+
+class HashingEmbeddingProvider(EmbeddingProvider):
+    """an in-process provider - byte n-gram counts are hashed into buckets and randomly projected down to `dimensions`.
+    vectors are unit length so the inner product operator works as it does for openai.
+    similar strings get similar vectors which is good enough to exercise the vector pipeline but this is not a semantic model
+    """
+
+    name = "local"
+    cacheable = False
+
+    def __init__(
+        self,
+        dimensions: int = 384,
+        ngrams: typing.Tuple[int, ...] = (3, 4, 5),
+        buckets: int = 4096,
+        seed: int = 42,
+    ):
+        self.dimensions = dimensions
+        self.ngrams = ngrams
+        self.buckets = buckets
+        self.seed = seed
+        self.model = f"hashing-ngram-{buckets}-{dimensions}-{seed}"
+        """built on first embed so that registering the provider does not import numpy"""
+        self._projection = None
+
+    @property
+    def projection(self):
+        import numpy as np
+
+        if self._projection is None:
+            self._projection = np.random.default_rng(self.seed).standard_normal(
+                (self.buckets, self.dimensions), dtype=np.float32
+            ) / np.sqrt(self.dimensions)
+        return self._projection
+
+    def _features(self, text: str):
+        import numpy as np
+
+        b = np.frombuffer(text.lower().encode("utf-8"), dtype=np.uint8).astype(np.uint64)
+        counts = np.zeros(self.buckets, dtype=np.float32)
+        for n in self.ngrams:
+            if len(b) < n:
+                continue
+            """a polynomial rolling hash over every window of n bytes (wraps mod 2^64)"""
+            h = np.zeros(len(b) - n + 1, dtype=np.uint64)
+            for k in range(n):
+                h = h * np.uint64(1099511628211) + b[k : len(b) - n + 1 + k]
+            counts += np.bincount((h % np.uint64(self.buckets)).astype(np.int64), minlength=self.buckets)
+        return np.log1p(counts)
+
+    def embed(self, texts: typing.List[str]) -> typing.List[typing.List[float]]:
+        import numpy as np
+
+        if not texts:
+            return []
+        X = np.stack([self._features(t) for t in texts]) @ self.projection
+        norms = np.linalg.norm(X, axis=1, keepdims=True)
+        X = X / np.where(norms == 0, 1, norms)
+        return X.tolist()
+
+
+_providers: typing.Dict[str, EmbeddingProvider] = {}
+
+
+def _provider_key(name: str) -> str:
+    """open_ai and openai are the same provider"""
+    return (name or "openai").replace("_", "").lower()
+
+
+def register_provider(provider: EmbeddingProvider, name: str = None):
+    """add or replace an embedding provider e.g. `register_provider(HashingEmbeddingProvider(dimensions=1536), 'openai')` to run offline"""
+    _providers[_provider_key(name or provider.name)] = provider
+    return provider
+
+
+def get_provider(name: str = "openai") -> EmbeddingProvider:
+    """the registered provider for a field's `embedding_provider`
+    with `FUNKY_OFFLINE_EMBEDDINGS` every provider is served locally with matching dimensions so schemas do not change
+    """
+    from funkyprompt.core.utils.env import OFFLINE_EMBEDDINGS
+
+    key = _provider_key(name)
+    if key not in _providers:
+        raise ValueError(
+            f"There is no embedding provider registered for {name} - registered providers are {list(_providers)}"
+        )
+    provider = _providers[key]
+    if OFFLINE_EMBEDDINGS and not isinstance(provider, HashingEmbeddingProvider):
+        provider = _providers.setdefault(
+            f"{key}-offline", HashingEmbeddingProvider(dimensions=provider.dimensions)
+        )
+    return provider
+
+
+def has_provider(name: str) -> bool:
+    return _provider_key(name) in _providers
+
+
+register_provider(OpenAIEmbeddingProvider())
+register_provider(HashingEmbeddingProvider())
+
+
+def embed_collection(c: typing.List[str], provider="open_ai", use_cache: bool = True):
+    """get embeddings from the provider (registry name) - defaults to openai
+    unchanged text is served from the embedding cache
+    """
+    provider = get_provider(provider)
+    cache = get_embedding_cache() if use_cache and provider.cacheable else None
+    if cache is None:
+        return provider.embed(c)
+    return cache.embed(
+        c,
+        provider=provider.name,
+        model=provider.model,
+        embed_fn=provider.embed,
+    )
 
 
 def embed_frame(
-    data: typing.List[dict], field_mapping: dict = None, id_column: str = None
+    data: typing.List[dict],
+    field_mapping: dict = None,
+    id_column: str = None,
+    providers: dict = None,
 ) -> typing.List[dict]:
     """given a data frame with texts that require embeddings do the thing and return a collection of records
     default conventions
     key->id
     field mappings for any column pair X and X_embedding
+    providers map fields to embedding providers and default to openai
     """
+    providers = providers or {}
     embeddings = {}
 
     def frame_col(name):
@@ -40,7 +610,11 @@ def embed_frame(
     for field, mapping in field_mapping.items():
         text = frame_col(field)
         """use the embedding function"""
-        embeddings[mapping] = embed_collection(text) if text is not None else None
+        embeddings[mapping] = (
+            embed_collection(text, provider=providers.get(field, "openai"))
+            if text is not None
+            else None
+        )
 
     """reshape to records"""
     keys = embeddings.keys()
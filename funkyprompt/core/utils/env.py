@@ -9,6 +9,45 @@ POSTGRES_PASSWORD =  "password"
 POSTGRES_USER = "sirsh"
 POSTGRES_CONNECTION_STRING = f"postgresql://{POSTGRES_USER}:{POSTGRES_PASSWORD}@{POSTGRES_SERVER}:{POSTGRES_PORT}/{POSTGRES_DB}"
 AGE_GRAPH = "funkybrain"
+"""connections are borrowed from a process-wide pool - see services.data.pool"""
+POSTGRES_POOL_MIN_SIZE = int(os.environ.get("POSTGRES_POOL_MIN_SIZE", 1))
+POSTGRES_POOL_MAX_SIZE = int(os.environ.get("POSTGRES_POOL_MAX_SIZE", 10))
+POSTGRES_POOL_TIMEOUT = float(os.environ.get("POSTGRES_POOL_TIMEOUT", 30))
+POSTGRES_POOL_HEALTH_CHECK_INTERVAL = float(os.environ.get("POSTGRES_POOL_HEALTH_CHECK_INTERVAL", 30))
+"""hot queries are prepared once per pooled connection and the least recently used statements are deallocated past this size"""
+POSTGRES_PREPARED_CACHE_SIZE = int(os.environ.get("POSTGRES_PREPARED_CACHE_SIZE", 256))
+"""update_records switches from batched inserts to COPY at this many records"""
+BULK_COPY_THRESHOLD = int(os.environ.get("FUNKY_BULK_COPY_THRESHOLD", 1000))
+"""embeddings can be queued for background workers instead of being computed inline on upsert"""
+DEFER_EMBEDDINGS = os.environ.get("FUNKY_DEFER_EMBEDDINGS", "false").lower() in ["1", "true", "yes"]
+EMBEDDING_QUEUE_TABLE = "core.embedding_queue"
+"""PostgresService.ask can run its strategies in parallel and either return the first with results or merge them all"""
+ASK_PARALLEL = os.environ.get("FUNKY_ASK_PARALLEL", "false").lower() in ["1", "true", "yes"]
+ASK_POLICY = os.environ.get("FUNKY_ASK_POLICY", "first")
+ASK_STRATEGY_TIMEOUT = float(os.environ.get("FUNKY_ASK_STRATEGY_TIMEOUT", 20))
+"""the vector strategy is one multi-vector query - a lexical (full text) pass for exact keywords is an extra query so it is opt-in"""
+ASK_LEXICAL = os.environ.get("FUNKY_ASK_LEXICAL", "false").lower() in ["1", "true", "yes"]
+"""query classifications are cached per model and question - a similarity threshold (e.g. 0.95) also matches near-duplicate questions"""
+CLASSIFIER_CACHE_SIZE = int(os.environ.get("FUNKY_CLASSIFIER_CACHE_SIZE", 1024))
+CLASSIFIER_CACHE_TTL = float(os.environ.get("FUNKY_CLASSIFIER_CACHE_TTL", 3600))
+CLASSIFIER_SIMILARITY_THRESHOLD = float(os.environ.get("FUNKY_CLASSIFIER_SIMILARITY_THRESHOLD", 0)) or None
+"""where embeddings are cached by content hash - local (sqlite under FUNKY_HOME), postgres, memory or none"""
+EMBEDDING_CACHE = os.environ.get("FUNKY_EMBEDDING_CACHE", "local").lower()
+"""the embedding client packs inputs into batches by (estimated) tokens and runs batches concurrently"""
+EMBEDDING_BATCH_TOKENS = int(os.environ.get("FUNKY_EMBEDDING_BATCH_TOKENS", 8000))
+EMBEDDING_MAX_CONCURRENCY = int(os.environ.get("FUNKY_EMBEDDING_MAX_CONCURRENCY", 4))
+EMBEDDING_REQUESTS_PER_MINUTE = int(os.environ.get("FUNKY_EMBEDDING_REQUESTS_PER_MINUTE", 3000))
+"""serve every embedding provider with the local hashing provider e.g. for CI and load tests without an api"""
+OFFLINE_EMBEDDINGS = os.environ.get("FUNKY_OFFLINE_EMBEDDINGS", "false").lower() in ["1", "true", "yes"]
+"""embeddings are stored inline in the entity table by default - otherwise (or per model with Config.embeddings_inline) in a side table joined through a view"""
+EMBEDDINGS_INLINE = os.environ.get("FUNKY_EMBEDDINGS_INLINE", "true").lower() in ["1", "true", "yes"]
+"""graph writes are sent as UNWIND batches of at most this many rows per statement"""
+GRAPH_UPSERT_BATCH_SIZE = int(os.environ.get("FUNKY_GRAPH_UPSERT_BATCH_SIZE", 500))
+"""tag path queries can be answered from an in-process snapshot of the graph - reloaded from age when older than the ttl (seconds, 0 for never)"""
+GRAPH_SNAPSHOT = os.environ.get("FUNKY_GRAPH_SNAPSHOT", "false").lower() in ["1", "true", "yes"]
+GRAPH_SNAPSHOT_TTL = float(os.environ.get("FUNKY_GRAPH_SNAPSHOT_TTL", 300))
+"""entity discovery reads the packaged manifest first - set a path to use another manifest or none to always discover"""
+ENTITY_MANIFEST = os.environ.get("FUNKY_ENTITY_MANIFEST")
 STORE_ROOT = os.environ.get('FUNKY_HOME',f"{Path.home()}/.funkyprompt")
 
 def get_repo_root():
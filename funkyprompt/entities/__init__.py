@@ -29,29 +29,41 @@ from funkyprompt.core import AbstractEntity
 from funkyprompt.core import load_entities as load_core_entities
 
 
+def _scan_entities() -> typing.List[AbstractEntity]:
+    """walk the packages for entity types - this imports every module so it is done once by the registry"""
+    return get_classes(AbstractEntity, package="funkyprompt.entities") + load_core_entities()
+
+
+from funkyprompt.entities.registry import EntityRegistry
+from funkyprompt.entities.manifest import load_manifest
+
+"""the process-wide index of entity types - the packaged manifest is read first so that lookups do not need discovery"""
+entity_registry = EntityRegistry(loader=_scan_entities, manifest=load_manifest)
+
+
 def load_entities(include_core: bool = True) -> typing.List[AbstractEntity]:
     """
     Load entities including the core ones optionally
     if funkyprompt is used as a library we can register entities from
     - registering/importing a package of entities
     - dynamic entities in a database
+    entities are discovered once and then served from the `entity_registry`
     """
-    entities = get_classes(AbstractEntity, package="funkyprompt.entities")
-    """
-    add core entities
-    """
-    if include_core:
-        entities += load_core_entities()
+    entities = entity_registry.entities()
+    if not include_core:
+        entities = [e for e in entities if not e.__module__.startswith("funkyprompt.core")]
     return entities
 
 
+def register(model: AbstractEntity) -> AbstractEntity:
+    """register a (dynamic) entity type so that it can be resolved"""
+    return entity_registry.register(model)
+
+
 def resolve(
     entity_model_name: str, entity_model_namespace: str = "public", **kwargs
 ) -> AbstractEntity:
     """resolve entity given the name and namespace
     the default is public for generic type entities that we store in funkyprompt
     """
-    match = f"{entity_model_namespace}.{entity_model_name}"
-    for e in load_entities():
-        if e.get_model_fullname() == match:
-            return e
+    return entity_registry.resolve(f"{entity_model_namespace}.{entity_model_name}")
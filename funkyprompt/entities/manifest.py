@@ -0,0 +1,124 @@
+"""
+The entity manifest is a build-time snapshot of what discovery would find - the entity types, where they live, their descriptions and function signatures.
+Discovery (`get_classes`) imports every module under funkyprompt.core and funkyprompt.entities which in turn pulls in the agents, services and their clients.
+With the manifest the registry can resolve an entity by importing only the module it is defined in and describe all entities (for planning) without importing any.
+
+The manifest is stamped with a fingerprint of the package sources and is ignored when it is stale, in which case we fall back to discovery.
+Rebuild it after adding or changing entities
+
+```bash
+funkyprompt manifest
+```
+
+or
+
+```python
+from funkyprompt.entities.manifest import write_manifest
+write_manifest()
+```
+"""
+
+import os
+import json
+import typing
+import hashlib
+import inspect
+import importlib
+from pathlib import Path
+from funkyprompt.core.utils import logger
+from funkyprompt.core.utils.env import ENTITY_MANIFEST
+
+MANIFEST_PATH = Path(__file__).parent / "manifest.json"
+
+
+def source_fingerprint(modules: typing.List[str] = None) -> str:
+    """a hash of the entities package and the other modules that define entities - reading the files is much cheaper than importing them.
+    a change to any of these sources makes the manifest stale
+    """
+    root = Path(__file__).parent.parent.parent
+    files = set(Path(__file__).parent.rglob("*.py"))
+    for module in modules or []:
+        file = root / f"{module.replace('.', '/')}.py"
+        if file.exists():
+            files.add(file)
+    h = hashlib.sha256()
+    for file in sorted(files):
+        h.update(str(file.relative_to(root)).encode())
+        h.update(file.read_bytes())
+    return h.hexdigest()
+
+
+def _function_entry(f: typing.Callable) -> dict:
+    try:
+        signature = str(inspect.signature(f))
+    except (TypeError, ValueError):
+        signature = None
+    return {
+        "name": f.__name__,
+        "signature": signature,
+        "description": inspect.getdoc(f),
+    }
+
+
+def manifest_entry(model) -> dict:
+    """what we need to know about an entity type without importing it"""
+    return {
+        "fullname": model.get_model_fullname(),
+        "namespace": model.get_model_namespace(),
+        "name": model.get_model_name(),
+        "label": model.get_model_fullname().replace(".", "_"),
+        "module": model.__module__,
+        "qualname": model.__qualname__,
+        "description": model._describe_model(),
+        "functions": [_function_entry(f) for f in model.get_class_and_instance_methods()],
+    }
+
+
+def build_manifest(entities: typing.List[typing.Any] = None) -> dict:
+    """build the manifest from discovery (or the entities given)"""
+    if entities is None:
+        from funkyprompt.entities import _scan_entities
+
+        entities = _scan_entities()
+    entries = [manifest_entry(e) for e in entities]
+    return {
+        "fingerprint": source_fingerprint(sorted({e["module"] for e in entries})),
+        "entities": entries,
+    }
+
+
+def write_manifest(path: str | Path = None, entities: typing.List[typing.Any] = None) -> Path:
+    """build and write the manifest - by default into the package so that it ships with it"""
+    path = Path(path or MANIFEST_PATH)
+    manifest = build_manifest(entities)
+    with open(path, "w") as f:
+        json.dump(manifest, f, indent=1, default=str)
+    logger.info(f"wrote {len(manifest['entities'])} entities to the manifest {path}")
+    return path
+
+
+def load_manifest(path: str | Path = None, check_fingerprint: bool = True) -> typing.Optional[dict]:
+    """the manifest entries keyed by fullname or None if there is no (fresh) manifest"""
+    path = path or ENTITY_MANIFEST or MANIFEST_PATH
+    if str(path).lower() == "none" or not os.path.exists(path):
+        return None
+    try:
+        with open(path) as f:
+            manifest = json.load(f)
+    except Exception as ex:
+        logger.warning(f"Failed to read the entity manifest {path} - {ex}")
+        return None
+    entries = manifest.get("entities", [])
+    modules = sorted({e["module"] for e in entries})
+    if check_fingerprint and manifest.get("fingerprint") != source_fingerprint(modules):
+        logger.debug(f"the entity manifest {path} is stale - entities will be discovered")
+        return None
+    return {e["fullname"]: e for e in entries}
+
+
+def import_entity(entry: dict):
+    """import the entity type for a manifest entry - only its own module is imported"""
+    model = importlib.import_module(entry["module"])
+    for part in entry["qualname"].split("."):
+        model = getattr(model, part)
+    return model
@@ -0,0 +1,195 @@
+"""
+The entity registry is an index of the entity types we know about.
+The packaged entities are discovered (a package walk that imports every module) once on first use and then every lookup
+is a dict lookup by fullname (namespace.name), by graph label (namespace_name) or by namespace.
+
+When a manifest is given (see `funkyprompt.entities.manifest`) lookups are served from it before any discovery - only the module
+defining the requested type is imported and `describe` needs no imports at all. Anything the manifest does not know falls back to discovery.
+
+Dynamic models e.g. those created from markdown or from the database can be registered explicitly and
+registration hooks are called so that anything derived from the set of entities can be refreshed.
+
+```python
+from funkyprompt.entities.registry import entity_registry
+
+entity_registry.resolve('public.project')
+entity_registry.resolve(label='public_project')
+entity_registry.register(MyModel)
+```
+"""
+
+import typing
+import threading
+from funkyprompt.core import AbstractEntity
+from funkyprompt.core.utils import logger
+
+
+def _label(model: AbstractEntity) -> str:
+    """the graph label for the type - see CypherHelper"""
+    return model.get_model_fullname().replace(".", "_")
+
+
+class EntityRegistry:
+    """entity types indexed by fullname, label and namespace"""
+
+    def __init__(
+        self,
+        loader: typing.Callable[[], typing.List[AbstractEntity]] = None,
+        manifest: typing.Callable[[], typing.Optional[typing.Dict[str, dict]]] = None,
+    ):
+        """
+        Args:
+            loader: discovers the packaged entities - called once and again only after `invalidate`
+            manifest: returns manifest entries by fullname (or None) - consulted before discovery
+        """
+        self._loader = loader
+        self._manifest_loader = manifest
+        self._manifest: typing.Dict[str, dict] = None
+        self._manifest_labels: typing.Dict[str, str] = None
+        """types imported from the manifest before (or without) discovery"""
+        self._lazy: typing.Dict[str, AbstractEntity] = {}
+        self._lock = threading.RLock()
+        self._loaded: typing.List[AbstractEntity] = None
+        self._dynamic: typing.Dict[str, AbstractEntity] = {}
+        self._by_fullname: typing.Dict[str, AbstractEntity] = {}
+        self._by_label: typing.Dict[str, AbstractEntity] = {}
+        self._by_namespace: typing.Dict[str, typing.List[AbstractEntity]] = {}
+        self._hooks: typing.List[typing.Callable[[AbstractEntity], None]] = []
+
+    def _ensure(self):
+        if self._loaded is not None:
+            return
+        with self._lock:
+            if self._loaded is None:
+                loaded = list(self._loader()) if self._loader else []
+                self._by_fullname, self._by_label, self._by_namespace = {}, {}, {}
+                for e in loaded + list(self._dynamic.values()):
+                    self._index(e)
+                self._loaded = loaded
+                logger.debug(f"indexed {len(self._by_fullname)} entity types")
+
+    def _entries(self) -> typing.Dict[str, dict]:
+        if self._manifest is None:
+            with self._lock:
+                if self._manifest is None:
+                    entries = None
+                    if self._manifest_loader:
+                        try:
+                            entries = self._manifest_loader()
+                        except Exception as ex:
+                            logger.warning(f"Failed to load the entity manifest - {ex}")
+                    self._manifest = entries or {}
+                    self._manifest_labels = {
+                        e["label"]: k for k, e in self._manifest.items()
+                    }
+        return self._manifest
+
+    def _resolve_lazy(self, fullname: str = None, label: str = None):
+        """resolve from dynamic types or the manifest without discovery - None if we cannot"""
+        entries = self._entries()
+        if label and not fullname:
+            for model in self._dynamic.values():
+                if _label(model) == label:
+                    return model
+            fullname = self._manifest_labels.get(label)
+        if not fullname:
+            return None
+        if fullname in self._dynamic:
+            return self._dynamic[fullname]
+        if fullname in self._lazy:
+            return self._lazy[fullname]
+        if fullname not in entries:
+            return None
+        from funkyprompt.entities.manifest import import_entity
+
+        try:
+            model = import_entity(entries[fullname])
+        except Exception as ex:
+            logger.warning(f"Failed to import {fullname} from the entity manifest - {ex}")
+            return None
+        if model.get_model_fullname() != fullname:
+            logger.warning(f"The entity manifest is out of date for {fullname}")
+            return None
+        self._lazy[fullname] = model
+        return model
+
+    def _index(self, model: AbstractEntity):
+        fullname = model.get_model_fullname()
+        previous = self._by_fullname.get(fullname)
+        if previous is not None:
+            namespace = self._by_namespace.get(model.get_model_namespace(), [])
+            if previous in namespace:
+                namespace.remove(previous)
+        self._by_fullname[fullname] = model
+        self._by_label[_label(model)] = model
+        self._by_namespace.setdefault(model.get_model_namespace(), []).append(model)
+
+    def add_hook(self, hook: typing.Callable[[AbstractEntity], None]):
+        """hooks are called with the model whenever a model is registered"""
+        self._hooks.append(hook)
+        return hook
+
+    def register(self, model: AbstractEntity) -> AbstractEntity:
+        """register (or replace) a model type e.g. a dynamic model - the model is kept over invalidations"""
+        model = AbstractEntity.ensure_model_not_instance(model)
+        with self._lock:
+            self._dynamic[model.get_model_fullname()] = model
+            if self._loaded is not None:
+                self._index(model)
+        for hook in self._hooks:
+            try:
+                hook(model)
+            except Exception as ex:
+                logger.warning(f"An entity registration hook failed for {model} - {ex}")
+        return model
+
+    def unregister(self, fullname: str):
+        with self._lock:
+            self._dynamic.pop(fullname, None)
+            self._lazy.pop(fullname, None)
+            self._loaded = None
+
+    def invalidate(self):
+        """rediscover the packaged entities on the next lookup e.g. after installing a package of entities"""
+        with self._lock:
+            self._loaded = None
+            self._manifest = None
+            self._lazy = {}
+
+    def resolve(
+        self, fullname: str = None, label: str = None
+    ) -> typing.Optional[AbstractEntity]:
+        """the entity type by fullname (namespace.name) or graph label (namespace_name)"""
+        if self._loaded is None:
+            model = self._resolve_lazy(fullname, label)
+            if model is not None:
+                return model
+        self._ensure()
+        if fullname:
+            return self._by_fullname.get(fullname)
+        if label:
+            return self._by_label.get(label)
+
+    def namespace(self, namespace: str) -> typing.List[AbstractEntity]:
+        self._ensure()
+        return list(self._by_namespace.get(namespace, []))
+
+    def entities(self) -> typing.List[AbstractEntity]:
+        self._ensure()
+        return list(self._by_fullname.values())
+
+    def describe(self) -> typing.Dict[str, dict]:
+        """the model descriptions (functions and fields) by fullname for prompting - from the manifest when we have one"""
+        entries = self._entries()
+        if entries and self._loaded is None:
+            described = {k: e["description"] for k, e in entries.items()}
+            described.update({k: m._describe_model() for k, m in self._dynamic.items()})
+            return described
+        return {e.get_model_fullname(): e._describe_model() for e in self.entities()}
+
+    def __contains__(self, fullname: str):
+        return self.resolve(fullname) is not None
+
+    def __len__(self):
+        self._ensure()
+        return len(self._by_fullname)
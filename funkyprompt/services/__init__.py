@@ -2,10 +2,16 @@ from funkyprompt.services.fs import FS
 from funkyprompt.services.models import language_model_client_from_context
 from funkyprompt.core import AbstractEntity
 from .data.postgres import PostgresService
+from .data.postgres_async import AsyncPostgresService
 
 
 def entity_store(model: AbstractEntity):
     """returns the configured store for the entity"""
     return PostgresService(model)
 
+
+def async_entity_store(model: AbstractEntity):
+    """returns the configured async store for the entity e.g. for use in the (async) api"""
+    return AsyncPostgresService(model)
+
 fs = FS()
\ No newline at end of file
@@ -1,5 +1,6 @@
 from funkyprompt.core import AbstractModel
 from abc import ABC, abstractmethod
+import asyncio
 import typing
 
 
@@ -46,3 +47,20 @@ class DataServiceBase(ABC):
         the query in the format required for the store.
         this could be a text search in a vector store, and sql query, list of keys etc.
         """
+
+    """
+    async counterparts - by default these run the blocking call in a worker thread
+    so every store can be used from async code. stores with an async driver override them
+    """
+
+    async def aupdate_records(self, records: typing.List[AbstractModel], **kwargs):
+        """async counterpart of update_records"""
+        return await asyncio.to_thread(self.update_records, records, **kwargs)
+
+    async def aselect_one(self, id: str, **kwargs) -> AbstractModel:
+        """async counterpart of select_one"""
+        return await asyncio.to_thread(self.select_one, id, **kwargs)
+
+    async def aask(self, question: str, **kwargs) -> typing.List[dict]:
+        """async counterpart of ask"""
+        return await asyncio.to_thread(self.ask, question, **kwargs)
@@ -0,0 +1,370 @@
+"""
+A durable queue for embedding work.
+
+When records are upserted with deferred embeddings we only write a job per (table, record, field) to a queue table.
+Workers claim batches of jobs in a short transaction (`FOR UPDATE SKIP LOCKED`) that stamps a lease on them so any number of workers
+(threads or processes) can drain the queue without stepping on each other. No locks or connections are held while the text is embedded
+so ingest writes that re-queue a claimed record never wait on a worker. Re-queuing bumps the job version and the worker only writes the
+embeddings and deletes the jobs whose version is unchanged - a record updated mid-embedding is embedded again with its latest text.
+A worker that dies mid-batch leaves its lease to expire and the jobs go to the next worker.
+
+```python
+from funkyprompt.services.data.embedding_queue import EmbeddingQueue, EmbeddingWorkerPool
+
+EmbeddingQueue()._create_queue()
+workers = EmbeddingWorkerPool(workers=4).start()
+EmbeddingQueue().metrics()
+```
+
+or run `funkyprompt embed` from the cli
+"""
+
+import os
+import time
+import socket
+import typing
+import threading
+import psycopg2.errors
+import psycopg2.extras
+from funkyprompt.core.utils import logger
+from funkyprompt.core.utils.env import EMBEDDING_QUEUE_TABLE
+from funkyprompt.core.types.sql import PgVector
+from funkyprompt.services.data.pool import get_pool, ConnectionPool
+
+"""jobs that keep failing are left in the queue for inspection"""
+MAX_ATTEMPTS = 5
+"""claimed jobs are handed to another worker if they are not finished within the lease (seconds)"""
+LEASE_SECONDS = 300
+
+"""whether each table has an embedding side table (see `SqlHelper._create_embedding_table_script`) - the jobs only know the table name"""
+_EMBEDDING_TABLES: typing.Dict[str, bool] = {}
+
+
+def _has_embedding_table(c, table_name: str) -> bool:
+    if table_name not in _EMBEDDING_TABLES:
+        c.execute("SELECT to_regclass(%s) IS NOT NULL", (f"{table_name}_embeddings",))
+        _EMBEDDING_TABLES[table_name] = c.fetchone()[0]
+    return _EMBEDDING_TABLES[table_name]
+
+
+def forget_embedding_table(table_name: str = None):
+    """look again for the side table of the table (or of all tables) on the next write e.g. after `migrate_to_embedding_table`"""
+    if table_name is None:
+        _EMBEDDING_TABLES.clear()
+    else:
+        _EMBEDDING_TABLES.pop(table_name, None)
+
+
+class EmbeddingQueue:
+    """the queue table and the batch processing of jobs"""
+
+    def __init__(self, table_name: str = None):
+        self.table_name = table_name or EMBEDDING_QUEUE_TABLE
+        """recorded on the jobs this queue leases"""
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:{id(self):x}"
+        self._lock = threading.Lock()
+        self._counters = {"processed": 0, "batches": 0, "failures": 0}
+
+    @property
+    def pool(self) -> ConnectionPool:
+        return get_pool()
+
+    def create_script(self) -> str:
+        """the queue table - one pending job per record and field"""
+        schema = self.table_name.split(".")[0]
+        return f"""
+        CREATE SCHEMA IF NOT EXISTS {schema};
+        CREATE TABLE IF NOT EXISTS {self.table_name} (
+            id BIGSERIAL PRIMARY KEY,
+            table_name VARCHAR NOT NULL,
+            key_field VARCHAR NOT NULL,
+            record_id VARCHAR NOT NULL,
+            field VARCHAR NOT NULL,
+            provider VARCHAR,
+            enqueued_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            attempts INTEGER DEFAULT 0,
+            last_error TEXT,
+            version INTEGER DEFAULT 0,
+            claimed_at TIMESTAMP,
+            claimed_by VARCHAR,
+            UNIQUE (table_name, record_id, field)
+        );
+        ALTER TABLE {self.table_name} ADD COLUMN IF NOT EXISTS version INTEGER DEFAULT 0;
+        ALTER TABLE {self.table_name} ADD COLUMN IF NOT EXISTS claimed_at TIMESTAMP;
+        ALTER TABLE {self.table_name} ADD COLUMN IF NOT EXISTS claimed_by VARCHAR;
+        """
+
+    def _create_queue(self):
+        """create the queue table if it does not exist"""
+        with self.pool.connection() as conn:
+            conn.cursor().execute(self.create_script())
+            conn.commit()
+
+    def enqueue(self, model, result: typing.List[dict]):
+        """add jobs for the embedding fields of the upserted records
+        a record that already has a job for a field is queued again - the attempts are reset (a dead job is revived), the lease is released
+        and the version is bumped which tells a worker that has already claimed the job not to write or delete it, so the latest text is always embedded.
+        claims are short transactions so this never waits on a worker
+
+        Args:
+            model: the AbstractModel type of the records
+            result: the upserted records - only the key field is used
+        """
+        helper = model.sql()
+        providers = {
+            k: (v.json_schema_extra or {}).get("embedding_provider")
+            for k, v in model.model_fields.items()
+        }
+        jobs = [
+            (helper.table_name, helper.id_field, str(r[helper.id_field]), field, providers.get(field))
+            for r in result or []
+            for field in model.get_embedding_fields()
+        ]
+        if not jobs:
+            return 0
+
+        with self.pool.connection() as conn:
+            psycopg2.extras.execute_values(
+                conn.cursor(),
+                f"""INSERT INTO {self.table_name} (table_name, key_field, record_id, field, provider)
+                VALUES %s ON CONFLICT (table_name, record_id, field)
+                DO UPDATE SET attempts = 0, last_error = NULL, enqueued_at = CURRENT_TIMESTAMP,
+                version = {self.table_name}.version + 1, claimed_at = NULL, claimed_by = NULL""",
+                jobs,
+            )
+            conn.commit()
+        logger.debug(f"queued {len(jobs)} embedding jobs for {helper.table_name}")
+        return len(jobs)
+
+    def _claim(self, batch_size: int) -> typing.List[dict]:
+        """lease up to `batch_size` jobs in a short transaction - jobs locked or leased by other workers are skipped"""
+        with self.pool.connection() as conn:
+            try:
+                c = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+                c.execute(
+                    f"""UPDATE {self.table_name} SET claimed_at = CURRENT_TIMESTAMP, claimed_by = %s
+                    WHERE id IN (
+                        SELECT id FROM {self.table_name}
+                        WHERE attempts < %s
+                        AND (claimed_at IS NULL OR claimed_at < CURRENT_TIMESTAMP - make_interval(secs => %s))
+                        ORDER BY id
+                        FOR UPDATE SKIP LOCKED
+                        LIMIT %s)
+                    RETURNING id, table_name, key_field, record_id, field, provider, version""",
+                    (self.worker_id, MAX_ATTEMPTS, LEASE_SECONDS, batch_size),
+                )
+                jobs = c.fetchall()
+                conn.commit()
+            except:
+                if not conn.closed:
+                    conn.rollback()
+                raise
+        return sorted(jobs, key=lambda j: j["id"])
+
+    def _load_texts(self, c, jobs: typing.List[dict]) -> typing.List[tuple]:
+        """the (key, text) of the records for a group of jobs on the same table and field"""
+        table_name, key_field, field = jobs[0]["table_name"], jobs[0]["key_field"], jobs[0]["field"]
+        c.execute(
+            f"""SELECT {key_field}::text, {field} FROM {table_name} WHERE {key_field} IN %s""",
+            (tuple(j["record_id"] for j in jobs),),
+        )
+        return c.fetchall()
+
+    def _embed(self, rows: typing.List[tuple], provider: str):
+        """when the data are none we embed a dummy value rather than re-indexing (same as embed_frame)"""
+        from funkyprompt.core.utils.embeddings import embed_collection
+
+        return embed_collection([text or "NONE" for _, text in rows], provider=provider or "openai")
+
+    def _write_vectors(self, c, jobs: typing.List[dict], rows: typing.List[tuple], vectors):
+        """write the vectors for a group of jobs on the same table and field"""
+        table_name, key_field, field = jobs[0]["table_name"], jobs[0]["key_field"], jobs[0]["field"]
+        if _has_embedding_table(c, table_name):
+            return self._write_embedding_table(c, table_name, key_field, field, rows, vectors)
+        try:
+            c.execute("SAVEPOINT inline_embeddings")
+            psycopg2.extras.execute_batch(
+                c,
+                f"""UPDATE {table_name} SET {field}_embedding = %s::vector WHERE {key_field} = %s""",
+                [(str(v), key) for (key, _), v in zip(rows, vectors)],
+            )
+            c.execute("RELEASE SAVEPOINT inline_embeddings")
+        except psycopg2.errors.UndefinedColumn:
+            """the inline columns were dropped since we looked (a migration in another process) - look again for the side table"""
+            c.execute("ROLLBACK TO SAVEPOINT inline_embeddings")
+            forget_embedding_table(table_name)
+            if not _has_embedding_table(c, table_name):
+                raise
+            logger.info(f"{table_name} was migrated to an embedding table - writing the vectors there")
+            self._write_embedding_table(c, table_name, key_field, field, rows, vectors)
+
+    def _write_embedding_table(self, c, table_name: str, key_field: str, field: str, rows: typing.List[tuple], vectors):
+        psycopg2.extras.execute_values(
+            c,
+            f"""INSERT INTO {table_name}_embeddings ({key_field}, field, embedding) VALUES %s
+            ON CONFLICT ({key_field}, field) DO UPDATE SET embedding = EXCLUDED.embedding, updated_at = CURRENT_TIMESTAMP""",
+            [(key, field, PgVector(v)) for (key, _), v in zip(rows, vectors)],
+        )
+
+    def process_batch(self, batch_size: int = 64) -> int:
+        """claim up to `batch_size` jobs, embed them and remove them from the queue - returns the number of jobs processed.
+        the claim, the text lookup and the write are separate short transactions and the embedding request holds no connection.
+        jobs re-queued while we were embedding (their version changed) are left for the next batch and their stale vectors are not written
+        """
+        jobs = self._claim(batch_size)
+        if not jobs:
+            return 0
+        ids = [j["id"] for j in jobs]
+
+        groups = {}
+        for j in jobs:
+            groups.setdefault((j["table_name"], j["field"], j["provider"]), []).append(j)
+
+        try:
+            with self.pool.connection() as conn:
+                c = conn.cursor()
+                texts = {k: self._load_texts(c, group) for k, group in groups.items()}
+                conn.commit()
+
+            vectors = {k: self._embed(texts[k], k[2]) if texts[k] else [] for k in groups}
+
+            with self.pool.connection() as conn:
+                try:
+                    c = conn.cursor()
+                    """lock the jobs that are still the version we claimed - re-queued jobs are skipped"""
+                    c.execute(
+                        f"""SELECT q.id FROM {self.table_name} q
+                        JOIN unnest(%s::bigint[], %s::integer[]) AS claimed(id, version)
+                        ON q.id = claimed.id AND q.version = claimed.version
+                        FOR UPDATE OF q""",
+                        (ids, [j["version"] for j in jobs]),
+                    )
+                    current = {r[0] for r in c.fetchall()}
+                    for k, group in groups.items():
+                        keep = {j["record_id"] for j in group if j["id"] in current}
+                        rows = [(r, v) for r, v in zip(texts[k], vectors[k]) if r[0] in keep]
+                        if rows:
+                            self._write_vectors(c, group, [r for r, _ in rows], [v for _, v in rows])
+                    if current:
+                        c.execute(f"""DELETE FROM {self.table_name} WHERE id = ANY(%s)""", (sorted(current),))
+                    conn.commit()
+                except:
+                    if not conn.closed:
+                        conn.rollback()
+                    raise
+        except Exception as ex:
+            logger.warning(f"Failed to process embedding jobs {ids} - {ex}")
+            self._record_failure(ids, ex)
+            return 0
+
+        if len(current) < len(ids):
+            logger.debug(f"{len(ids) - len(current)} embedding jobs were re-queued while they were embedded")
+        with self._lock:
+            self._counters["processed"] += len(current)
+            self._counters["batches"] += 1
+        return len(current)
+
+    def _record_failure(self, ids: typing.List[int], ex: Exception):
+        """count the attempt so poison jobs eventually stop being claimed"""
+        with self._lock:
+            self._counters["failures"] += 1
+        if not ids:
+            return
+        try:
+            with self.pool.connection() as conn:
+                conn.cursor().execute(
+                    f"""UPDATE {self.table_name} SET attempts = attempts + 1, last_error = %s, claimed_at = NULL, claimed_by = NULL
+                    WHERE id = ANY(%s)""",
+                    (repr(ex), ids),
+                )
+                conn.commit()
+        except Exception as uex:
+            logger.warning(f"Failed to record the failed embedding jobs - {uex}")
+
+    def drain(self, batch_size: int = 64) -> int:
+        """process batches until there is nothing left to claim"""
+        total = 0
+        while processed := self.process_batch(batch_size=batch_size):
+            total += processed
+        return total
+
+    def metrics(self) -> dict:
+        """queue depth and lag (age of the oldest pending job) and the counters for this process"""
+        with self.pool.connection() as conn:
+            c = conn.cursor()
+            c.execute(
+                f"""SELECT count(*),
+                COALESCE(EXTRACT(EPOCH FROM (CURRENT_TIMESTAMP - min(enqueued_at))), 0),
+                count(*) FILTER (WHERE attempts >= %s)
+                FROM {self.table_name}""",
+                (MAX_ATTEMPTS,),
+            )
+            depth, lag, dead = c.fetchone()
+            conn.commit()
+        with self._lock:
+            return {
+                "depth": depth,
+                "lag_seconds": float(lag),
+                "failed_jobs": dead,
+                **self._counters,
+            }
+
+
+class EmbeddingWorkerPool:
+    """a pool of worker threads that drain the embedding queue.
+    throughput scales with the number of workers up to the limits of the embedding provider and connection pool
+    """
+
+    def __init__(
+        self,
+        workers: int = 4,
+        batch_size: int = 64,
+        poll_interval: float = 1.0,
+        queue: EmbeddingQueue = None,
+    ):
+        self.queue = queue or EmbeddingQueue()
+        self.workers = workers
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self._stop = threading.Event()
+        self._threads: typing.List[threading.Thread] = []
+        self._started_at = None
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                processed = self.queue.process_batch(batch_size=self.batch_size)
+            except Exception as ex:
+                """e.g. the pool timed out - back off and try again"""
+                logger.warning(f"Embedding worker error - {ex}")
+                processed = 0
+            if not processed:
+                self._stop.wait(self.poll_interval)
+
+    def start(self):
+        """start the worker threads (daemons)"""
+        self._stop.clear()
+        self._started_at = time.time()
+        self._threads = [
+            threading.Thread(target=self._run, name=f"funky-embedding-{i}", daemon=True)
+            for i in range(self.workers)
+        ]
+        for t in self._threads:
+            t.start()
+        logger.info(f"started {self.workers} embedding workers")
+        return self
+
+    def stop(self, timeout: float = None):
+        """stop after the current batches complete"""
+        self._stop.set()
+        for t in self._threads:
+            t.join(timeout)
+        self._threads = []
+
+    def metrics(self) -> dict:
+        """queue metrics plus the throughput since the pool started"""
+        m = self.queue.metrics()
+        elapsed = time.time() - self._started_at if self._started_at else 0
+        m["workers"] = len(self._threads)
+        m["jobs_per_second"] = m["processed"] / elapsed if elapsed else 0.0
+        return m
@@ -0,0 +1,292 @@
+"""
+An in-process snapshot of the tag graph for fast traversal.
+
+Entities are tagged with paths A/B which are merged into AGE as (entity)-[:TAG]->(A)-[:TAG]->(B) (see `CypherHelper.upsert_path_batches`).
+Questions like "what is tagged A/B", "what is near this node" or "which tags go with this tag" are small traversals but in AGE each one is a
+cypher round trip. The snapshot holds the same edges as CSR adjacency arrays in NumPy (both directions) with node names interned to integer ids
+so these are answered in process with a few array lookups.
+
+AGE stays the source of truth - the snapshot is loaded from it, refreshed incrementally from our own graph writes and reloaded when it is older than
+`GRAPH_SNAPSHOT_TTL` seconds so that writes from other processes are picked up. It is optional - set `FUNKY_GRAPH_SNAPSHOT=true` to use it for
+`GraphManager.query_by_path`.
+
+```python
+from funkyprompt.services.data.graph_snapshot import get_graph_snapshot
+
+snapshot = get_graph_snapshot(store)
+snapshot.query_by_path(['Robotics/AI'])
+snapshot.neighbourhood('Robotics', hops=2)
+snapshot.co_occurring_tags('Robotics')
+```
+"""
+
+import json
+import time
+import typing
+import threading
+from funkyprompt.core.utils import logger
+from funkyprompt.core.utils.env import GRAPH_SNAPSHOT_TTL
+
+try:
+    import numpy as np
+except ImportError:
+    """numpy is optional - without it there is no snapshot and graph queries go to AGE"""
+    np = None
+
+
+def _csr(src: "np.ndarray", dst: "np.ndarray", size: int) -> typing.Tuple["np.ndarray", "np.ndarray"]:
+    """compressed sparse rows - the neighbours of node i are indices[indptr[i]:indptr[i+1]]"""
+    order = np.argsort(src, kind="stable")
+    indptr = np.zeros(size + 1, dtype=np.int64)
+    np.cumsum(np.bincount(src, minlength=size), out=indptr[1:])
+    return indptr, dst[order]
+
+
+def _gather(csr: typing.Tuple["np.ndarray", "np.ndarray"], nodes: "np.ndarray") -> "np.ndarray":
+    """the neighbours of all the nodes (with repeats) in one vectorised lookup"""
+    indptr, indices = csr
+    starts, ends = indptr[nodes], indptr[nodes + 1]
+    counts = ends - starts
+    if not counts.sum():
+        return np.empty(0, dtype=indices.dtype)
+    """the position of each neighbour is its row start plus its offset within the row"""
+    offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    return indices[np.repeat(starts, counts) + offsets]
+
+
+def _agtype(value):
+    """agtype values come back as json text (with a ::type suffix for vertices and edges)"""
+    if not isinstance(value, str):
+        return value
+    try:
+        return json.loads(value.split("::")[0])
+    except ValueError:
+        return value
+
+
+class _State(typing.NamedTuple):
+    """one built version of the snapshot - never changed once built so a query that reads it once sees consistent names and arrays"""
+
+    ids: typing.Mapping[str, int]
+    names: typing.Tuple[str, ...]
+    """the entity label for entity nodes - tag nodes have none"""
+    labels: typing.Tuple[typing.Optional[str], ...]
+    out: typing.Tuple["np.ndarray", "np.ndarray"]
+    inn: typing.Tuple["np.ndarray", "np.ndarray"]
+
+
+class GraphSnapshot:
+    """the edges of one type (TAG by default) as CSR arrays over interned node names
+
+    writes go to the builder fields under the lock and queries read the last built `_State` - writes or a reload swap in a new state
+    and never change one a query may be reading
+
+    Examples:
+
+    ```python
+    snapshot = GraphSnapshot()
+    snapshot.add_paths({'public_project': [{'name': 'p1', 'b': 'Robotics', 'c': 'AI'}]})
+    snapshot.query_by_path('Robotics/AI')
+    ```
+    """
+
+    def __init__(self, edge_name: str = "TAG"):
+        if np is None:
+            raise ImportError("The graph snapshot requires numpy - install it with `pip install numpy`")
+        self.edge_name = edge_name
+        self._lock = threading.RLock()
+        self._ids: typing.Dict[str, int] = {}
+        self._names: typing.List[str] = []
+        self._labels: typing.List[typing.Optional[str]] = []
+        self._src = np.empty(0, dtype=np.int64)
+        self._dst = np.empty(0, dtype=np.int64)
+        """edges added since the state was last built"""
+        self._pending: typing.List[typing.Tuple[int, int]] = []
+        self._dirty = True
+        self._current: _State = None
+        self.loaded_at: float = None
+
+    def __len__(self):
+        return len(self._state().names)
+
+    def _intern(self, name: str, label: str = None) -> int:
+        i = self._ids.get(name)
+        if i is None:
+            i = self._ids[name] = len(self._names)
+            self._names.append(name)
+            self._labels.append(label or None)
+        elif label and not self._labels[i]:
+            self._labels[i] = label
+            self._dirty = True
+        return i
+
+    def add_edge(self, source: str, target: str, source_label: str = None):
+        with self._lock:
+            self._pending.append((self._intern(source, source_label), self._intern(target)))
+            self._dirty = True
+
+    def add_paths(self, rows: typing.Dict[str, typing.List[dict]]):
+        """add the tag paths {name, b, c} by entity label - as produced by `CypherHelper.path_rows` for the graph writes"""
+        with self._lock:
+            for label, items in rows.items():
+                for r in items:
+                    self.add_edge(r["name"], r["b"], label)
+                    self.add_edge(r["b"], r["c"])
+
+    def _state(self) -> _State:
+        """the current state - pending edges are merged (and deduplicated as MERGE would) and a new state is built on first use after a write"""
+        with self._lock:
+            if self._dirty or self._current is None:
+                size = len(self._names)
+                if self._pending:
+                    pending = np.array(self._pending, dtype=np.int64)
+                    src = np.concatenate([self._src, pending[:, 0]])
+                    dst = np.concatenate([self._dst, pending[:, 1]])
+                    keys = np.unique(src * max(size, 1) + dst)
+                    self._src, self._dst = keys // max(size, 1), keys % max(size, 1)
+                    self._pending = []
+                self._current = _State(
+                    ids=dict(self._ids),
+                    names=tuple(self._names),
+                    labels=tuple(self._labels),
+                    out=_csr(self._src, self._dst, size),
+                    inn=_csr(self._dst, self._src, size),
+                )
+                self._dirty = False
+            return self._current
+
+    def neighbours(self, name: str, direction: str = "out") -> typing.List[str]:
+        """the names one edge away - direction is out, in or both"""
+        state = self._state()
+        i = state.ids.get(name)
+        if i is None:
+            return []
+        nodes = np.array([i])
+        found = {
+            "out": lambda: _gather(state.out, nodes),
+            "in": lambda: _gather(state.inn, nodes),
+            "both": lambda: np.concatenate([_gather(state.out, nodes), _gather(state.inn, nodes)]),
+        }[direction]()
+        return [state.names[j] for j in np.unique(found)]
+
+    def query_by_path(self, paths: typing.Union[str, typing.List[str]], label: str = None) -> typing.List[str]:
+        """the names of the nodes a with a-[:TAG]->A-[:TAG]->B for any of the paths A/B - the same match as `GraphManager.query_by_path` in cypher.
+        optionally only entities with the label e.g. public_project
+        """
+        if isinstance(paths, str):
+            paths = [paths]
+        state = self._state()
+        found = []
+        for path in paths:
+            parts = path.split("/")
+            b, c = state.ids.get(parts[0]), state.ids.get(parts[1] if len(parts) > 1 else "NONE")
+            if b is None or c is None:
+                continue
+            indptr, indices = state.out
+            if c not in indices[indptr[b] : indptr[b + 1]]:
+                continue
+            found.append(_gather(state.inn, np.array([b])))
+        if not found:
+            return []
+        names = []
+        for j in np.unique(np.concatenate(found)):
+            if label is None or state.labels[j] == label:
+                names.append(state.names[j])
+        return names
+
+    def neighbourhood(self, name: str, hops: int = 1, direction: str = "both") -> typing.Dict[str, int]:
+        """the names within k hops of the node with their distance - a breadth first search one frontier at a time"""
+        state = self._state()
+        i = state.ids.get(name)
+        if i is None:
+            return {}
+        depth = np.full(len(state.names), -1, dtype=np.int64)
+        depth[i] = 0
+        frontier = np.array([i])
+        for hop in range(1, hops + 1):
+            nxt = []
+            if direction in ("out", "both"):
+                nxt.append(_gather(state.out, frontier))
+            if direction in ("in", "both"):
+                nxt.append(_gather(state.inn, frontier))
+            frontier = np.unique(np.concatenate(nxt))
+            frontier = frontier[depth[frontier] < 0]
+            if not len(frontier):
+                break
+            depth[frontier] = hop
+        return {state.names[j]: int(depth[j]) for j in np.flatnonzero(depth > 0)}
+
+    def co_occurring_tags(self, tag: str, limit: int = 10) -> typing.List[typing.Tuple[str, int]]:
+        """the other tags of the entities tagged with the tag and how many entities they share - most shared first"""
+        state = self._state()
+        i = state.ids.get(tag)
+        if i is None:
+            return []
+        tagged = _gather(state.inn, np.array([i]))
+        entities = np.array([j for j in np.unique(tagged) if state.labels[j]], dtype=np.int64)
+        if not len(entities):
+            return []
+        tags, counts = np.unique(_gather(state.out, entities), return_counts=True)
+        shared = [(state.names[t], int(n)) for t, n in zip(tags, counts) if t != i]
+        return sorted(shared, key=lambda x: (-x[1], x[0]))[:limit]
+
+    def load(self, service) -> "GraphSnapshot":
+        """(re)load all the edges from AGE through a postgres service - the new state is built first and swapped in at once"""
+        data = service.query_graph(
+            f"""MATCH (a)-[:{self.edge_name}]->(b) RETURN a.name, label(a), b.name""",
+            returns=["a", "l", "b"],
+        )
+        fresh = GraphSnapshot(self.edge_name)
+        for d in data or []:
+            source, label, target = _agtype(d["a"]), _agtype(d["l"]), _agtype(d["b"])
+            if source is not None and target is not None:
+                fresh.add_edge(str(source), str(target), label)
+        state = fresh._state()
+        with self._lock:
+            self._ids, self._names, self._labels = fresh._ids, fresh._names, fresh._labels
+            self._src, self._dst, self._pending = fresh._src, fresh._dst, []
+            self._current, self._dirty = state, False
+            self.loaded_at = time.monotonic()
+        logger.debug(f"loaded the graph snapshot - {self.stats()}")
+        return self
+
+    def is_stale(self, ttl: float = None) -> bool:
+        ttl = GRAPH_SNAPSHOT_TTL if ttl is None else ttl
+        if self.loaded_at is None:
+            return True
+        return ttl > 0 and time.monotonic() - self.loaded_at > ttl
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "nodes": len(self._names),
+                "edges": len(self._src) + len(self._pending),
+                "age": None if self.loaded_at is None else time.monotonic() - self.loaded_at,
+            }
+
+
+_snapshot: GraphSnapshot = None
+_snapshot_lock = threading.Lock()
+
+
+def get_graph_snapshot(service, refresh: bool = False) -> GraphSnapshot:
+    """the process-wide snapshot - loaded from AGE through the service on first use and reloaded when stale"""
+    global _snapshot
+    with _snapshot_lock:
+        if _snapshot is None:
+            _snapshot = GraphSnapshot()
+        if refresh or _snapshot.is_stale():
+            _snapshot.load(service)
+        return _snapshot
+
+
+def current_graph_snapshot() -> typing.Optional[GraphSnapshot]:
+    """the snapshot if one has been loaded - graph writes update it but never load it"""
+    if _snapshot is not None and _snapshot.loaded_at is not None:
+        return _snapshot
+
+
+def clear_graph_snapshot():
+    global _snapshot
+    with _snapshot_lock:
+        _snapshot = None
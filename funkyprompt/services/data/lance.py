@@ -9,8 +9,9 @@ import pyarrow as pa
 from lancedb.pydantic import LanceModel, Vector
 from lancedb.embeddings import get_registry
 from funkyprompt.services import fs
-"""TODO env.preferred_test_embedding"""
-func = get_registry().get("openai").create(name="text-embedding-ada-002")
+from funkyprompt.core.utils.embeddings import get_provider
+"""lance uses its own embedding function registry - we take the model from ours"""
+func = get_registry().get("openai").create(name=get_provider("openai").model)
 
 
 class LanceAbstractContentModel(LanceModel, AbstractModel):
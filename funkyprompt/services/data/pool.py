@@ -0,0 +1,399 @@
+"""
+A process-wide connection pool for the postgres service.
+
+psycopg2 ships a ThreadedConnectionPool but it raises as soon as it is exhausted and it knows nothing about stale connections.
+Here we keep a small pool of our own that
+- blocks (with a timeout) when all connections are checked out instead of failing
+- checks the health of idle connections on checkout and reconnects if the server has gone away
+- keeps counters (checkouts, waits, in use etc.) so we can see what the pool is doing under load
+
+Every PostgresService instance borrows from the same pool so constructing stores is cheap.
+The async store uses psycopg 3's AsyncConnectionPool instead (see `get_async_pool`) which already does all of the above.
+"""
+
+import os
+import asyncio
+import time
+import typing
+import atexit
+import threading
+from collections import deque
+from contextlib import contextmanager
+import psycopg2
+import psycopg2.extensions
+from funkyprompt.core.utils import logger
+from funkyprompt.core.utils.env import (
+    POSTGRES_CONNECTION_STRING,
+    POSTGRES_POOL_MIN_SIZE,
+    POSTGRES_POOL_MAX_SIZE,
+    POSTGRES_POOL_TIMEOUT,
+    POSTGRES_POOL_HEALTH_CHECK_INTERVAL,
+    POSTGRES_PREPARED_CACHE_SIZE,
+)
+
+
+class PoolTimeout(Exception):
+    """raised when we cannot get a connection from the pool in time"""
+
+    pass
+
+
+class ConnectionPool:
+    """a thread-safe pool of psycopg2 connections
+
+    Examples:
+
+    ```python
+    pool = ConnectionPool(POSTGRES_CONNECTION_STRING, min_size=1, max_size=5)
+    with pool.connection() as conn:
+        c = conn.cursor()
+        c.execute('select 1')
+
+    pool.stats()
+    ```
+    """
+
+    def __init__(
+        self,
+        dsn: str,
+        min_size: int = 1,
+        max_size: int = 10,
+        timeout: float = 30,
+        health_check_interval: float = 30,
+        connect: typing.Callable = None,
+        configure: typing.Callable = None,
+    ):
+        """
+        Args:
+            dsn: the postgres connection string
+            min_size: connections opened up front and kept around
+            max_size: the most connections we will ever open at once
+            timeout: seconds to wait for a free connection before raising PoolTimeout
+            health_check_interval: idle connections older than this are pinged before being handed out
+            connect: the connection factory - defaults to psycopg2.connect
+            configure: called with each new connection before it is first handed out e.g. to load extensions and set session state
+        """
+        if max_size < 1 or min_size > max_size:
+            raise ValueError(f"invalid pool sizing {min_size=}, {max_size=}")
+
+        self._dsn = dsn
+        self._connect = connect or psycopg2.connect
+        self._configure = configure
+        self.min_size = min_size
+        self.max_size = max_size
+        self.timeout = timeout
+        self.health_check_interval = health_check_interval
+
+        self._cond = threading.Condition()
+        """idle connections with the time they were returned - used LIFO to keep warm connections warm"""
+        self._idle: typing.Deque[typing.Tuple[typing.Any, float]] = deque()
+        self._in_use = set()
+        """the number of connections opened or being opened"""
+        self._size = 0
+        self._closed = False
+        self._counters = {
+            "connects": 0,
+            "reconnects": 0,
+            "checkouts": 0,
+            "waits": 0,
+            "wait_time": 0.0,
+            "timeouts": 0,
+            "discarded": 0,
+        }
+
+        for _ in range(min_size):
+            with self._cond:
+                self._size += 1
+            self._idle.append((self._open(), time.monotonic()))
+
+    def __repr__(self):
+        s = self.stats()
+        return f"ConnectionPool(size={s['size']}, in_use={s['in_use']}, max_size={self.max_size})"
+
+    def _open(self):
+        """open a new connection for a slot that has already been reserved"""
+        conn = None
+        try:
+            conn = self._connect(self._dsn)
+            if self._configure:
+                """session state set here lives as long as the connection so it is set once and not per query"""
+                self._configure(conn)
+        except:
+            if conn is not None:
+                self._close_quietly(conn)
+            with self._cond:
+                self._size -= 1
+                self._cond.notify()
+            raise
+        with self._cond:
+            self._counters["connects"] += 1
+        return conn
+
+    def _is_healthy(self, conn, last_used: float) -> bool:
+        """cheap checks always and a round trip only if the connection has been idle for a while"""
+        if conn.closed:
+            return False
+        if time.monotonic() - last_used < self.health_check_interval:
+            return True
+        try:
+            c = conn.cursor()
+            c.execute("SELECT 1")
+            c.close()
+            conn.rollback()
+            return True
+        except Exception as ex:
+            logger.debug(f"pooled connection failed health check - {ex}")
+            return False
+
+    def _close_quietly(self, conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def getconn(self, timeout: float = None):
+        """borrow a connection - you must return it with `putconn` or use the `connection` context manager"""
+        timeout = self.timeout if timeout is None else timeout
+        started = time.monotonic()
+        deadline = started + timeout
+        waited = False
+        conn, last_used = None, None
+
+        with self._cond:
+            while True:
+                if self._closed:
+                    raise PoolTimeout("the connection pool is closed")
+                if self._idle:
+                    conn, last_used = self._idle.pop()
+                    break
+                if self._size < self.max_size:
+                    """reserve a slot and connect outside the lock"""
+                    self._size += 1
+                    break
+                waited = True
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._counters["timeouts"] += 1
+                    raise PoolTimeout(
+                        f"timed out after {timeout}s waiting for one of {self.max_size} connections"
+                    )
+                self._cond.wait(remaining)
+
+            if waited:
+                self._counters["waits"] += 1
+                self._counters["wait_time"] += time.monotonic() - started
+
+        if conn is None:
+            conn = self._open()
+        elif not self._is_healthy(conn, last_used):
+            """the server may have restarted or dropped us - reuse the slot for a fresh connection"""
+            self._close_quietly(conn)
+            conn = self._open()
+            with self._cond:
+                self._counters["reconnects"] += 1
+
+        with self._cond:
+            self._in_use.add(conn)
+            self._counters["checkouts"] += 1
+        return conn
+
+    def putconn(self, conn, discard: bool = False):
+        """return a connection to the pool. broken connections or those we are asked to discard are closed"""
+        with self._cond:
+            self._in_use.discard(conn)
+
+        if not discard and not conn.closed:
+            try:
+                """never hand out a connection with an open transaction"""
+                if (
+                    conn.get_transaction_status()
+                    != psycopg2.extensions.TRANSACTION_STATUS_IDLE
+                ):
+                    conn.rollback()
+            except Exception:
+                discard = True
+
+        with self._cond:
+            if discard or conn.closed or self._closed:
+                self._size -= 1
+                self._counters["discarded"] += 1
+                self._close_quietly(conn)
+            else:
+                self._idle.append((conn, time.monotonic()))
+            self._cond.notify()
+
+    @contextmanager
+    def connection(self, timeout: float = None):
+        """borrow a connection for the duration of the block"""
+        conn = self.getconn(timeout=timeout)
+        try:
+            yield conn
+        except:
+            """if the error killed the connection it will be discarded"""
+            self.putconn(conn, discard=bool(conn.closed))
+            raise
+        else:
+            self.putconn(conn)
+
+    def stats(self) -> dict:
+        """pool level counters - checkouts, waits etc. are cumulative and in_use, idle, size are current"""
+        with self._cond:
+            return {
+                "min_size": self.min_size,
+                "max_size": self.max_size,
+                "size": self._size,
+                "in_use": len(self._in_use),
+                "idle": len(self._idle),
+                **self._counters,
+            }
+
+    def close(self):
+        """close idle connections and refuse new checkouts - connections in use are closed when returned"""
+        with self._cond:
+            self._closed = True
+            idle = list(self._idle)
+            self._idle.clear()
+            self._size -= len(idle)
+            self._cond.notify_all()
+        for conn, _ in idle:
+            self._close_quietly(conn)
+
+
+_pool: ConnectionPool = None
+_pool_pid: int = None
+_pool_lock = threading.Lock()
+
+
+def _configure_connection(conn):
+    """pooled connections load age and put it on the search path once when they are opened so cypher queries need no preamble.
+    databases without age still get a working connection for plain sql
+    """
+    try:
+        c = conn.cursor()
+        c.execute("LOAD 'age'")
+        c.execute('SET search_path = ag_catalog, "$user", public')
+        c.close()
+        conn.commit()
+    except psycopg2.Error as ex:
+        logger.warning(f"Failed to initialise the age extension on a pooled connection - {ex}")
+        conn.rollback()
+
+
+def get_pool() -> ConnectionPool:
+    """the process-wide pool - created lazily and recreated after a fork since connections cannot be shared across processes"""
+    global _pool, _pool_pid
+    if _pool is not None and _pool_pid == os.getpid():
+        return _pool
+    with _pool_lock:
+        if _pool is None or _pool_pid != os.getpid():
+            _pool = ConnectionPool(
+                POSTGRES_CONNECTION_STRING,
+                min_size=POSTGRES_POOL_MIN_SIZE,
+                max_size=POSTGRES_POOL_MAX_SIZE,
+                timeout=POSTGRES_POOL_TIMEOUT,
+                health_check_interval=POSTGRES_POOL_HEALTH_CHECK_INTERVAL,
+                configure=_configure_connection,
+            )
+            _pool_pid = os.getpid()
+        return _pool
+
+
+def close_pool():
+    """close the process-wide pool e.g. on shutdown"""
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.close()
+            _pool = None
+
+
+atexit.register(close_pool)
+
+
+_async_pool = None
+_async_pool_lock: asyncio.Lock = None
+
+
+def _register_vector_dumpers(conn, oid: int):
+    """bind PgVector parameters to the (extension) vector type - binary when psycopg chooses it, text otherwise"""
+    from psycopg.adapt import Dumper
+    from psycopg.pq import Format
+    from funkyprompt.core.types.sql import PgVector
+
+    class VectorTextDumper(Dumper):
+        def dump(self, obj):
+            return obj.text().encode()
+
+    class VectorBinaryDumper(Dumper):
+        format = Format.BINARY
+
+        def dump(self, obj):
+            return obj.binary()
+
+    VectorTextDumper.oid = VectorBinaryDumper.oid = oid
+    conn.adapters.register_dumper(PgVector, VectorTextDumper)
+    conn.adapters.register_dumper(PgVector, VectorBinaryDumper)
+
+
+async def _configure_async_connection(conn):
+    """async connections load age, set the search path and learn the vector type once when they are opened"""
+    try:
+        async with conn.cursor() as c:
+            await c.execute("LOAD 'age'")
+            await c.execute('SET search_path = ag_catalog, "$user", public')
+        await conn.commit()
+    except Exception as ex:
+        logger.warning(f"Failed to initialise the age extension on an async connection - {ex}")
+        await conn.rollback()
+
+    from psycopg.types import TypeInfo
+
+    info = await TypeInfo.fetch(conn, "vector")
+    await conn.commit()
+    if info:
+        """registering the type info lets lists of vectors be sent as vector[]"""
+        info.register(conn)
+        _register_vector_dumpers(conn, info.oid)
+    """psycopg prepares queries server side (protocol level) and keeps an lru of them per connection"""
+    conn.prepared_max = POSTGRES_PREPARED_CACHE_SIZE
+
+
+async def get_async_pool():
+    """the process-wide async pool - opened lazily on the running event loop.
+    this needs psycopg 3 which is an optional dependency `pip install "psycopg[binary,pool]"`
+    """
+    global _async_pool, _async_pool_lock
+    if _async_pool is not None:
+        return _async_pool
+    if _async_pool_lock is None:
+        _async_pool_lock = asyncio.Lock()
+    async with _async_pool_lock:
+        if _async_pool is None:
+            try:
+                from psycopg_pool import AsyncConnectionPool
+            except ImportError as iex:
+                raise ImportError(
+                    "The async postgres service requires psycopg 3 - install it with `pip install 'psycopg[binary,pool]'`"
+                ) from iex
+
+            pool = AsyncConnectionPool(
+                POSTGRES_CONNECTION_STRING,
+                min_size=POSTGRES_POOL_MIN_SIZE,
+                max_size=POSTGRES_POOL_MAX_SIZE,
+                timeout=POSTGRES_POOL_TIMEOUT,
+                configure=_configure_async_connection,
+                kwargs={"prepare_threshold": 1},
+                check=AsyncConnectionPool.check_connection,
+                open=False,
+            )
+            await pool.open()
+            _async_pool = pool
+    return _async_pool
+
+
+async def close_async_pool():
+    """close the async pool e.g. in an app shutdown hook"""
+    global _async_pool
+    if _async_pool is not None:
+        await _async_pool.close()
+        _async_pool = None
@@ -9,20 +9,47 @@ In funkyprompt the game is to play nice with AbstractModels so that the postgres
 """
 
 import json
+import uuid
+import time
 import typing
 import psycopg2
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from funkyprompt.core import AbstractModel, AbstractEntity, AbstractEdge, AbstractContentModel
 from funkyprompt.services.data import DataServiceBase
-from funkyprompt.core.utils.env import POSTGRES_CONNECTION_STRING, AGE_GRAPH
+from funkyprompt.services.data.pool import get_pool, ConnectionPool
+from funkyprompt.services.data.embedding_queue import EmbeddingQueue, forget_embedding_table
+from funkyprompt.services.data.prepared import execute_prepared, prepared_stats
+from funkyprompt.services.data.graph_snapshot import GraphSnapshot, get_graph_snapshot, current_graph_snapshot
+from funkyprompt.core.utils.env import (
+    POSTGRES_CONNECTION_STRING,
+    AGE_GRAPH,
+    BULK_COPY_THRESHOLD,
+    DEFER_EMBEDDINGS,
+    ASK_PARALLEL,
+    ASK_POLICY,
+    ASK_LEXICAL,
+    ASK_STRATEGY_TIMEOUT,
+    POSTGRES_POOL_MAX_SIZE,
+    GRAPH_SNAPSHOT,
+)
 from funkyprompt.core.utils import logger
-from funkyprompt.core.types.sql import VectorSearchOperator
-from funkyprompt.entities import resolve as resolve_entity
+from funkyprompt.core.types.sql import FULL_TEXT_COLUMN, PgVector, VectorSearchOperator, CopyStream, copy_csv_row
+from funkyprompt.entities import resolve as resolve_entity, entity_registry
 from pydantic._internal._model_construction import ModelMetaclass
 import re
 
-def cypher_with_age_wrapper(q: str, returns=None):
+"""AGE is loaded and on the search path per session - pooled connections do this when they are opened (see `services.data.pool`)"""
+AGE_PREAMBLE = """LOAD 'age';
+        SET search_path = ag_catalog, "$user", public;"""
+
+
+def cypher_with_age_wrapper(q: str, returns=None, preamble: bool = False, params: bool = False):
     """wrapper a cypher query - specify the return variables expected"""
     """try infer how many terms so we can create a clause for the AGE wrapper"""
+    """pooled sessions have already loaded age and set the search path - the preamble is only for scripts run elsewhere e.g. psql"""
+    """with params the cypher query can use $parameters from an agtype map passed as the one query parameter %s (prepared statements only - age wants a server side parameter)"""
     
     return_clause_regex = r"RETURN\s+([\w\s,]+)"
     if not returns and q:
@@ -30,17 +57,60 @@ def cypher_with_age_wrapper(q: str, returns=None):
             returns = [f"n{i}" for i, term in enumerate(match.group(1).split(','))]
     
     returns = f",".join([f'{n} agtype' for n in returns or ['n']])
+    params = ", %s" if params else ""
 
-    return (
-        f""" LOAD 'age';
-        SET search_path = ag_catalog, "$user", public;
-        SELECT * 
+    query = f"""SELECT * 
         FROM cypher('{AGE_GRAPH}', $$
             {q}
-        $$) as ({returns});"""
-        if q
-        else None
-    )
+        $${params}) as ({returns});"""
+    if preamble:
+        query = f""" {AGE_PREAMBLE}
+        {query}"""
+
+    return query if q else None
+
+
+_executor: ThreadPoolExecutor = None
+_executor_lock = threading.Lock()
+
+
+def _ask_executor() -> ThreadPoolExecutor:
+    """a shared pool for running ask strategies in parallel - the strategies borrow from the connection pool
+    so it is sized like the pool and parallel strategies never queue for more connections than there are
+    """
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=POSTGRES_POOL_MAX_SIZE, thread_name_prefix="funky-ask")
+    return _executor
+
+
+"""the deadline of the ask strategy running on this thread - its queries get a statement timeout so abandoned strategies give back their connections"""
+_strategy_context = threading.local()
+
+
+def _statement_timeout_ms() -> typing.Optional[int]:
+    deadline = getattr(_strategy_context, "deadline", None)
+    if deadline is None:
+        return None
+    return max(1, int((deadline - time.monotonic()) * 1000))
+
+
+def _bounded(strategy: typing.Callable, deadline: float) -> typing.Callable:
+    """run the strategy with its deadline on the worker thread"""
+
+    def run():
+        _strategy_context.deadline = deadline
+        try:
+            return strategy()
+        finally:
+            _strategy_context.deadline = None
+
+    return run
+
+
+"""tables known to have (or not have) the full text column"""
+_FULL_TEXT_TABLES: typing.Dict[str, bool] = {}
 
 
 def _parse_vertex_result(x):
@@ -63,7 +133,8 @@ def _parse_vertex_result(x):
             "name": name,
         }
    
-        d["model"] = resolve_entity(**d)
+        """an indexed lookup - the label is unambiguous where names or namespaces contain underscores"""
+        d["model"] = entity_registry.resolve(label=x["label"]) or resolve_entity(**d)
 
         return d
     except:
@@ -73,31 +144,61 @@ class GraphManager:
     def __init__(self, service: "PostgresService"):
         self._service = service
         
-    def query_by_path(cls, path, edge_name='TAG', filter_node_types: typing.Optional[str] = None):
+    def query_by_path(
+        cls,
+        path,
+        edge_name='TAG',
+        filter_node_types: typing.Optional[str] = None,
+        use_snapshot: bool = None,
+    ):
         """
         given a path A/B/C we query nodes connected along edges (tags)
+        with the graph snapshot enabled (FUNKY_GRAPH_SNAPSHOT) the names are matched in process and only the entity lookup goes to the database
         """
         
         #TEMP - we can do multiple easily enough
         if isinstance(path,str):
             path = [path]
                     
-        if len(path):
-            """for any number of matches"""
-            predicates = f" OR ".join([f"( b.name = '{p.split('/')[0]}' and c.name = '{p.split('/')[1]}' )" for p in path])
-            Q = f"""MATCH (a)-[:{edge_name}]->(b)-[:{edge_name}]->(c)
-            WHERE {predicates}
-            RETURN a
-            """
-
-            logger.trace(f"Query names {Q=}")
-            data = cls._service._execute_cypher(Q)
-            names = [json.loads(d['n'].split('::')[0]).get('properties',{}).get('name') for d in data]
-            
-            logger.debug(f"Query names {names=}")
-            return cls._service.select_by_names(names)
-        else:
+        if not len(path):
             raise Exception("You must pass a set of paths of the form A/B")
+
+        if (GRAPH_SNAPSHOT if use_snapshot is None else use_snapshot) and edge_name == 'TAG':
+            try:
+                names = cls.snapshot().query_by_path(path, label=filter_node_types)
+                logger.debug(f"Query names from the graph snapshot {names=}")
+                return cls._service.select_by_names(names)
+            except Exception as ex:
+                """age is the source of truth"""
+                logger.warning(f"Failed to query the graph snapshot - querying the graph instead - {ex}")
+
+        """for any number of matches"""
+        predicates = f" OR ".join([f"( b.name = '{p.split('/')[0]}' and c.name = '{p.split('/')[1]}' )" for p in path])
+        Q = f"""MATCH (a)-[:{edge_name}]->(b)-[:{edge_name}]->(c)
+        WHERE {predicates}
+        RETURN a
+        """
+
+        logger.trace(f"Query names {Q=}")
+        data = cls._service._execute_cypher(Q)
+        names = [json.loads(d['n'].split('::')[0]).get('properties',{}).get('name') for d in data]
+        
+        logger.debug(f"Query names {names=}")
+        return cls._service.select_by_names(names)
+
+    def snapshot(cls, refresh: bool = False) -> GraphSnapshot:
+        """the in-process snapshot of the tag graph - see `services.data.graph_snapshot`"""
+        return get_graph_snapshot(cls._service, refresh=refresh)
+
+    def neighbourhood(cls, name: str, hops: int = 1) -> typing.Dict[str, int]:
+        """the names of the nodes within some hops of the named node and their distance - from the graph snapshot"""
+        return cls.snapshot().neighbourhood(name, hops=hops)
+
+    def co_occurring_tags(cls, tag: str, limit: int = 10) -> typing.List[typing.Tuple[str, int]]:
+        """the tags most often used together with the tag - from the graph snapshot"""
+        return cls.snapshot().co_occurring_tags(tag, limit=limit)
+
+
 class PostgresService(DataServiceBase):
     """the postgres service wrapper for sinking and querying entities/models
 
@@ -123,15 +224,33 @@ class PostgresService(DataServiceBase):
     # run any query (store.execute) or do vector search
     store.ask(question="are there any projects about sirsh's interests")
 
+    # stream large tables without loading them into memory (store.execute_iter for any query)
+    for p in store.select_iter(itersize=1000):
+        ...
+
     ```
     """
 
     def __init__(self, model: AbstractModel):
-        self.conn = psycopg2.connect(POSTGRES_CONNECTION_STRING)
         """we do this because its easy for user to assume the instance is what we want instead of the type"""
         model = AbstractModel.ensure_model_not_instance(model)
         self.model = model
 
+    @property
+    def pool(self) -> ConnectionPool:
+        """connections are borrowed from the process-wide pool per query so stores are cheap to construct"""
+        return get_pool()
+
+    @staticmethod
+    def pool_stats() -> dict:
+        """stats for the shared connection pool e.g. checkouts, waits, in use"""
+        return get_pool().stats()
+
+    @staticmethod
+    def prepared_stats() -> dict:
+        """stats for the prepared statements e.g. prepares, executes, hits, evictions"""
+        return prepared_stats()
+
     def _alter_model(cls):
         """try to alter the table by adding new columns only"""
         raise NotImplementedError("alter table not yet implemented")
@@ -161,6 +280,9 @@ class PostgresService(DataServiceBase):
             """
             script = cypher_with_age_wrapper(cls.model.cypher().create_script())
             cls.execute(script)
+            """ivfflat lists are trained on the data so those indexes should be built after loading - see `create_vector_indexes`"""
+            if cls.model.sql().vector_index["method"] == "hnsw":
+                cls.create_vector_indexes(concurrently=False)
             logger.info(f"updated {cls.model.get_model_fullname()}")
         except Exception as pex:
             if pex is psycopg2.errors.DuplicateTable:
@@ -168,6 +290,39 @@ class PostgresService(DataServiceBase):
             else:
                 raise
 
+    def migrate_to_embedding_table(cls):
+        """move the inline embeddings of the model to its embedding table and create the view joining them.
+        set `embeddings_inline = False` on the model Config (or the env FUNKY_EMBEDDINGS_INLINE) to search and write the new layout
+        """
+        cls.execute(cls.model.sql().embedding_table_migration_script())
+        """queue workers in this process look for the side table again rather than writing to the dropped columns"""
+        forget_embedding_table(cls.model.sql().table_name)
+        if not cls.model.sql().embeddings_inline:
+            cls.create_vector_indexes()
+
+    def create_vector_indexes(cls, concurrently: bool = True, quantization: str = None):
+        """create the ann indexes for the embedding columns as configured on the model (hnsw by default)
+        concurrent builds do not lock the table for writes so this can be run against a live table
+        the quantization (halfvec, binary or none) defaults to the model config
+        """
+        scripts = cls.model.sql().vector_index_scripts(
+            concurrently=concurrently, quantization=quantization
+        )
+        if not scripts:
+            return
+        with cls.pool.connection() as conn:
+            """CREATE INDEX CONCURRENTLY cannot run inside a transaction block"""
+            conn.autocommit = True
+            try:
+                c = conn.cursor()
+                for script in scripts:
+                    logger.debug(script)
+                    started = time.time()
+                    c.execute(script)
+                    logger.info(f"built vector index in {time.time() - started:.1f}s")
+            finally:
+                conn.autocommit = False
+
     def __drop_table__(cls):
         """drop the table - really just for testing and not something we would likely do often"""
         script = f"drop table {cls.model.get_model_fullname()}"
@@ -181,9 +336,12 @@ class PostgresService(DataServiceBase):
         data: tuple = None,
         as_upsert: bool = False,
         page_size: int = 100,
+        prepare: bool = False,
     ):
         """run any sql query
         this works only for selects and transactional updates without selects
+        a pooled connection is borrowed for the query and if the connection is lost (e.g. server restart) we retry once on a fresh one
+        hot queries with a fixed shape can be run as prepared statements (see `services.data.prepared`)
         """
         
         # lets not do this for a moment
@@ -192,31 +350,102 @@ class PostgresService(DataServiceBase):
         
         if not query:
             return
+        if as_upsert and data is not None and not isinstance(data, list):
+            """batches may be generators and we need to be able to replay them on retry"""
+            data = list(data)
+        for attempt in range(2):
+            with cls.pool.connection() as conn:
+                try:
+                    return cls._execute(
+                        conn, query, data, as_upsert=as_upsert, page_size=page_size, prepare=prepare
+                    )
+                except (psycopg2.OperationalError, psycopg2.InterfaceError):
+                    if conn.closed and attempt == 0:
+                        logger.warning(f"Lost the connection running a query for model {cls.model} - retrying on a new connection")
+                    else:
+                        raise
+            """the broken connection has been discarded by the pool at this point"""
+
+    def _execute(
+        cls,
+        conn,
+        query: str,
+        data: tuple = None,
+        as_upsert: bool = False,
+        page_size: int = 100,
+        prepare: bool = False,
+    ):
+        """run the query on a borrowed connection"""
         try:
-            c = cls.conn.cursor()
-            if as_upsert:
-                psycopg2.extras.execute_values(
-                    c, query, data, template=None, page_size=page_size
+            c = conn.cursor()
+            if (timeout := _statement_timeout_ms()) is not None:
+                """inside a parallel ask strategy - the query cannot outlive the strategy"""
+                c.execute(f"SET LOCAL statement_timeout = {timeout}")
+            if prepare:
+                execute_prepared(c, query, data)
+                result = c.fetchall() if c.description else None
+            elif as_upsert:
+                """fetch the RETURNING rows of every page and not just the last one"""
+                result = psycopg2.extras.execute_values(
+                    c,
+                    query,
+                    data,
+                    template=None,
+                    page_size=page_size,
+                    fetch="RETURNING" in query.upper(),
                 )
             else:
                 c.execute(query, data)
+                result = c.fetchall() if c.description else None
 
-            if c.description:
-                result = c.fetchall()
+            if c.description and result is not None:
                 """if we have and updated and read we can commit and send,
                 otherwise we commit outside this block"""
-                cls.conn.commit()
+                conn.commit()
                 column_names = [desc[0] for desc in c.description or []]
                 result = [dict(zip(column_names, r)) for r in result]
                 return result
             """case of upsert no-query transactions"""
-            cls.conn.commit()
+            conn.commit()
         except Exception as pex:
             logger.warning(f"Failing to execute query {query} for model {cls.model} - Postgres error: {pex}, {data}")
-            cls.conn.rollback()
+            if not conn.closed:
+                conn.rollback()
             raise
-        finally:
-            cls.conn.close
+
+    def execute_iter(
+        cls,
+        query: str,
+        data: tuple = None,
+        itersize: int = 2000,
+    ) -> typing.Iterator[dict]:
+        """stream the results of a select query using a named (server side) cursor
+        rows are yielded as dicts and only `itersize` rows are held in client memory at any time
+        so memory stays flat for any table size. The pooled connection is held until the iterator is exhausted or closed
+
+        Args:
+            query: a select query
+            data: optional query parameters
+            itersize: the number of rows fetched from the server per round trip
+        """
+        if not query:
+            return
+        with cls.pool.connection() as conn:
+            try:
+                with conn.cursor(name=f"funky_{uuid.uuid4().hex}") as c:
+                    c.itersize = itersize
+                    c.execute(query, data)
+                    column_names = None
+                    for r in c:
+                        if column_names is None:
+                            column_names = [desc[0] for desc in c.description]
+                        yield dict(zip(column_names, r))
+                conn.commit()
+            except Exception as pex:
+                logger.warning(f"Failing to stream query {query} for model {cls.model} - Postgres error: {pex}, {data}")
+                if not conn.closed:
+                    conn.rollback()
+                raise
 
     def _execute_cypher(
         cls,
@@ -233,6 +462,43 @@ class PostgresService(DataServiceBase):
         """run an upsert sql query"""
         return cls.execute(query, data=data, page_size=page_size, as_upsert=True)
 
+    def execute_copy_upsert(cls, records: typing.List[dict], returning: str | typing.List[str] = None):
+        """bulk upsert serialized records by streaming them with COPY into a temp staging table and merging with one INSERT ... ON CONFLICT.
+        This avoids the round trips and statement parsing of batched inserts for large ingests.
+        The csv format is used because psycopg2 has no binary encoders for arrays, json etc.
+
+        Args:
+            records: records serialized for the database (see `SqlHelper.serialize_for_db`)
+            returning: the columns to return from the merge - defaults to the narrow `SqlHelper.upsert_returning`
+        """
+        helper = cls.model.sql()
+        staging_table = f"_funky_staging_{uuid.uuid4().hex[:12]}"
+        fields = helper.field_names
+        lines = (copy_csv_row([r.get(f) for f in fields]) for r in records)
+
+        started = time.time()
+        with cls.pool.connection() as conn:
+            try:
+                c = conn.cursor()
+                c.execute(helper.copy_staging_script(staging_table))
+                c.copy_expert(helper.copy_query(staging_table), CopyStream(lines))
+                c.execute(helper.merge_from_staging_query(staging_table, returning=returning))
+                result = c.fetchall() if c.description else []
+                column_names = [desc[0] for desc in c.description or []]
+                """the staging table is dropped on commit"""
+                conn.commit()
+            except Exception as pex:
+                logger.warning(f"Failing to bulk load {len(records)} records for model {cls.model} - Postgres error: {pex}")
+                if not conn.closed:
+                    conn.rollback()
+                raise
+
+        elapsed = max(time.time() - started, 1e-6)
+        logger.info(
+            f"Bulk loaded {len(records)} records into {helper.table_name} in {elapsed:.2f}s ({len(records)/elapsed:.0f} rows/s)"
+        )
+        return [dict(zip(column_names, r)) for r in result]
+
     @classmethod
     def create_model(cls, model: AbstractModel):
         """creates the model based on the type.
@@ -249,6 +515,17 @@ class PostgresService(DataServiceBase):
 
     def queue_update_embeddings(self, result: typing.List[dict]):
         """embeddings in general should be processed async
+        when we insert some data, we read back a result with ids and we queue a job per record and embedding field.
+        workers (see `EmbeddingWorkerPool` or `funkyprompt embed`) drain the queue and write the embeddings
+        """
+        if not self.model.get_embedding_fields():
+            """no embeddings, no op"""
+            return
+
+        return EmbeddingQueue().enqueue(self.model, result)
+
+    def update_embeddings(self, result: typing.List[dict]):
+        """the inline alternative to queueing embeddings
         when we insert some data, we read back a result with ids and column data for embeddings
         we then use whatever provided to get an embedding tensor and save it to the database
         this insert could be inline or adjacent table
@@ -264,14 +541,14 @@ class PostgresService(DataServiceBase):
         embeddings = embed_frame(
             result,
             field_mapping=self.model.get_embedding_fields(),
+            providers=self.model.get_embedding_providers(),
             id_column=helper.id_field,
         )
 
-        query = helper.embedding_fields_partial_update_query(batch_size=len(result))
+        """written to the inline columns or the embedding table depending on the model layout"""
+        query, data = helper.embedding_update(embeddings)
 
-        return self.execute_upsert(
-            query=query, data=(helper.partial_model_tuple(e) for e in embeddings)
-        )
+        return self.execute_upsert(query=query, data=data)
         
     def select_by_names(self, names: typing.List[str]):
         """name lookup"""
@@ -282,9 +559,9 @@ class PostgresService(DataServiceBase):
         column: str = "name"
         """selects one by name using the internal model"""
         table_name = self.model.get_model_fullname()
-        fields = ",".join(self.model.sql().field_names)
+        fields = self.model.sql().select_list
         q = f"""SELECT { fields } FROM {table_name} where {column} = ANY(%s);"""
-        data = self.execute(q,names)
+        data = self.execute(q, (names,), prepare=True)
         if len(data):
             logger.debug(f"Fetched {len(data)} related entries")
             """TODO: trace loaded keys here and elsewhere as this is like citations"""
@@ -294,19 +571,36 @@ class PostgresService(DataServiceBase):
     def select_one(self, name: str, column: str = "name"):
         """selects one by name using the internal model"""
         table_name = self.model.get_model_fullname()
-        fields = ",".join(self.model.sql().field_names)
-        q = f"""SELECT { fields } FROM {table_name} where {column} = '{name}' limit 1"""
-        data = self.execute(q)
+        fields = self.model.sql().select_list
+        q = f"""SELECT { fields } FROM {table_name} where {column} = %s limit 1"""
+        data = self.execute(q, (name,), prepare=True)
         if len(data):
             return self.model(**dict(data[0]))
         
     def select(self, limit:int=None):
         """selects top records ordered by date desc"""
         table_name = self.model.get_model_fullname()
-        fields = ",".join(self.model.sql().field_names)
-        q = f"""SELECT { fields } FROM {table_name} order by created_at desc limit {limit or 10}"""
-        data = self.execute(q)
+        fields = self.model.sql().select_list
+        q = f"""SELECT { fields } FROM {table_name} order by created_at desc limit %s"""
+        data = self.execute(q, (limit or 10,), prepare=True)
         return [self.model(**dict(d)) for d in data]
+
+    def select_iter(self, limit: int = None, itersize: int = 2000, as_model: bool = True):
+        """lazily select all (or the top `limit`) records ordered by date desc e.g. for exports or re-embedding large tables
+        records are streamed from a server side cursor - see `execute_iter`
+
+        Args:
+            limit: optional limit - by default the entire table is streamed
+            itersize: the number of rows fetched from the server per round trip
+            as_model: yield model instances (default) or raw dicts
+        """
+        table_name = self.model.get_model_fullname()
+        fields = self.model.sql().select_list
+        q = f"""SELECT { fields } FROM {table_name} order by created_at desc"""
+        if limit:
+            q += f" limit {int(limit)}"
+        for d in self.execute_iter(q, itersize=itersize):
+            yield self.model(**d) if as_model else d
         
 
     def __getitem__(self, name: str):
@@ -316,67 +610,119 @@ class PostgresService(DataServiceBase):
         return entity
 
     @classmethod
-    def get_nodes_by_name(cls, name: str, default_model: AbstractEntity = None) -> typing.List[AbstractEntity]:
+    def get_nodes_by_name(
+        cls, name: str | typing.List[str], default_model: AbstractEntity = None
+    ) -> typing.List[AbstractEntity]:
         """the node mode is only useful when we are invariant to types,
         because we can resolve nodes even when we dont know their type.
         Suppose an LLM knows that something _is_ an entity but does not know what it is
         we can match ANY nodes in the graph and then when we know the label->entity map
-        we can then select one by one.
-        We can make this more efficient in a number of ways but for now it provides a nice
-        entity resolution route for agent
-        Examples of optimization:
-        - cached types in the instance
-        - async parallel search over nodes
+        we can load the typed entities.
+        One cypher query matches all the names and the typed records are loaded with one query for all labels
+        so the latency does not grow with the number of hits
+
+        Args:
+            name: one or more names
+            default_model: the type to assume if the names are not in the graph
         """
-        
-        
+        names = name if isinstance(name, list) else [name]
+        names = [n for n in names if n]
+        if not names:
+            return []
 
-        cypher_query = f"""MATCH (v {{name:'{name}'}}) RETURN v, label(v) AS nodelLabel"""
-        data = cls(AbstractEntity).query_graph(cypher_query)
+        cypher_query = f"""MATCH (v) WHERE v.name IN $names RETURN v, label(v) AS nodelLabel"""
+        data = cls(AbstractEntity).query_graph(cypher_query, params={"names": names})
         """do the entity wrapper stuff here
            should return an expanded abstract model i.e. one with lots of metadata in a structure e.g. desc, data, available functions
         """
-
-        """we can wrap the entities when we know their type when they match name
-           we need to do multiple select_ones for each matched type here (TODO:)
-        """
         data = [_parse_vertex_result(x) for x in data]
         if not len(data):
             """we are going to try and use graph nodes to manage any type but we can also just assume one exists on this entity type"""
-            data = [ {'name':name, 'model': default_model } ]
-            
+            data = [{'name': n, 'model': default_model} for n in names]
 
-        """a not so efficient way to load entities but fine for now"""
-        valid_entities = []
+        """group the names by type - labels without a known type are loaded as content models"""
+        groups = {}
         for d in data:
             try:
                 model = d.get('model')
                 if not model:
-                    """or we can resolve the entire thing for proper schema"""
                     model = AbstractContentModel.create_model(name=d['entity_model_name'], namespace=d['entity_model_namespace'])
-                    
-                """sketches: we want a generalized way to load entities and register their metadata"""
-                e = cls(model).select_one(d["name"])
-                if e:
-                    valid_entities.append(e)
+                key = model.get_model_fullname()
+                groups.setdefault(key, (model, []))[1].append(d["name"])
             except Exception as ex:
-                import traceback
-                logger.warning(f"Failed to load an entity from the graph node - {d} - {traceback.format_exc()}")
-                
-              
+                logger.warning(f"Failed to resolve a type for the graph node - {d} - {traceback.format_exc()}")
+
+        return cls(AbstractEntity)._select_typed_by_names(list(groups.values()))
+
+    def _select_typed_by_names(
+        self, groups: typing.List[typing.Tuple[AbstractModel, typing.List[str]]]
+    ) -> typing.List[AbstractModel]:
+        """load records of several types by name in one round trip - each table contributes rows as json to one union query.
+        if the union fails (e.g. a table for one label does not exist) we fall back to a query per type
+        """
+        if not groups:
+            return []
+        parts, params = [], []
+        for i, (model, names) in enumerate(groups):
+            helper = model.sql()
+            parts.append(
+                f"""SELECT {i} AS _group, row_to_json(t)::text AS _row FROM (
+                SELECT {",".join(helper.field_names)} FROM {helper.table_name} WHERE name = ANY(%s)) t"""
+            )
+            params.append(names)
+        try:
+            data = self.execute("\nUNION ALL\n".join(parts), tuple(params))
+            return [groups[d["_group"]][0](**json.loads(d["_row"])) for d in data]
+        except Exception as ex:
+            logger.warning(f"Failed to load the entities in one query - {ex} - loading per type")
+
+        valid_entities = []
+        for model, names in groups:
+            try:
+                valid_entities += PostgresService(model).select_by_names(names) or []
+            except Exception as ex:
+                logger.warning(f"Failed to load {model.get_model_fullname()} entities {names} - {ex}")
         return valid_entities
 
-    def query_graph(self, query: str, returns: typing.List[str]=None):
+    def query_graph(self, query: str, returns: typing.List[str]=None, params: dict = None):
         """query the graph with a valid cypher query
         Args:
             query: a cypher query
             returns: a list of return variables e.g. n,e,r - defaults to n i.e. a single result column
+            params: values for $parameters in the cypher query - parameterised queries are run as prepared statements
         """
         ###
         """AGE/postgres runs cypher with some boilerplate"""
-        query = cypher_with_age_wrapper(query,returns=returns)
+        if params is not None:
+            query = cypher_with_age_wrapper(query, returns=returns, params=True)
+            return self.execute(query, (json.dumps(params),), prepare=True)
+        query = cypher_with_age_wrapper(query, returns=returns)
         return self.execute(query)
 
+    def execute_graph_batches(self, batches: typing.List[typing.Tuple[str, dict]]) -> list:
+        """run parameterised cypher statements e.g. the UNWIND batches from the CypherHelper - each statement shape is prepared once per connection"""
+        results = []
+        for query, params in batches:
+            logger.trace(query)
+            results += self.query_graph(query, params=params) or []
+        return results
+
+    def upsert_graph_paths(self, records: typing.List[AbstractEntity], batch_size: int = None) -> list:
+        """merge the tag paths of the records into the graph in a few statements (one per label and chunk of `batch_size` paths)"""
+        result = self.execute_graph_batches(
+            self.model.cypher().upsert_path_batches(records, batch_size=batch_size)
+        )
+        if (snapshot := current_graph_snapshot()) is not None:
+            """the graph has the paths now so the snapshot can have them too"""
+            snapshot.add_paths(self.model.cypher().path_rows(records))
+        return result
+
+    def upsert_graph_relationships(self, records: typing.List[AbstractEntity], batch_size: int = None) -> list:
+        """merge the nodes and edges of the relationship fields of the records - one statement per label or edge type and chunk of `batch_size`"""
+        return self.execute_graph_batches(
+            self.model.cypher().upsert_relationships_batches(records, batch_size=batch_size)
+        )
+
     def ask_graph(self, question: str):
         """map the question into a valid cypher query and execute query on the graph"""
         query = self.model.cypher().query_from_natural_language(question)
@@ -388,11 +734,28 @@ class PostgresService(DataServiceBase):
         question: str,
         after_date: typing.Optional[dict] | str = None,
         limit: int = None,
+        parallel: bool = None,
+        policy: str = None,
+        timeouts: typing.Dict[str, float] = None,
+        lexical: bool = None,
         **kwargs,
     ):
         """
         a high level interface that determines the correct mode of query from natural language question
         different possible avenues from here... experimental
+
+        the strategies (entity lookup, graph, sql and vector search) can run one after another falling through on empty results
+        or in parallel where latency is bounded by the slowest useful strategy rather than the sum of all of them
+
+        Args:
+            question: the question
+            after_date: (unused) a temporal predicate
+            limit: (unused) a result limit
+            parallel: run the recommended strategies at once - defaults to the env `FUNKY_ASK_PARALLEL`
+            policy: in parallel mode `first` returns the results of the highest priority strategy to find something
+              and `merge` waits for all and returns their rows as one list in priority order without duplicates - defaults to the env `FUNKY_ASK_POLICY`
+            timeouts: seconds per strategy (entity, graph, sql, vector) - slower strategies are abandoned and their queries are cancelled by a statement timeout
+            lexical: add a full text pass to the vector search (one more query) - defaults to the env `FUNKY_ASK_LEXICAL`
         """
 
         from funkyprompt.core.agents import QueryClassifier
@@ -406,40 +769,47 @@ class PostgresService(DataServiceBase):
             )
         )
 
-        print(self.model, classification)
+        logger.debug(f"{self.model} {classification}")
 
         """we should audit all query decisions - maybe as an async task
         below this is framed as an either or to put pressure on the decision maker
         but we could also do this as a parallel search, try to avoid false fetches and combine
         """
+        strategies = self._ask_strategies(question, classification, lexical=lexical)
+        if ASK_PARALLEL if parallel is None else parallel:
+            return self._run_strategies_parallel(
+                strategies, policy=policy or ASK_POLICY, timeouts=timeouts
+            )
 
-        results = {}
+        for name, strategy in strategies.items():
+            if name != "vector":
+                if result := strategy():
+                    return result
+                continue
+            try:
+                return strategy()
+            except:
+                #because we do this aspirationally we only error if the recommended type was vector
+                if classification.recommend_query_type == "VECTOR":
+                    raise
+                logger.warning(f"The vector search failed - {traceback.format_exc()}")
+        return []
+
+    def _ask_strategies(self, question: str, classification, lexical: bool = None) -> typing.Dict[str, typing.Callable]:
+        """the strategies the classifier recommends in priority order - each returns empty results when it does not find anything"""
+        from funkyprompt.core.agents import QueryClassifier
+
+        strategies = {}
         # we should try to avoid using general entity terms and use this just for specific things
-        if classification.recommend_query_type == "ENTITY":
-            for e in classification.entities:
-                for r in self.get_nodes_by_name(e, default_model=self.model):
-                    results[r.id] = r
-            # if we have nothing, try the other options
-            if len(results):
-                return list(results.values())
+        if classification.recommend_query_type == "ENTITY" and classification.entities:
+            strategies["entity"] = lambda: self._ask_entities(classification.entities)
 
         # if we have a high confidence query and it works, do this
-         
-        if classification.cypher_query:
-            query = classification.cypher_query.get('query')
-            confidence = classification.cypher_query.get('confidence')
-            #this is a low confidence threshold for now to test
-            
-            if confidence > 0.5:
-                data = self._execute_cypher(query)
-                data = [_parse_vertex_result(x) for x in data]
-                if len(data):
-                    print(data)
-                    return {
-                        'hint': "These are results from a graph search. You can lookup this set of entities using the entity lookup and supplying a list of names without asking for help",
-                        'data': data
-                    }
-        
+        cypher = classification.cypher_query or {}
+        #this is a low confidence threshold for now to test
+        if cypher.get("query") and (cypher.get("confidence") or 0) > 0.5:
+            strategies["graph"] = lambda: self._ask_graph(cypher["query"])
+
         if (
             classification.sql_query
             and classification.sql_query_confidence_based_on_model
@@ -447,33 +817,119 @@ class PostgresService(DataServiceBase):
         ):
             # TODO: manage thresholds and multiple queries
             # TODO drop embeddings from the result that is returned
-            data = self.execute(classification.sql_query)
-            if len(data):
-                return data
-
-         
-        """fall back to a vector search - a temporal predicate will be needed here"""
-        count_vector_result = 0
-        vector_keys = []
-        for q in classification.decomposed_questions:
-            try:
-                for r in self.vector_search(q):
-                    results[r["id"]] = r
-                    vector_keys.append(r['name'])
-                    count_vector_result+= 1
-            except:
-                #because we do this aspirationally we only error if the recommended type was vector
-                if classification.recommend_query_type == 'VECTOR':
-                    raise
+            strategies["sql"] = lambda: self.execute(classification.sql_query)
+
+        """fall back to a vector (and full text when we have it) search - a temporal predicate will be needed here"""
+        strategies["vector"] = lambda: self._ask_vector(
+            question, classification.decomposed_questions, lexical=lexical
+        )
+        return strategies
+
+    def _ask_entities(self, entities: typing.List[str]):
+        results = {}
+        for r in self.get_nodes_by_name(entities, default_model=self.model):
+            results[r.id] = r
+        return list(results.values())
+
+    def _ask_graph(self, query: str):
+        data = self._execute_cypher(query)
+        data = [_parse_vertex_result(x) for x in data]
+        if len(data):
+            return {
+                'hint': "These are results from a graph search. You can lookup this set of entities using the entity lookup and supplying a list of names without asking for help",
+                'data': data
+            }
+
+    def _ask_vector(self, question: str, decomposed_questions: typing.List[str], lexical: bool = None):
+        results = {}
+        """all the decomposed questions cost one embedding call and one query"""
+        found = self.vector_search_many(decomposed_questions or [question])
+        records = [r for rs in found.values() for r in rs]
+        if (ASK_LEXICAL if lexical is None else lexical) and self.has_full_text():
+            """and (opt-in) lexical matches for any exact keywords in the question"""
+            records += self.hybrid_search(question, use_vector=False)
+        for r in records:
+            results[r["id"]] = r
         #telemetry
-        logger.debug(f"fetched {count_vector_result} using vector search: keys {vector_keys}")
+        logger.debug(f"fetched {len(records)} using vector search: keys {[r['name'] for r in records]}")
         return list(results.values())
 
+    def _run_strategies_parallel(
+        self,
+        strategies: typing.Dict[str, typing.Callable],
+        policy: str = "first",
+        timeouts: typing.Dict[str, float] = None,
+    ):
+        """run the strategies on the shared pool - strategies that time out are abandoned (their threads finish in the background)
+        the strategies are in priority order (as the classifier recommends them) and under the `first` policy a result is only accepted
+        once every higher priority strategy has come back empty, failed or timed out - a fast low priority strategy does not beat a slower better one.
+        strategies that have not started when there is a winner are cancelled so they do not take pooled connections
+        """
+        if policy not in ["first", "merge"]:
+            raise ValueError(f"Unknown ask policy {policy} - use first or merge")
+        timeouts = timeouts or {}
+        started = time.monotonic()
+        deadlines = {
+            name: started + timeouts.get(name, ASK_STRATEGY_TIMEOUT) for name in strategies
+        }
+        futures = {
+            name: _ask_executor().submit(_bounded(strategy, deadlines[name]))
+            for name, strategy in strategies.items()
+        }
+        results = {}
+        pending = dict(futures)
+        while pending:
+            timeout = max(0, min(deadlines[n] for n in pending) - time.monotonic())
+            done, _ = wait(pending.values(), timeout=timeout, return_when=FIRST_COMPLETED)
+            for name, f in list(pending.items()):
+                if f in done:
+                    pending.pop(name)
+                    try:
+                        results[name] = f.result()
+                    except Exception as ex:
+                        logger.warning(f"The {name} strategy failed - {ex}")
+                elif time.monotonic() >= deadlines[name]:
+                    pending.pop(name)
+                    logger.warning(f"The {name} strategy timed out")
+
+            if policy == "first":
+                for name in futures:
+                    if name in pending:
+                        """a higher priority strategy may still find something"""
+                        break
+                    if results.get(name):
+                        for f in pending.values():
+                            f.cancel()
+                        logger.debug(f"ask strategy {name} won after {time.monotonic() - started:.2f}s")
+                        return results[name]
+
+        logger.debug(f"ask strategies finished {list(results)} after {time.monotonic() - started:.2f}s")
+        if policy == "first":
+            return []
+        return self._merge_results([results[name] for name in futures if results.get(name)])
+
+    def _merge_results(self, results: typing.List[typing.Any]) -> list:
+        """the rows of each strategy in priority order as one list - rows found by more than one strategy are kept once (by the model key)"""
+        key = self.model.sql().id_field
+        merged, seen = [], set()
+        for rows in results:
+            for r in rows if isinstance(rows, list) else [rows]:
+                k = r.get(key) if isinstance(r, dict) else getattr(r, key, None)
+                if k is not None:
+                    if str(k) in seen:
+                        continue
+                    seen.add(str(k))
+                merged.append(r)
+        return merged
+
     def vector_search(
         self,
         question: str,
-        search_operator: VectorSearchOperator = VectorSearchOperator.INNER_PRODUCT,
+        search_operator: VectorSearchOperator = None,
         limit: int = 7,
+        ef_search: int = None,
+        probes: int = None,
+        quantization: str = None,
     ):
         """
         search the model' embedding content
@@ -481,8 +937,11 @@ class PostgresService(DataServiceBase):
 
         Args:
             question: a natural language question
-            search_operator: the pg_vector operator type as an enum - uses the default inner product because we use the open ai embeddings by default
+            search_operator: the pg_vector operator type as an enum - defaults to the operator of the model's vector index (inner product unless configured)
             limit: limit results to return
+            ef_search: hnsw candidate list size for this query (higher is better recall, slower) - pg default 40
+            probes: ivfflat lists to probe for this query (higher is better recall, slower) - pg default 1
+            quantization: search the halfvec or binary index and re-rank by full precision, or none - defaults to the model config
 
         Example:
 
@@ -498,50 +957,267 @@ class PostgresService(DataServiceBase):
 
         from funkyprompt.core.utils.embeddings import embed_collection
 
+        if not self.model.sql().embedding_fields:
+            raise Exception(
+                "this type does not support vector search as there are no embedding columns"
+            )
+
+        vec = embed_collection([question], provider=self._search_provider())[0]
+
+        query, params = self._vector_search_query(vec, search_operator, limit, quantization)
+        settings = self.model.sql().vector_search_settings(ef_search, probes)
+        return self.execute(settings + query, params)
+
+    def benchmark_vector_search(
+        self,
+        questions: typing.List[str],
+        limit: int = 10,
+        modes: typing.List[str] = ("none", "halfvec", "binary"),
+        ef_search: int = None,
+        build_indexes: bool = True,
+    ) -> typing.List[dict]:
+        """compare the quantization modes on this table - recall@k against the exact search, latency and index size for each mode.
+        the exact results come from a full precision scan with index scans turned off.
+        indexes for the modes are built (concurrently) unless they exist. a mode with re-ranking needs ef_search >= limit x rerank
+
+        Example:
+
+            ```python
+            store.benchmark_vector_search(["projects about graphs", "what did i read about postgres"], limit=10, ef_search=100)
+            ```
+        """
+        from funkyprompt.core.utils.embeddings import embed_collection
+
         helper = self.model.sql()
+        vecs = embed_collection(questions, provider=self._search_provider())
 
-        if not helper.embedding_fields:
+        def _search(vec, mode, settings):
+            query, params = self._vector_search_query(vec, limit=limit, quantization=mode)
+            started = time.perf_counter()
+            data = self.execute(settings + query, params)
+            return [d[helper.id_field] for d in data], (time.perf_counter() - started) * 1000
+
+        exact = [
+            set(_search(v, "none", "SET LOCAL enable_indexscan = off;")[0]) for v in vecs
+        ]
+        results = []
+        for mode in modes:
+            if build_indexes:
+                self.create_vector_indexes(quantization=mode)
+            recalls, latencies = [], []
+            for vec, truth in zip(vecs, exact):
+                ids, ms = _search(vec, mode, helper.vector_search_settings(ef_search))
+                recalls.append(len(truth & set(ids)) / len(truth) if truth else 1.0)
+                latencies.append(ms)
+            size = self.execute(
+                "SELECT coalesce(pg_relation_size(to_regclass(%s)), 0) AS bytes",
+                (helper.vector_index_name(quantization=mode),),
+            )[0]["bytes"]
+            latencies.sort()
+            results.append(
+                {
+                    "mode": mode,
+                    f"recall_at_{limit}": sum(recalls) / len(recalls),
+                    "mean_ms": sum(latencies) / len(latencies),
+                    "p95_ms": latencies[min(len(latencies) - 1, int(0.95 * len(latencies)))],
+                    "index_bytes": size,
+                }
+            )
+            logger.info(results[-1])
+        return results
+
+    def hybrid_search(
+        self,
+        question: str,
+        limit: int = 7,
+        candidates: int = None,
+        rrf_k: int = 60,
+        search_operator: VectorSearchOperator = None,
+        ef_search: int = None,
+        probes: int = None,
+        use_vector: bool = True,
+    ):
+        """
+        search with the embeddings and full text at the same time and fuse the rankings (reciprocal rank fusion) in one round trip.
+        exact keywords, names and codes that embeddings blur are found by the lexical side and the vector side finds paraphrases.
+        records that rank well in both come first - `matched_rankings` says if a record was found by one or both
+
+        Args:
+            question: a natural language question or keywords - websearch syntax works e.g. "postgres -mysql" or '"exact phrase"'
+            limit: limit results to return
+            candidates: how many results each ranking contributes before fusion - defaults to 4 times the limit
+            rrf_k: the rank fusion constant - larger values flatten the contribution of the top ranks
+            search_operator: see `vector_search`
+            ef_search: see `vector_search`
+            probes: see `vector_search`
+            use_vector: the vector ranking can be skipped e.g. when the question has been searched with `vector_search_many`
+        """
+        from funkyprompt.core.utils.embeddings import embed_collection
+
+        helper = self.model.sql()
+        lexical = self.has_full_text()
+        vector = bool(helper.embedding_fields) and use_vector
+        params = {
+            "question": question,
+            "candidates": candidates or 4 * limit,
+            "rrf_k": rrf_k,
+            "limit": limit,
+        }
+        if vector:
+            params["vec"] = PgVector(
+                embed_collection([question], provider=self._search_provider())[0]
+            )
+        query = helper.hybrid_search_query(search_operator, vector=vector, lexical=lexical)
+        settings = helper.vector_search_settings(ef_search, probes) if vector else ""
+        return self.execute(settings + query, params)
+
+    def has_full_text(self) -> bool:
+        """if the table has the generated full text column - tables created before it was added need `create_full_text_index`"""
+        table_name = self.model.get_model_fullname()
+        if table_name not in _FULL_TEXT_TABLES:
+            schema, name = table_name.split(".")
+            data = self.execute(
+                """SELECT 1 FROM information_schema.columns WHERE table_schema = %s AND table_name = %s AND column_name = %s""",
+                (schema, name, FULL_TEXT_COLUMN),
+            )
+            _FULL_TEXT_TABLES[table_name] = bool(data)
+        return _FULL_TEXT_TABLES[table_name]
+
+    def create_full_text_index(self):
+        """add the generated full text column and its GIN index to an existing table"""
+        script = self.model.sql().full_text_index_script(add_column=True)
+        if script:
+            self.execute(script)
+            _FULL_TEXT_TABLES.pop(self.model.get_model_fullname(), None)
+
+    def vector_search_many(
+        self,
+        questions: typing.List[str],
+        search_operator: VectorSearchOperator = None,
+        limit: int = 7,
+        ef_search: int = None,
+        probes: int = None,
+    ) -> typing.Dict[str, typing.List[dict]]:
+        """
+        search for several questions (e.g. the decomposed parts of one question) with one batched embedding call
+        and one query - each question vector is joined laterally to its own top `limit` records.
+        records are deduplicated by id and kept under the question they are closest to
+
+        Args:
+            questions: natural language questions
+            search_operator: see `vector_search`
+            limit: limit results per question
+            ef_search: see `vector_search`
+            probes: see `vector_search`
+
+        Returns:
+            the results for each question
+        """
+        from funkyprompt.core.utils.embeddings import embed_collection
+
+        if not self.model.sql().embedding_fields:
             raise Exception(
                 "this type does not support vector search as there are no embedding columns"
             )
+        if not questions:
+            return {}
+
+        vecs = embed_collection(questions, provider=self._search_provider())
+        query, params = self._vector_search_many_query(vecs, search_operator, limit)
+        settings = self.model.sql().vector_search_settings(ef_search, probes)
+        return self._group_by_question(questions, self.execute(settings + query, params))
+
+    @staticmethod
+    def _group_by_question(questions: typing.List[str], data: typing.List[dict]):
+        """keep each record once under its nearest question"""
+        nearest = {}
+        for d in data:
+            if d["id"] not in nearest or d["distances"] < nearest[d["id"]]["distances"]:
+                nearest[d["id"]] = d
+        results = {q: [] for q in questions}
+        for d in sorted(nearest.values(), key=lambda d: d["distances"]):
+            results[questions[d.pop("question_index") - 1]].append(d)
+        return results
+
+    def _vector_search_many_query(
+        self,
+        vecs: typing.List[typing.List[float]],
+        search_operator: VectorSearchOperator = None,
+        limit: int = 7,
+    ) -> typing.Tuple[str, dict]:
+        """the lateral top-k query for a batch of question vectors - see `_vector_search_query`"""
+        helper = self.model.sql()
+        search_operator = search_operator or helper.vector_index["operator"]
+
+        part_predicates = ""
+        if search_operator == VectorSearchOperator.INNER_PRODUCT:
+            distance_max: float = -0.79
+            part_predicates = f"WHERE nearest.distances < {distance_max}"
+
+        query = f"""SELECT q.question_index, nearest.*
+            FROM unnest(%(vecs)s::vector[]) WITH ORDINALITY AS q(vec, question_index)
+            CROSS JOIN LATERAL (
+                {helper.nearest_query('q.vec', search_operator, limit=int(limit))}
+            ) nearest {part_predicates}
+            order by q.question_index, nearest.distances ASC
+             """
+        return query, {"vecs": [PgVector(v) for v in vecs]}
+
+    def _search_provider(self) -> str:
+        """the question must be embedded by the same provider as the searched column (the first embedding field)"""
+        return next(iter(self.model.get_embedding_providers().values()))
+
+    def _vector_search_query(
+        self,
+        vec: typing.List[float],
+        search_operator: VectorSearchOperator = None,
+        limit: int = 7,
+        quantization: str = None,
+    ) -> typing.Tuple[str, dict]:
+        """build the vector search query and its params for an embedded question - shared by the sync and async stores
+        the question vector is a bound parameter that is referenced once - the inner query orders by the distance alias
+        so the planner can use the ann index and the distance threshold is applied to the top results outside
+        """
+        helper = self.model.sql()
+        """the index is only used when we search with the operator it was built for"""
+        search_operator = search_operator or helper.vector_index["operator"]
 
         """default to one for now and OR later 
         - we actually need to determine the embedding provided for each column from the metadata 
         :TODO: test the more general case of multiple columns with multiple providers when getting embeddings
         it may be a different operator is better in each case
         """
-        vec = embed_collection([question])[0]
-
-        embedding_fields = helper.embedding_fields[0]
-        select_fields = ",".join(helper.field_names)
-
-        distance_max: float = (
-            -0.79
-        )  ##TODO: this only makes sense for the neg inner product
-        part_predicates = (
-            f"{embedding_fields} {search_operator.value} '{vec}' < {distance_max}"
-        )
-
-        """distances are determined in different ways, that includes what 'large' is"""
-        distances = f"{embedding_fields} {search_operator.value} '{vec}' "
-
-        """TODO: we could make some attempt to normalize for different systems
+        """distances are determined in different ways, that includes what 'large' is
+        TODO: we could make some attempt to normalize for different systems
         the scale of divergence e.g. for NE_INNER_PRODUCT (-1 - d)"""
-        """generate the query for now for only one embedding col"""
-        query = f"""SELECT
-            {select_fields},
-            ({distances}) as distances
-            from {helper.table_name} 
-              WHERE {part_predicates}
-                order by {distances} ASC LIMIT {limit}
+        part_predicates = ""
+        if search_operator == VectorSearchOperator.INNER_PRODUCT:
+            distance_max: float = -0.79
+            part_predicates = f"WHERE distances < {distance_max}"
+
+        """generate the query for now for only one embedding col - inline or from the embedding table (see `SqlHelper.nearest_query`)"""
+        query = f"""SELECT * FROM (
+            {helper.nearest_query('%(vec)s', search_operator, limit=int(limit), quantization=quantization)}
+            ) nearest {part_predicates}
+            order by distances ASC
              """
 
-        return self.execute(query)
-    
-    
-    def update_records(self, records: typing.List[AbstractModel]):
+        return query, {"vec": PgVector(vec)}
+
+    def update_records(
+        self,
+        records: typing.List[AbstractModel],
+        defer_embeddings: bool = None,
+        returning: str | typing.List[str] = None,
+    ):
         """records are updated using typed object relational mapping.
-        the embedding update is queued
+        batches of at least `BULK_COPY_THRESHOLD` records are loaded with COPY (see `execute_copy_upsert`)
+
+        Args:
+            records: the records to upsert
+            defer_embeddings: queue the embeddings for the background workers instead of computing them inline - defaults to the env `FUNKY_DEFER_EMBEDDINGS`
+            returning: the columns to return for the upserted records - by default only the key and the embedding source fields.
+             ask for more e.g. `helper.select_list` for the model fields or `*` for every column including the vectors
         """
 
         # TODO: there is a very confusing behaviour when the update records works on dictionaries and not objects
@@ -552,20 +1228,36 @@ class PostgresService(DataServiceBase):
         something i am trying to understand is model for sub classed models e.g. missing content but
         """
         helper = self.model.sql()  
-        data = [
-            tuple(helper.serialize_for_db(r).values()) for i, r in enumerate(records)
-        ]
 
         if records:
-            query = helper.upsert_query(batch_size=len(records))
-            try:
-                result = self.execute_upsert(query=query, data=data)
-            except:
-                logger.info(f"Failing to run {query}")
-                raise
+            if len(records) >= BULK_COPY_THRESHOLD:
+                """large ingests are streamed with COPY and merged in one statement"""
+                result = self.execute_copy_upsert(
+                    [helper.serialize_for_db(r) for r in records], returning=returning
+                )
+            else:
+                data = [
+                    tuple(helper.serialize_for_db(r).values()) for i, r in enumerate(records)
+                ]
+                query = helper.upsert_query(batch_size=len(records), returning=returning)
+                try:
+                    if len(records) == 1:
+                        """single record upserts are the hot path in agent loops and have a fixed shape"""
+                        query = helper.upsert_query(
+                            batch_size=1, returning=returning, row_placeholders=True
+                        )
+                        result = self.execute(query, data[0], prepare=True)
+                    else:
+                        result = self.execute_upsert(query=query, data=data)
+                except:
+                    logger.info(f"Failing to run {query}")
+                    raise
 
-            """for now do inline but this could be an async thing to not block"""
-            self.queue_update_embeddings(result)
+            """inline by default or queued so the ingest returns immediately"""
+            if DEFER_EMBEDDINGS if defer_embeddings is None else defer_embeddings:
+                self.queue_update_embeddings(result)
+            else:
+                self.update_embeddings(result)
 
             """ <<GRAPH>>
                 add the node and edges for certain types that have unique names and are entity like
@@ -575,20 +1267,12 @@ class PostgresService(DataServiceBase):
             if issubclass(self.model, AbstractEntity):
                 """save the primary node ref - this doubles as a key-value lookup"""
                 
-                query = self.model.cypher().upsert_path_statements(records)
-                logger.trace(query)
-                _ = self._execute_cypher(query=query)
+                self.upsert_graph_paths(records)
                 
                 """al alternative options"""
-                # query = self.model.cypher().upsert_nodes_statement(records, has_full_entity=True) 
-                # logger.trace(query)
-                # _ = self._execute_cypher(query)
+                # _ = self.execute_graph_batches(self.model.cypher().upsert_nodes_batches(records, has_full_entity=True))
                 # """export all edges pointing away from each entity using the metadata"""
-                # nodes_query, edges_query = self.model.cypher().upsert_relationships_queries(records)
-                # logger.trace(nodes_query)
-                # logger.trace(edges_query)
-                # _ = self._execute_cypher(nodes_query)
-                # _ = self._execute_cypher(edges_query)
+                # _ = self.upsert_graph_relationships(records)
  
             return result
 
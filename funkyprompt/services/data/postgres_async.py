@@ -0,0 +1,308 @@
+"""
+The async postgres service runs the same typed queries as the PostgresService but on psycopg 3's async driver.
+This is useful in the FastAPI app where a blocking vector search would otherwise stall the event loop.
+Many concurrent sessions share one worker and one async connection pool without a thread per request.
+
+The async methods are the `a` prefixed counterparts of the sync ones e.g. `await store.aselect_one('test')`.
+The sync methods are inherited and still work using the sync pool.
+
+psycopg 3 is an optional dependency - `pip install "psycopg[binary,pool]"`
+"""
+
+import json
+import asyncio
+import typing
+from funkyprompt.core import AbstractModel, AbstractEntity
+from funkyprompt.core.utils import logger
+from funkyprompt.core.utils.env import DEFER_EMBEDDINGS
+from funkyprompt.core.types.sql import VectorSearchOperator, PgVector, FULL_TEXT_COLUMN
+from funkyprompt.services.data.pool import get_async_pool
+from funkyprompt.services.data.graph_snapshot import current_graph_snapshot
+from .postgres import PostgresService, cypher_with_age_wrapper, _FULL_TEXT_TABLES
+
+
+class AsyncPostgresService(PostgresService):
+    """the async postgres service for sinking and querying entities/models
+
+    Examples:
+
+    ```python
+    from funkyprompt.entities import Project
+    from funkyprompt.services import async_entity_store
+
+    store = async_entity_store(Project)
+    await store.aupdate_records(Project(name='test', description='a test project', labels=['test']))
+    await store.aselect_one('test')
+    await store.avector_search("are there any projects about sirsh's interests")
+    ```
+    """
+
+    @staticmethod
+    async def apool_stats() -> dict:
+        """stats for the shared async connection pool"""
+        return (await get_async_pool()).get_stats()
+
+    async def aexecute(
+        cls,
+        query: str,
+        data: tuple = None,
+        as_upsert: bool = False,
+        settings: str = None,
+    ):
+        """run any sql query on a pooled async connection
+        upserts are run once per row in a pipeline (psycopg 3 has no execute_values) and must use row placeholders
+        settings e.g. SET LOCAL statements run first in the same transaction - parameterised queries must be single statements
+        """
+        if not query:
+            return
+
+        pool = await get_async_pool()
+        """the pool connection context commits on success and rolls back on errors"""
+        async with pool.connection() as conn:
+            try:
+                async with conn.cursor() as c:
+                    if settings:
+                        await c.execute(settings)
+                    if as_upsert:
+                        await c.executemany(query, list(data or []), returning=True)
+                        result, column_names = [], None
+                        while True:
+                            if c.description:
+                                column_names = column_names or [d.name for d in c.description]
+                                result += await c.fetchall()
+                            if not c.nextset():
+                                break
+                    else:
+                        await c.execute(query, data)
+                        if not c.description:
+                            return
+                        column_names = [d.name for d in c.description]
+                        result = await c.fetchall()
+                    return [dict(zip(column_names, r)) for r in result]
+            except Exception as pex:
+                logger.warning(
+                    f"Failing to execute query {query} for model {cls.model} - Postgres error: {pex}, {data}"
+                )
+                raise
+
+    async def aexecute_upsert(cls, query: str, data: tuple = None):
+        """run an upsert sql query built with row placeholders"""
+        return await cls.aexecute(query, data=data, as_upsert=True)
+
+    async def _aexecute_cypher(cls, query: str):
+        """async connections are configured for age when they are opened"""
+        try:
+            return await cls.aexecute(cypher_with_age_wrapper(query))
+        except:
+            logger.warning(f"Failing to execute cypher query")
+            raise
+
+    async def aquery_graph(self, query: str, returns: typing.List[str] = None, params: dict = None):
+        """query the graph with a valid cypher query
+        Args:
+            query: a cypher query
+            returns: a list of return variables e.g. n,e,r - defaults to n i.e. a single result column
+            params: values for $parameters in the cypher query - bound server side as the agtype parameter
+        """
+        if params is not None:
+            query = cypher_with_age_wrapper(query, returns=returns, params=True)
+            return await self.aexecute(query, (json.dumps(params),))
+        query = cypher_with_age_wrapper(query, returns=returns)
+        return await self.aexecute(query)
+
+    async def aupsert_graph_paths(self, records: typing.List[AbstractEntity], batch_size: int = None) -> list:
+        """see `upsert_graph_paths`"""
+        results = []
+        for query, params in self.model.cypher().upsert_path_batches(records, batch_size=batch_size):
+            results += await self.aquery_graph(query, params=params) or []
+        if (snapshot := current_graph_snapshot()) is not None:
+            snapshot.add_paths(self.model.cypher().path_rows(records))
+        return results
+
+    async def aselect_by_names(self, names: typing.List[str]):
+        """name lookup"""
+        if not names:
+            return
+        if not isinstance(names, list):
+            names = [names]
+        table_name = self.model.get_model_fullname()
+        fields = self.model.sql().select_list
+        q = f"""SELECT { fields } FROM {table_name} where name = ANY(%s);"""
+        data = await self.aexecute(q, (names,))
+        if len(data):
+            logger.debug(f"Fetched {len(data)} related entries")
+            return [self.model(**dict(d)) for d in data]
+
+    async def aselect_one(self, name: str, column: str = "name"):
+        """selects one by name using the internal model"""
+        table_name = self.model.get_model_fullname()
+        fields = self.model.sql().select_list
+        q = f"""SELECT { fields } FROM {table_name} where {column} = %s limit 1"""
+        data = await self.aexecute(q, (name,))
+        if len(data):
+            return self.model(**dict(data[0]))
+
+    async def avector_search(
+        self,
+        question: str,
+        search_operator: VectorSearchOperator = None,
+        limit: int = 7,
+        ef_search: int = None,
+        probes: int = None,
+        quantization: str = None,
+    ):
+        """
+        search the model' embedding content - see `vector_search`
+        the embedding request is blocking (http) so it is run in a worker thread
+        """
+        from funkyprompt.core.utils.embeddings import embed_collection
+
+        if not self.model.sql().embedding_fields:
+            raise Exception(
+                "this type does not support vector search as there are no embedding columns"
+            )
+
+        vec = (
+            await asyncio.to_thread(
+                embed_collection, [question], provider=self._search_provider()
+            )
+        )[0]
+
+        query, params = self._vector_search_query(vec, search_operator, limit, quantization)
+        return await self.aexecute(
+            query,
+            params,
+            settings=self.model.sql().vector_search_settings(ef_search, probes),
+        )
+
+    async def avector_search_many(
+        self,
+        questions: typing.List[str],
+        search_operator: VectorSearchOperator = None,
+        limit: int = 7,
+        ef_search: int = None,
+        probes: int = None,
+    ):
+        """search for several questions with one embedding call and one query - see `vector_search_many`"""
+        from funkyprompt.core.utils.embeddings import embed_collection
+
+        if not self.model.sql().embedding_fields:
+            raise Exception(
+                "this type does not support vector search as there are no embedding columns"
+            )
+        if not questions:
+            return {}
+
+        vecs = await asyncio.to_thread(
+            embed_collection, questions, provider=self._search_provider()
+        )
+        query, params = self._vector_search_many_query(vecs, search_operator, limit)
+        data = await self.aexecute(
+            query,
+            params,
+            settings=self.model.sql().vector_search_settings(ef_search, probes),
+        )
+        return self._group_by_question(questions, data)
+
+    async def ahybrid_search(
+        self,
+        question: str,
+        limit: int = 7,
+        candidates: int = None,
+        rrf_k: int = 60,
+        search_operator: VectorSearchOperator = None,
+        ef_search: int = None,
+        probes: int = None,
+    ):
+        """fused full text and vector search - see `hybrid_search`"""
+        from funkyprompt.core.utils.embeddings import embed_collection
+
+        helper = self.model.sql()
+        table_name = self.model.get_model_fullname()
+        if table_name not in _FULL_TEXT_TABLES:
+            schema, name = table_name.split(".")
+            data = await self.aexecute(
+                """SELECT 1 FROM information_schema.columns WHERE table_schema = %s AND table_name = %s AND column_name = %s""",
+                (schema, name, FULL_TEXT_COLUMN),
+            )
+            _FULL_TEXT_TABLES[table_name] = bool(data)
+
+        vector = bool(helper.embedding_fields)
+        params = {
+            "question": question,
+            "candidates": candidates or 4 * limit,
+            "rrf_k": rrf_k,
+            "limit": limit,
+        }
+        if vector:
+            vec = await asyncio.to_thread(
+                embed_collection, [question], provider=self._search_provider()
+            )
+            params["vec"] = PgVector(vec[0])
+        query = helper.hybrid_search_query(
+            search_operator, vector=vector, lexical=_FULL_TEXT_TABLES[table_name]
+        )
+        return await self.aexecute(
+            query,
+            params,
+            settings=helper.vector_search_settings(ef_search, probes) if vector else None,
+        )
+
+    async def aupdate_embeddings(self, result: typing.List[dict]):
+        """the async counterpart of `update_embeddings`"""
+        from funkyprompt.core.utils.embeddings import embed_frame
+
+        helper = self.model.sql()
+
+        if not helper.embedding_fields or not result:
+            """no embeddings, no op"""
+            return
+
+        embeddings = await asyncio.to_thread(
+            embed_frame,
+            result,
+            field_mapping=self.model.get_embedding_fields(),
+            providers=self.model.get_embedding_providers(),
+            id_column=helper.id_field,
+        )
+
+        query, data = helper.embedding_update(embeddings, row_placeholders=True)
+
+        return await self.aexecute_upsert(query=query, data=data)
+
+    async def aupdate_records(
+        self,
+        records: typing.List[AbstractModel],
+        defer_embeddings: bool = None,
+        returning: str | typing.List[str] = None,
+        **kwargs,
+    ):
+        """records are updated using typed object relational mapping - see `update_records`"""
+
+        if records and not isinstance(records, list):
+            records = [records]
+
+        if not records:
+            return
+
+        helper = self.model.sql()
+        data = [tuple(helper.serialize_for_db(r).values()) for r in records]
+        query = helper.upsert_query(
+            batch_size=len(records), returning=returning, row_placeholders=True
+        )
+        try:
+            result = await self.aexecute_upsert(query=query, data=data)
+        except:
+            logger.info(f"Failing to run {query}")
+            raise
+
+        if DEFER_EMBEDDINGS if defer_embeddings is None else defer_embeddings:
+            await asyncio.to_thread(self.queue_update_embeddings, result)
+        else:
+            await self.aupdate_embeddings(result)
+
+        if issubclass(self.model, AbstractEntity):
+            """save the primary node ref - this doubles as a key-value lookup"""
+            await self.aupsert_graph_paths(records)
+
+        return result
@@ -0,0 +1,129 @@
+"""
+Prepared statements for hot queries.
+
+The lookups an agent makes in a loop (select one by name, graph node lookups, single record upserts) have the same shape every time
+and only the values change. Instead of sending fresh SQL text to be parsed and planned on every call we `PREPARE` each query shape once per connection
+and then `EXECUTE` it with the values. The statements prepared on a connection are kept in a small LRU and deallocated when evicted.
+
+Queries use `%s` placeholders as usual and the query text (which includes the table i.e. the model) is the key for the shape.
+
+```python
+with get_pool().connection() as conn:
+    c = execute_prepared(conn.cursor(), "SELECT name FROM public.project WHERE name = %s", ("test",))
+    c.fetchall()
+
+prepared_stats()
+```
+"""
+
+import re
+import typing
+import weakref
+import threading
+from collections import OrderedDict
+from psycopg2 import errors
+from funkyprompt.core.utils import logger
+from funkyprompt.core.utils.env import POSTGRES_PREPARED_CACHE_SIZE
+
+_PLACEHOLDER = re.compile(r"%%|%s")
+
+_lock = threading.Lock()
+_counters = {"prepares": 0, "executes": 0, "evictions": 0}
+
+
+def to_positional(query: str) -> typing.Tuple[str, int]:
+    """swap the driver placeholders `%s` for server side parameters $1, $2... and unescape %% - returns the query and the parameter count"""
+    count = 0
+
+    def _sub(m):
+        nonlocal count
+        if m.group(0) == "%%":
+            return "%"
+        count += 1
+        return f"${count}"
+
+    return _PLACEHOLDER.sub(_sub, query), count
+
+
+class PreparedStatementCache:
+    """the statements prepared on one connection - least recently used statements are deallocated past `max_size`"""
+
+    def __init__(self, max_size: int = None):
+        self.max_size = max_size or POSTGRES_PREPARED_CACHE_SIZE
+        self._statements: typing.OrderedDict[str, typing.Tuple[str, int]] = OrderedDict()
+        self._next = 0
+
+    def __len__(self):
+        return len(self._statements)
+
+    def statement(self, cursor, query: str) -> typing.Tuple[str, int]:
+        """the statement name and parameter count for the query - prepared on first use"""
+        if query in self._statements:
+            self._statements.move_to_end(query)
+            return self._statements[query]
+
+        while len(self._statements) >= self.max_size:
+            _, (evicted, _) = self._statements.popitem(last=False)
+            cursor.execute(f"DEALLOCATE {evicted}")
+            with _lock:
+                _counters["evictions"] += 1
+
+        self._next += 1
+        name = f"funky_stmt_{self._next}"
+        positional, count = to_positional(query.strip().rstrip(";"))
+        cursor.execute(f"PREPARE {name} AS {positional}")
+        """only cache statements that were successfully prepared"""
+        self._statements[query] = (name, count)
+        with _lock:
+            _counters["prepares"] += 1
+        logger.trace(f"prepared {name} - {query}")
+        return name, count
+
+    def forget(self, query: str):
+        self._statements.pop(query, None)
+
+
+"""caches die with their connection - a reconnect starts with nothing prepared"""
+_caches: "weakref.WeakKeyDictionary[typing.Any, PreparedStatementCache]" = weakref.WeakKeyDictionary()
+
+
+def get_statement_cache(conn) -> PreparedStatementCache:
+    """connections are only used by one thread at a time (they are checked out of the pool) so the cache needs no lock of its own"""
+    with _lock:
+        if conn not in _caches:
+            _caches[conn] = PreparedStatementCache()
+        return _caches[conn]
+
+
+def execute_prepared(cursor, query: str, data: typing.Sequence = None):
+    """execute the query as a prepared statement on the cursor's connection - the cursor can then be fetched as usual
+    errors in the query itself e.g. a constraint violation leave the statement prepared so it stays cached - forgetting it would leak a statement on the server
+    """
+    cache = get_statement_cache(cursor.connection)
+    name, count = cache.statement(cursor, query)
+    data = tuple(data or ())
+    if len(data) != count:
+        raise ValueError(f"The query expects {count} parameters but {len(data)} were given")
+    try:
+        if count:
+            cursor.execute(f"EXECUTE {name} ({', '.join(['%s'] * count)})", data)
+        else:
+            cursor.execute(f"EXECUTE {name}")
+    except errors.InvalidSqlStatementName:
+        """the statement is gone server side e.g. it was deallocated - prepare again next time"""
+        cache.forget(query)
+        raise
+    with _lock:
+        _counters["executes"] += 1
+    return cursor
+
+
+def prepared_stats() -> dict:
+    """process-wide counters - executes that did not need a prepare are the cache hits"""
+    with _lock:
+        return {
+            **_counters,
+            "hits": _counters["executes"] - _counters["prepares"],
+            "connections": len(_caches),
+            "statements": sum(len(c) for c in _caches.values()),
+        }
@@ -0,0 +1,51 @@
+import time
+from funkyprompt.entities import Project
+from funkyprompt.core.agents.QueryClassifier import ClassificationCache, QueryClassifier
+
+
+def _classification(**kwargs):
+    return QueryClassifier(decomposed_questions=["what projects are there"], recommend_query_type="VECTOR", **kwargs)
+
+
+def test_cache_hits_for_normalised_questions_and_expires():
+    cache = ClassificationCache(ttl=0.2)
+    cache.put(Project, "What projects are there?", _classification())
+    hit = cache.get(Project, "  what projects are  there ")
+    assert hit is not None and hit.recommend_query_type == "VECTOR"
+
+    """a cached classification is a copy"""
+    hit.recommend_query_type = "SQL"
+    assert cache.get(Project, "what projects are there").recommend_query_type == "VECTOR"
+
+    time.sleep(0.25)
+    assert cache.get(Project, "what projects are there") is None
+
+
+def test_cache_evicts_least_recently_used_and_matches_near_duplicates():
+    cache = ClassificationCache(max_size=2, similarity_threshold=0.8, embedding_provider="local")
+    cache.put(Project, "list all of the projects about postgres", _classification())
+    cache.put(Project, "b", _classification())
+    cache.put(Project, "c", _classification())
+    assert cache.get(Project, "list all of the projects about postgres") is None
+
+    cache.put(Project, "list all of the projects about postgres", _classification())
+    assert cache.get(Project, "list all the projects about postgres") is not None
+    assert cache.get(Project, "sourdough bread recipes") is None
+    assert cache.stats()["semantic_hits"] == 1
+
+
+def test_schema_hash_is_memoized_and_embedding_failures_skip_the_cache(monkeypatch):
+    from funkyprompt.core.agents.QueryClassifier import _SCHEMA_HASHES
+
+    _SCHEMA_HASHES.pop(Project, None)
+    calls = []
+    prompt = Project.get_model_as_prompt
+    monkeypatch.setattr(Project, "get_model_as_prompt", classmethod(lambda cls: calls.append(1) or prompt()))
+    ClassificationCache.schema_hash(Project)
+    ClassificationCache.schema_hash(Project)
+    assert len(calls) == 1, "the model prompt is not rebuilt per lookup"
+
+    cache = ClassificationCache(similarity_threshold=0.8, embedding_provider="nowhere")
+    cache.put(Project, "what projects are there", _classification())
+    assert cache.stats()["size"] == 0
+    assert cache.get(Project, "what projects are there") is None
@@ -0,0 +1,42 @@
+from funkyprompt.core.AbstractModel import Edge, Node
+from funkyprompt.entities import Project
+
+
+def test_graph_paths_are_merged_in_unwind_batches():
+    projects = [Project(name=f"p{i}", description="test", graph_paths=["Topic/Graphs", "Topic/Graphs"]) for i in range(5)]
+    batches = Project.cypher().upsert_path_batches(projects, batch_size=2)
+
+    """duplicate paths are sent once and the rows are chunked - the statement shape is the same for every chunk"""
+    assert [len(params["rows"]) for _, params in batches] == [2, 2, 1]
+    assert len({query for query, _ in batches}) == 1
+    query, params = batches[0]
+    assert "UNWIND $rows AS r" in query and "MERGE (a:public_project {name: r.name})" in query
+    assert params["rows"][0] == {"name": "p0", "b": "Topic", "c": "Graphs"}
+    assert "p0" not in query
+
+
+def test_nodes_and_edges_are_batched_by_label():
+    nodes = Project.cypher().upsert_nodes_batches([Node(name="a"), Node(name="b", node_type="public.task"), Node(name="a")], has_full_entity=True)
+    assert sorted(len(p["rows"]) for _, p in nodes) == [1, 1]
+    assert any("MERGE (n:public_task {name: r.name})" in q and "SET n.entity = 1" in q for q, _ in nodes)
+
+    edges = [
+        Edge(source_node=Node(name=f"s{i}", node_type="public.project"), target_node=Node(name="t", node_type="public.task"), description="d", type="HAS_TASK")
+        for i in range(3)
+    ]
+    ((query, params),) = Project.cypher().upsert_edges_batches(edges)
+    assert "-[e:HAS_TASK {name: r.edge_name}]->(b:public_task {name: r.target})" in query
+    assert "e.description = r.attributes.description" in query and len(params["rows"]) == 3
+
+
+def test_relationships_are_merged_as_node_then_edge_batches():
+    from funkyprompt.entities.nodes import PersonPreferences
+
+    people = [PersonPreferences(name=f"u{i}", related_entities={"Tom": "friend", "Ann": "sister"}) for i in range(2)]
+    batches = PersonPreferences.cypher().upsert_relationships_batches(people)
+
+    """the two target nodes are merged once and before the four edges that use them"""
+    (nodes, node_params), (edges, edge_params) = batches
+    assert "MERGE (n:generic {name: r.name})" in nodes and [r["name"] for r in node_params["rows"]] == ["Tom", "Ann"]
+    assert "->(b:generic {name: r.target})" in edges and len(edge_params["rows"]) == 4
+    assert all("Tom" not in q and "u0" not in q for q, _ in batches)
@@ -0,0 +1,196 @@
+from funkyprompt.core.types.sql import pg_array_literal, copy_csv_row, CopyStream
+from funkyprompt.entities import Project
+
+
+def test_pg_array_literal_quotes_like_postgres():
+    """we should store the same text as an INSERT of a python list into a text column"""
+    assert pg_array_literal(["a", "b"]) == "{a,b}"
+    assert pg_array_literal(["a b", 'q"', None, ""]) == '{"a b","q\\"",NULL,""}'
+
+
+def test_copy_csv_row():
+    """None is the unquoted empty string (NULL) and everything else is quoted"""
+    row = copy_csv_row([None, "", 'say "hi"', ["x", "y z"], {"k": 1}, True, 3])
+    assert row == ',"","say ""hi""","{x,""y z""}","{""k"": 1}","true","3"\n'
+
+
+def test_copy_stream_reads_in_chunks():
+    stream = CopyStream(copy_csv_row([i]) for i in range(100))
+    chunks = []
+    while chunk := stream.read(64):
+        chunks.append(chunk)
+    assert "".join(chunks) == "".join(copy_csv_row([i]) for i in range(100))
+
+
+def test_merge_from_staging_query():
+    helper = Project.sql()
+    q = helper.merge_from_staging_query("_staging")
+    assert f"ON CONFLICT ({helper.id_field})" in q
+    assert f"DISTINCT ON ({helper.id_field})" in q
+    assert helper.copy_query("_staging").startswith("COPY _staging (")
+
+
+def test_vector_index_scripts_follow_model_config():
+    from funkyprompt.core import AbstractModel
+    from funkyprompt.core.fields.annotations import OpenAIEmbeddingField
+
+    class Indexed(AbstractModel):
+        class Config:
+            name: str = "indexed"
+            namespace: str = "public"
+            vector_index = {"method": "ivfflat", "operator": "cosine", "lists": 500}
+
+        id: str
+        text: str = OpenAIEmbeddingField()
+
+    (script,) = Indexed.sql().vector_index_scripts()
+    assert "CREATE INDEX CONCURRENTLY IF NOT EXISTS public_indexed_text_embedding_ivfflat_idx" in script
+    assert "USING ivfflat (text_embedding vector_cosine_ops) WITH (lists = 500)" in script
+
+    """the default is an hnsw index for the inner product operator we search with"""
+    (script,) = Project.sql().vector_index_scripts(concurrently=False)
+    assert "CONCURRENTLY" not in script and "USING hnsw (" in script and "vector_ip_ops" in script
+    assert Project.sql().vector_search_settings(ef_search=100) == "SET LOCAL hnsw.ef_search = 100;"
+
+
+def test_pg_vector_encodings():
+    import struct
+    import psycopg2.extensions
+    from funkyprompt.core.types.sql import PgVector
+
+    v = PgVector([0.5, -0.25, 1e-7])
+    assert psycopg2.extensions.adapt(v).getquoted() == b"'[0.5,-0.25,1e-07]'::vector"
+    assert struct.unpack(">HH3f", v.binary())[:2] == (3, 0)
+
+
+def test_vector_search_binds_the_vector_once():
+    from funkyprompt.core.types.sql import PgVector
+    from funkyprompt.services.data.postgres import PostgresService
+
+    query, params = PostgresService(Project)._vector_search_query([0.1] * 1536, limit=3)
+    assert query.count("%(vec)s") == 1 and "0.1" not in query
+    assert isinstance(params["vec"], PgVector)
+    assert "ORDER BY distances ASC LIMIT 3" in query
+
+
+def test_full_text_column_and_hybrid_query():
+    helper = Project.sql()
+    script = helper.create_script()
+    assert "search_tsv tsvector GENERATED ALWAYS AS (setweight(to_tsvector('english', coalesce(description::text, '')), 'A')) STORED" in script
+    assert "USING GIN (search_tsv)" in script
+
+    q = helper.hybrid_search_query()
+    assert "websearch_to_tsquery('english', %(question)s)" in q and "%(vec)s" in q
+    assert "sum(1.0 / (%(rrf_k)s + rank))" in q
+
+    lexical_only = helper.hybrid_search_query(vector=False)
+    assert "%(vec)s" not in lexical_only and "UNION ALL" not in lexical_only
+
+
+def test_vector_search_many_is_one_lateral_query_grouped_by_nearest_question():
+    from funkyprompt.services.data.postgres import PostgresService
+
+    store = PostgresService(Project)
+    query, params = store._vector_search_many_query([[0.1] * 3, [0.2] * 3], limit=5)
+    assert "unnest(%(vecs)s::vector[]) WITH ORDINALITY" in query and "CROSS JOIN LATERAL" in query
+    assert len(params["vecs"]) == 2
+
+    rows = [
+        {"question_index": 1, "id": "a", "distances": -0.9},
+        {"question_index": 1, "id": "b", "distances": -0.8},
+        {"question_index": 2, "id": "b", "distances": -0.95},
+    ]
+    grouped = store._group_by_question(["q1", "q2"], rows)
+    assert [r["id"] for r in grouped["q1"]] == ["a"]
+    assert [r["id"] for r in grouped["q2"]] == ["b"]
+
+
+def test_helpers_are_compiled_once_per_model():
+    helper = Project.sql()
+    assert Project.sql() is helper and Project.cypher() is Project.cypher()
+
+    """restricted fields are not on the model - the shared field list must not grow"""
+    fields = list(helper.field_names)
+    q = helper.partial_update_query(["name", "description_embedding"], batch_size=10)
+    assert "description_embedding" in q and helper.field_names == fields
+    assert helper.partial_update_query(["name", "description_embedding"], batch_size=2) is q
+
+    row = helper.partial_model_tuple({"name": "test"})
+    assert len(row) == len(fields) and row[fields.index("name")] == "test"
+    assert helper.select_fields_with_dummies()["name"] != "test"
+
+
+def test_upserts_return_a_narrow_projection_by_default():
+    helper = Project.sql()
+    embedded = list(Project.get_embedding_fields())
+    assert helper.upsert_returning == ", ".join([helper.id_field] + embedded)
+    assert helper.upsert_query(batch_size=1).endswith(f"RETURNING {helper.upsert_returning};")
+    assert helper.merge_from_staging_query("_staging").endswith(f"RETURNING {helper.upsert_returning};")
+
+    """the embedding update sends the vectors and only needs the keys back"""
+    assert helper.embedding_fields_partial_update_query(batch_size=1).endswith(f"RETURNING {helper.id_field};")
+
+    """fuller projections are explicit"""
+    assert helper.upsert_query(batch_size=1, returning="*").endswith("RETURNING *;")
+    assert helper.upsert_query(batch_size=1, returning=["id", "name", "id"]).endswith("RETURNING id, name;")
+
+
+def test_embedding_side_table_layout():
+    from funkyprompt.core import AbstractModel
+    from funkyprompt.core.fields.annotations import OpenAIEmbeddingField
+
+    class SideTable(AbstractModel):
+        class Config:
+            name: str = "side_table"
+            namespace: str = "public"
+            embeddings_inline = False
+
+        id: str
+        text: str = OpenAIEmbeddingField()
+
+    helper = SideTable.sql()
+    script = helper.create_script()
+    """the entity table is narrow - the vectors live in the side table and the view puts them back together"""
+    assert "text_embedding vector" not in script
+    assert "CREATE TABLE IF NOT EXISTS public.side_table_embeddings" in script and "PRIMARY KEY (id, field)" in script
+    assert "e0.embedding AS text_embedding" in script and "e0.field = 'text'" in script
+
+    (index,) = helper.vector_index_scripts()
+    assert "ON public.side_table_embeddings USING hnsw ((embedding::vector(1536)) vector_ip_ops)" in index
+    assert "WHERE field = 'text'" in index
+
+    nearest = helper.nearest_query("%(vec)s", limit=3)
+    assert "FROM public.side_table_embeddings e JOIN public.side_table t ON t.id = e.id" in nearest
+    assert "(e.embedding::vector(1536) <#> %(vec)s) AS distances" in nearest
+
+    query, rows = helper.embedding_update([{"id": "a", "text_embedding": [0.5, 0.5]}])
+    assert query.startswith("INSERT INTO public.side_table_embeddings (id, field, embedding)")
+    assert [(i, f, list(v.values)) for i, f, v in rows] == [("a", "text", [0.5, 0.5])]
+
+
+def test_quantized_index_and_rerank_query():
+    from funkyprompt.core import AbstractModel
+    from funkyprompt.core.fields.annotations import OpenAIEmbeddingField
+
+    class Quantized(AbstractModel):
+        class Config:
+            name: str = "quantized"
+            namespace: str = "public"
+            vector_index = {"quantization": {"text": "binary"}, "rerank": 10}
+
+        id: str
+        text: str = OpenAIEmbeddingField()
+
+    helper = Quantized.sql()
+    (script,) = helper.vector_index_scripts()
+    assert "public_quantized_text_embedding_binary_hnsw_idx" in script
+    assert "USING hnsw ((binary_quantize(text_embedding)::bit(1536)) bit_hamming_ops)" in script
+
+    """candidates are found by hamming distance over the index expression and re-ranked by the full precision distance"""
+    q = helper.nearest_query("%(vec)s", limit=5)
+    assert "ORDER BY binary_quantize(t.text_embedding)::bit(1536) <~> binary_quantize(%(vec)s)::bit(1536)" in q
+    assert "LIMIT 5 * 10" in q and "(c._embedding <#> %(vec)s) AS distances" in q
+
+    (halfvec,) = helper.vector_index_scripts(quantization="halfvec")
+    assert "((text_embedding)::halfvec(1536)) halfvec_ip_ops" in halfvec
+    assert "c._embedding" not in helper.nearest_query("%(vec)s", limit=5, quantization="none")
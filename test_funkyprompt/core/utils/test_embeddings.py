@@ -0,0 +1,156 @@
+from funkyprompt.core.utils.embeddings import EmbeddingCache, SqliteEmbeddingStore
+
+
+class CountingEmbedder:
+    """a stand in for the provider that counts what it is asked to embed"""
+
+    def __init__(self):
+        self.calls = []
+
+    def __call__(self, texts):
+        self.calls.append(list(texts))
+        return [[float(len(t)), 1.0] for t in texts]
+
+
+def test_cache_only_embeds_new_distinct_text(tmp_path):
+    embedder = CountingEmbedder()
+    cache = EmbeddingCache(store=SqliteEmbeddingStore(str(tmp_path / "e.db")))
+
+    first = cache.embed(["a", "bb", "a"], provider="openai", model="m", embed_fn=embedder)
+    assert first == [[1.0, 1.0], [2.0, 1.0], [1.0, 1.0]]
+    assert embedder.calls == [["a", "bb"]], "duplicates in a batch should be embedded once"
+
+    second = cache.embed(["bb", "a", "ccc"], provider="openai", model="m", embed_fn=embedder)
+    assert second == [[2.0, 1.0], [1.0, 1.0], [3.0, 1.0]]
+    assert embedder.calls[-1] == ["ccc"]
+
+
+def test_cache_is_persistent_and_keyed_by_model(tmp_path):
+    embedder = CountingEmbedder()
+    path = str(tmp_path / "e.db")
+    EmbeddingCache(store=SqliteEmbeddingStore(path)).embed(["a"], "openai", "m", embedder)
+
+    """a new process (cache) reads from the local store"""
+    cache = EmbeddingCache(store=SqliteEmbeddingStore(path))
+    cache.embed(["a"], "openai", "m", embedder)
+    assert len(embedder.calls) == 1 and cache.stats()["hit_rate"] == 1.0
+
+    cache.embed(["a"], "openai", "other-model", embedder)
+    assert len(embedder.calls) == 2
+
+
+class StandInEmbeddingServer:
+    """a local http server that speaks the openai embeddings api - the first `fail_first` requests get a 503"""
+
+    def __init__(self, fail_first: int = 0):
+        import json
+        import threading
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+        server = self
+        self.requests = []
+        self.fail_first = fail_first
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+                server.requests.append(body["input"])
+                if len(server.requests) <= server.fail_first:
+                    self.send_response(503)
+                    self.end_headers()
+                    return
+                """return the data out of order to check that the client sorts by index"""
+                data = [
+                    {"object": "embedding", "index": i, "embedding": [float(len(t)), 0.5]}
+                    for i, t in enumerate(body["input"])
+                ][::-1]
+                payload = json.dumps(
+                    {
+                        "object": "list",
+                        "data": data,
+                        "model": body["model"],
+                        "usage": {"prompt_tokens": 1, "total_tokens": 1},
+                    }
+                ).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+        self.base_url = f"http://127.0.0.1:{self.httpd.server_address[1]}/v1"
+
+    def close(self):
+        self.httpd.shutdown()
+
+
+def test_client_batches_concurrently_and_preserves_order():
+    from funkyprompt.core.utils.embeddings import EmbeddingClient
+
+    server = StandInEmbeddingServer(fail_first=1)
+    try:
+        client = EmbeddingClient(
+            base_url=server.base_url,
+            api_key="test",
+            max_tokens_per_batch=10,
+            max_concurrency=3,
+            requests_per_minute=0,
+            backoff=0.01,
+        )
+        texts = ["x" * (i % 7 + 1) for i in range(40)]
+        vectors = client.embed(texts)
+        assert vectors == [[float(len(t)), 0.5] for t in texts]
+
+        stats = client.stats()
+        assert stats["requests"] == len(client.batches(texts)) > 1
+        assert stats["retries"] == 1 and stats["inputs"] == 40
+    finally:
+        server.close()
+
+
+def test_local_provider_is_fast_normalised_and_similarity_preserving():
+    import time
+    import numpy as np
+    from funkyprompt.core.utils.embeddings import embed_collection, get_provider
+
+    provider = get_provider("local")
+    texts = [f"record {i} about postgres vector search and graphs" for i in range(2000)]
+    started = time.time()
+    vectors = np.array(embed_collection(texts, provider="local"))
+    assert vectors.shape == (2000, provider.dimensions)
+    assert len(texts) / (time.time() - started) > 1000, "should embed thousands of texts per second"
+    assert np.allclose(np.linalg.norm(vectors, axis=1), 1.0, atol=1e-5)
+
+    a, b, c = np.array(
+        provider.embed(["installing postgres on the mac", "install postgres on a mac", "sourdough bread recipes"])
+    )
+    assert a @ b > a @ c
+    assert provider.embed(["same"]) == provider.embed(["same"])
+
+
+def test_local_provider_builds_its_projection_on_first_embed():
+    from funkyprompt.core.utils.embeddings import HashingEmbeddingProvider
+
+    provider = HashingEmbeddingProvider(dimensions=8, buckets=64)
+    assert provider._projection is None, "registering the provider should not need numpy"
+    assert len(provider.embed(["hello"])[0]) == 8 and provider.projection.shape == (64, 8)
+
+
+def test_embedding_columns_are_sized_by_provider():
+    from funkyprompt.core import AbstractModel
+    from funkyprompt.core.fields.annotations import LocalEmbeddingField, OpenAIEmbeddingField
+
+    class LocalThings(AbstractModel):
+        id: str
+        text: str = LocalEmbeddingField()
+        other: str = OpenAIEmbeddingField()
+
+    script = LocalThings.sql().create_script()
+    assert "text_embedding vector(384)" in script
+    assert "other_embedding vector(1536)" in script
+    assert LocalThings.get_embedding_providers() == {"text": "local", "other": "openai"}
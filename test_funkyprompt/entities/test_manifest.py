@@ -0,0 +1,29 @@
+import json
+from funkyprompt.entities import Project, Task
+from funkyprompt.entities.registry import EntityRegistry
+from funkyprompt.entities.manifest import write_manifest, load_manifest
+
+
+def test_registry_resolves_from_the_manifest_without_discovery(tmp_path):
+    path = write_manifest(tmp_path / "manifest.json", entities=[Project, Task])
+
+    def loader():
+        raise AssertionError("discovery should not run when the manifest knows the type")
+
+    registry = EntityRegistry(loader=loader, manifest=lambda: load_manifest(path))
+    assert registry.resolve("public.project") is Project
+    assert registry.resolve(label="public_task") is Task
+    described = registry.describe()
+    assert set(described) == {"public.project", "public.task"}
+    assert described["public.project"]["about"] == Project.get_model_description()
+
+
+def test_stale_manifest_is_ignored(tmp_path):
+    path = write_manifest(tmp_path / "manifest.json", entities=[Project])
+    manifest = json.loads(path.read_text())
+    manifest["fingerprint"] = "stale"
+    path.write_text(json.dumps(manifest))
+
+    assert load_manifest(path) is None
+    registry = EntityRegistry(loader=lambda: [Project, Task], manifest=lambda: load_manifest(path))
+    assert registry.resolve("public.task") is Task
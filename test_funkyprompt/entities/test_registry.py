@@ -0,0 +1,33 @@
+from funkyprompt.core import AbstractEntity
+from funkyprompt.entities import Project, Task
+from funkyprompt.entities.registry import EntityRegistry
+
+
+def test_registry_loads_once_and_indexes_types():
+    calls = []
+
+    def loader():
+        calls.append(1)
+        return [Project, Task]
+
+    registry = EntityRegistry(loader=loader)
+    assert registry.resolve("public.project") is Project
+    assert registry.resolve(label="public_task") is Task
+    assert set(registry.namespace("public")) == {Project, Task}
+    registry.resolve("public.nothing")
+    assert len(calls) == 1
+
+
+def test_dynamic_registration_hooks_and_invalidation():
+    registry = EntityRegistry(loader=lambda: [Project])
+    seen = []
+    registry.add_hook(seen.append)
+
+    Dynamic = AbstractEntity.create_model(name="dynamic", namespace="test")
+    registry.register(Dynamic)
+    assert seen == [Dynamic]
+    assert registry.resolve("test.dynamic") is Dynamic
+
+    """dynamic types survive rediscovery"""
+    registry.invalidate()
+    assert registry.resolve("test.dynamic") is Dynamic and len(registry) == 2
@@ -0,0 +1,166 @@
+"""the queue is tested against a one connection pool of fake connections - the sql is checked and the rows are scripted"""
+
+import psycopg2.errors
+import psycopg2.extras
+import psycopg2.extensions
+import pytest
+from funkyprompt.entities import Project
+from funkyprompt.services.data import embedding_queue
+from funkyprompt.services.data.pool import ConnectionPool
+from funkyprompt.services.data.embedding_queue import EmbeddingQueue, MAX_ATTEMPTS, LEASE_SECONDS
+
+
+class FakeCursor:
+    def __init__(self, conn):
+        self.conn = conn
+        self._rows = []
+
+    def execute(self, query, data=None):
+        query = " ".join(query.split())
+        self.conn.log.append((query, data))
+        if "RETURNING id, table_name" in query:
+            self._rows = self.conn.claimable
+        elif query.startswith("SELECT id::text"):
+            self._rows = [(j["record_id"], f"text {j['record_id']}") for j in self.conn.claimable]
+        elif query.startswith("SELECT q.id"):
+            """the jobs still at the claimed version"""
+            self._rows = [(j["id"],) for j in self.conn.claimable if j["id"] not in self.conn.requeued]
+        elif query.startswith("SELECT to_regclass"):
+            self._rows = [(self.conn.migrated,)]
+        elif query.startswith("UPDATE public.project SET description_embedding") and self.conn.migrated:
+            raise psycopg2.errors.UndefinedColumn('column "description_embedding" does not exist')
+
+    def fetchall(self):
+        return self._rows
+
+    def fetchone(self):
+        return self._rows[0]
+
+
+class FakeConnection:
+    def __init__(self, dsn=None):
+        self.log = []
+        self.claimable = []
+        self.requeued = set()
+        """the inline embedding columns have been moved to public.project_embeddings"""
+        self.migrated = False
+        self.commits = self.rollbacks = 0
+        self.closed = 0
+
+    def cursor(self, cursor_factory=None):
+        return FakeCursor(self)
+
+    def commit(self):
+        self.commits += 1
+
+    def rollback(self):
+        self.rollbacks += 1
+
+    def get_transaction_status(self):
+        return psycopg2.extensions.TRANSACTION_STATUS_IDLE
+
+
+@pytest.fixture
+def queue(monkeypatch):
+    """one connection with a short timeout - anything that holds it while another caller needs it fails the test"""
+    pool = ConnectionPool("fake", min_size=1, max_size=1, timeout=0.2, connect=FakeConnection)
+    monkeypatch.setattr(embedding_queue, "get_pool", lambda: pool)
+    monkeypatch.setattr(embedding_queue, "_EMBEDDING_TABLES", {})
+
+    def execute_values(cursor, query, rows, **kwargs):
+        cursor.execute(query, rows)
+
+    monkeypatch.setattr(psycopg2.extras, "execute_values", execute_values)
+    monkeypatch.setattr(psycopg2.extras, "execute_batch", execute_values)
+    q = EmbeddingQueue("test.embedding_jobs")
+    with pool.connection() as conn:
+        q.conn = conn
+    return q
+
+
+def _job(i, version=0):
+    return {
+        "id": i,
+        "table_name": "public.project",
+        "key_field": "id",
+        "record_id": f"r{i}",
+        "field": "description",
+        "provider": "openai",
+        "version": version,
+    }
+
+
+def test_enqueue_revives_and_requeues_existing_jobs(queue):
+    assert queue.enqueue(Project, [{"id": "a"}, {"id": "b"}]) == 2
+    query, rows = queue.conn.log[-1]
+    assert "DO UPDATE SET attempts = 0, last_error = NULL, enqueued_at = CURRENT_TIMESTAMP" in query
+    assert "version = test.embedding_jobs.version + 1, claimed_at = NULL" in query
+    assert rows == [
+        ("public.project", "id", "a", "description", "openai"),
+        ("public.project", "id", "b", "description", "openai"),
+    ]
+    assert queue.enqueue(Project, []) == 0
+
+
+def test_process_batch_leases_embeds_without_a_connection_and_deletes_what_it_claimed(queue, monkeypatch):
+    conn = queue.conn
+    conn.claimable = [_job(1), _job(2)]
+
+    def embed(rows, provider):
+        """an ingest that re-queues a claimed record while we embed must not wait for the worker"""
+        assert queue.enqueue(Project, [{"id": "r2"}]) == 1
+        conn.requeued.add(2)
+        return [[0.1, 0.2] for _ in rows]
+
+    monkeypatch.setattr(queue, "_embed", embed)
+    assert queue.process_batch(batch_size=10) == 1
+
+    queries = [q for q, _ in conn.log]
+    claim = next(i for i, q in enumerate(queries) if "RETURNING id, table_name" in q)
+    assert "FOR UPDATE SKIP LOCKED" in queries[claim] and conn.log[claim][1] == (queue.worker_id, MAX_ATTEMPTS, LEASE_SECONDS, 10)
+    assert "q.version = claimed.version" in next(q for q in queries if q.startswith("SELECT q.id"))
+
+    """only the job that was not re-queued is written and deleted - the re-queued one is embedded again with its new text"""
+    (_, written), = [l for l in conn.log if l[0].startswith("UPDATE public.project SET description_embedding")]
+    assert [key for _, key in written] == ["r1"]
+    assert conn.log[-1] == ("DELETE FROM test.embedding_jobs WHERE id = ANY(%s)", ([1],))
+    assert queue._counters["processed"] == 1
+
+
+def test_failed_batches_count_attempts_and_release_the_lease(queue, monkeypatch):
+    conn = queue.conn
+    conn.claimable = [_job(1), _job(2)]
+
+    def fail(rows, provider):
+        raise ValueError("provider down")
+
+    monkeypatch.setattr(queue, "_embed", fail)
+    assert queue.process_batch() == 0
+    query, args = conn.log[-1]
+    assert query.startswith("UPDATE test.embedding_jobs SET attempts = attempts + 1") and "claimed_at = NULL" in query
+    assert args == ("ValueError('provider down')", [1, 2])
+    assert queue._counters["failures"] == 1 and queue._counters["processed"] == 0
+
+    conn.claimable = []
+    assert queue.process_batch() == 0 and queue._counters["failures"] == 1
+
+
+def test_vectors_go_to_the_embedding_table_once_the_inline_columns_are_dropped(queue, monkeypatch):
+    conn = queue.conn
+    conn.claimable = [_job(1)]
+    monkeypatch.setattr(queue, "_embed", lambda rows, provider: [[0.1, 0.2] for _ in rows])
+    assert queue.process_batch() == 1
+    assert embedding_queue._EMBEDDING_TABLES == {"public.project": False}
+
+    """another process migrates the table - the cached answer is stale and the update fails on the dropped column"""
+    conn.migrated = True
+    conn.log.clear()
+    assert queue.process_batch() == 1
+    queries = [q for q, _ in conn.log]
+    assert "ROLLBACK TO SAVEPOINT inline_embeddings" in queries
+    assert any(q.startswith("INSERT INTO public.project_embeddings") for q in queries)
+    assert embedding_queue._EMBEDDING_TABLES == {"public.project": True}
+    assert queue._counters["failures"] == 0
+
+    embedding_queue.forget_embedding_table("public.project")
+    assert embedding_queue._EMBEDDING_TABLES == {}
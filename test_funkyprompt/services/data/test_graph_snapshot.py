@@ -0,0 +1,98 @@
+"""the snapshot is tested from the rows we would write to the graph so we do not need a database"""
+
+from funkyprompt.entities import Project
+from funkyprompt.services.data.graph_snapshot import GraphSnapshot
+
+
+def _snapshot():
+    projects = [
+        Project(name="p1", description="test", graph_paths=["Robotics/AI", "Gardening/Home"]),
+        Project(name="p2", description="test", graph_paths=["Robotics/AI", "Robotics/AI"]),
+        Project(name="p3", description="test", graph_paths=["Cooking/Home", "Gardening"]),
+    ]
+    snapshot = GraphSnapshot()
+    snapshot.add_paths(Project.cypher().path_rows(projects))
+    return snapshot
+
+
+def test_path_queries_match_the_cypher_pattern():
+    snapshot = _snapshot()
+    assert snapshot.query_by_path("Robotics/AI") == ["p1", "p2"]
+    assert sorted(snapshot.query_by_path(["Gardening/Home", "Cooking/Home"])) == ["p1", "p3"]
+    """a path without a category is tagged NONE - like the cypher match any entity tagged Gardening matches once the Gardening/NONE edge exists"""
+    assert snapshot.query_by_path("Gardening") == ["p1", "p3"]
+    assert snapshot.query_by_path("Robotics/Home") == [] and snapshot.query_by_path("Unknown/AI") == []
+    assert snapshot.query_by_path("Robotics/AI", label="public_task") == []
+
+    """writes after the arrays are built are merged on the next query - MERGE semantics so duplicates are not added"""
+    snapshot.add_paths(Project.cypher().path_rows([Project(name="p4", description="test", graph_paths=["Robotics/AI"])]))
+    snapshot.add_paths(Project.cypher().path_rows([Project(name="p2", description="test", graph_paths=["Robotics/AI"])]))
+    assert snapshot.query_by_path("Robotics/AI", label="public_project") == ["p1", "p2", "p4"]
+    assert snapshot.stats()["edges"] == 10
+
+
+def test_neighbourhood_and_co_occurring_tags():
+    snapshot = _snapshot()
+    assert snapshot.neighbourhood("p1", hops=1) == {"Robotics": 1, "Gardening": 1}
+    hood = snapshot.neighbourhood("p1", hops=2)
+    assert hood["AI"] == 2 and hood["p2"] == 2 and hood["p3"] == 2 and "Cooking" not in hood
+    assert snapshot.neighbourhood("p1", hops=3)["Cooking"] == 3
+    assert snapshot.co_occurring_tags("Robotics") == [("Gardening", 1)]
+    assert snapshot.co_occurring_tags("Gardening") == [("Cooking", 1), ("Robotics", 1)]
+
+
+def test_snapshot_loads_from_the_graph():
+    class FakeService:
+        def query_graph(self, query, returns=None):
+            assert "MATCH (a)-[:TAG]->(b)" in query and returns == ["a", "l", "b"]
+            return [
+                {"a": '"p1"', "l": '"public_project"', "b": '"Robotics"'},
+                {"a": '"Robotics"', "l": '""', "b": '"AI"'},
+            ]
+
+    snapshot = _snapshot().load(FakeService())
+    assert snapshot.query_by_path("Robotics/AI", label="public_project") == ["p1"]
+    assert snapshot.query_by_path("Gardening/Home") == [], "a load replaces what we had"
+    assert not snapshot.is_stale(ttl=60)
+
+
+def test_queries_see_one_state_while_the_snapshot_reloads():
+    import threading
+
+    def graph(names, tag):
+        class FakeService:
+            def query_graph(self, query, returns=None):
+                return [{"a": f'"{n}"', "l": '"public_project"', "b": f'"{tag}"'} for n in names] + [
+                    {"a": f'"{tag}"', "l": '""', "b": '"AI"'}
+                ]
+
+        return FakeService()
+
+    """the two graphs intern their names in a different order and size so mixing their states gives wrong names or index errors"""
+    small, large = graph(["a1"], "Robotics"), graph([f"b{i}" for i in range(50)], "Robotics")
+    snapshot = GraphSnapshot().load(small)
+    before = snapshot._state()
+    expected = ({"a1"}, {f"b{i}" for i in range(50)})
+
+    done, errors = threading.Event(), []
+
+    def reload():
+        for i in range(200):
+            snapshot.load(large if i % 2 == 0 else small)
+        done.set()
+
+    def read():
+        try:
+            while not done.is_set():
+                assert set(snapshot.query_by_path("Robotics/AI")) in expected
+                assert set(snapshot.neighbours("Robotics", direction="in")) in expected
+        except Exception as ex:
+            errors.append(ex)
+
+    threads = [threading.Thread(target=reload)] + [threading.Thread(target=read) for _ in range(3)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert not errors
+    assert before.names == ("a1", "Robotics", "AI"), "a built state is never changed"
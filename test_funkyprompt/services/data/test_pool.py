@@ -0,0 +1,101 @@
+"""the pool is tested against fake connections so we do not need a database"""
+
+import threading
+import time
+import pytest
+import psycopg2.extensions
+from funkyprompt.services.data.pool import ConnectionPool, PoolTimeout
+
+
+class FakeCursor:
+    def __init__(self, conn):
+        self.conn = conn
+
+    def execute(self, q, data=None):
+        if self.conn.broken:
+            raise psycopg2.OperationalError("server closed the connection unexpectedly")
+
+    def close(self):
+        pass
+
+
+class FakeConnection:
+    def __init__(self, dsn):
+        self.dsn = dsn
+        self.closed = 0
+        self.broken = False
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def get_transaction_status(self):
+        return psycopg2.extensions.TRANSACTION_STATUS_IDLE
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        self.closed = 1
+
+
+def _pool(**kwargs):
+    return ConnectionPool("fake", connect=FakeConnection, **kwargs)
+
+
+def test_pool_reuses_connections():
+    pool = _pool(min_size=1, max_size=2)
+    with pool.connection() as a:
+        pass
+    with pool.connection() as b:
+        pass
+    assert a is b, "the idle connection should be reused"
+    stats = pool.stats()
+    assert stats["connects"] == 1 and stats["checkouts"] == 2 and stats["in_use"] == 0
+
+
+def test_pool_blocks_and_times_out_when_exhausted():
+    pool = _pool(min_size=0, max_size=1, timeout=0.05)
+    conn = pool.getconn()
+    with pytest.raises(PoolTimeout):
+        pool.getconn()
+    assert pool.stats()["timeouts"] == 1
+
+    """a waiter is released when the connection is returned"""
+    threading.Timer(0.05, pool.putconn, args=(conn,)).start()
+    assert pool.getconn(timeout=2) is conn
+    assert pool.stats()["waits"] == 1
+
+
+def test_pool_reconnects_unhealthy_connections():
+    pool = _pool(min_size=1, max_size=1, health_check_interval=0)
+    with pool.connection() as conn:
+        conn.broken = True
+    time.sleep(0.01)
+    with pool.connection() as fresh:
+        assert fresh is not conn
+    assert conn.closed and pool.stats()["reconnects"] == 1
+
+
+def test_pool_discards_closed_connections():
+    pool = _pool(min_size=0, max_size=1)
+    with pytest.raises(psycopg2.OperationalError):
+        with pool.connection() as conn:
+            conn.closed = 2
+            raise psycopg2.OperationalError("lost")
+    stats = pool.stats()
+    assert stats["size"] == 0 and stats["discarded"] == 1
+
+
+def test_pool_configures_each_connection_once():
+    configured = []
+    pool = _pool(min_size=1, max_size=1, health_check_interval=0, configure=configured.append)
+    for _ in range(3):
+        with pool.connection() as conn:
+            pass
+    assert configured == [conn], "session state is set when the connection is opened and not per checkout"
+
+    conn.broken = True
+    time.sleep(0.01)
+    with pool.connection() as fresh:
+        pass
+    assert configured == [conn, fresh], "a reconnect is configured again"
@@ -0,0 +1,226 @@
+import time
+from funkyprompt.entities import Project
+from funkyprompt.services.data.postgres import PostgresService
+
+
+def _slow(result, seconds):
+    def f():
+        time.sleep(seconds)
+        return result
+
+    return f
+
+
+def test_parallel_strategies_first_with_results_wins():
+    store = PostgresService(Project)
+    started = time.monotonic()
+    result = store._run_strategies_parallel(
+        {"entity": _slow([], 0.01), "sql": _slow(["sql"], 0.05), "vector": _slow(["vector"], 1)},
+        policy="first",
+    )
+    assert result == ["sql"]
+    assert time.monotonic() - started < 0.5
+
+
+def test_parallel_strategies_merge_with_timeouts():
+    def broken():
+        raise Exception("no graph")
+
+    store = PostgresService(Project)
+    started = time.monotonic()
+    result = store._run_strategies_parallel(
+        {"graph": broken, "sql": _slow(["sql"], 0.05), "vector": _slow(["vector"], 2)},
+        policy="merge",
+        timeouts={"vector": 0.2},
+    )
+    assert result == ["sql"]
+    assert time.monotonic() - started < 1
+
+
+def test_parallel_strategies_merge_rows_in_priority_order_without_duplicates():
+    store = PostgresService(Project)
+    result = store._run_strategies_parallel(
+        {
+            "sql": _slow([{"id": 1, "name": "a"}, {"id": 2, "name": "b"}], 0.05),
+            "vector": _slow([{"id": 2, "name": "b", "distances": 0.1}, {"id": 3, "name": "c"}], 0.01),
+        },
+        policy="merge",
+    )
+    assert [r["name"] for r in result] == ["a", "b", "c"] and "distances" not in result[1]
+
+
+def test_strategy_queries_are_bounded_by_a_statement_timeout():
+    """queries run by a strategy set a local statement timeout from the strategy deadline"""
+    from funkyprompt.services.data.postgres import _bounded
+
+    executed = []
+
+    class Cursor:
+        description = None
+
+        def execute(self, q, data=None):
+            executed.append(q)
+
+    class Connection:
+        closed = 0
+
+        def cursor(self):
+            return Cursor()
+
+        def commit(self):
+            pass
+
+    store = PostgresService(Project)
+    _bounded(lambda: store._execute(Connection(), "UPDATE t SET x = 1"), time.monotonic() + 2)()
+    assert executed[0].startswith("SET LOCAL statement_timeout = ") and 1000 < int(executed[0].split()[-1]) <= 2000
+    store._execute(Connection(), "UPDATE t SET x = 1")
+    assert executed[-1] == "UPDATE t SET x = 1" and len(executed) == 3
+
+
+def test_typed_entities_are_loaded_in_one_query():
+    import json
+    from funkyprompt.entities import Task
+
+    queries = []
+
+    class Recording(PostgresService):
+        def execute(self, query, data=None, **kwargs):
+            queries.append((query, data))
+            return [
+                {"_group": 0, "_row": json.dumps({"name": "p1", "description": "a project"})},
+                {"_group": 1, "_row": json.dumps({"name": "t1", "description": "a task", "project_name": "p1"})},
+            ]
+
+    entities = Recording(Project)._select_typed_by_names([(Project, ["p1"]), (Task, ["t1", "t2"])])
+    assert len(queries) == 1 and queries[0][0].count("UNION ALL") == 1
+    assert queries[0][1] == (["p1"], ["t1", "t2"])
+    assert [type(e) for e in entities] == [Project, Task]
+
+
+def test_cypher_wrapper_emits_only_the_cypher_call():
+    from funkyprompt.services.data.postgres import cypher_with_age_wrapper
+
+    query = cypher_with_age_wrapper("MATCH (n {name: $name}) RETURN n", params=True)
+    assert "LOAD" not in query and "search_path" not in query
+    assert query.strip().startswith("SELECT") and "$$, %s) as (n0 agtype)" in query
+
+
+def test_ask_vector_is_one_query_unless_lexical_is_asked_for():
+    calls = []
+
+    class Recording(PostgresService):
+        def vector_search_many(self, questions, **kwargs):
+            calls.append(("vector", questions))
+            return {q: [{"id": q, "name": q}] for q in questions}
+
+        def has_full_text(self):
+            return True
+
+        def hybrid_search(self, question, use_vector=True, **kwargs):
+            calls.append(("lexical", question))
+            return [{"id": "lexical", "name": "lexical"}]
+
+    store = Recording(Project)
+    assert len(store._ask_vector("q", ["a", "b"])) == 2
+    assert calls == [("vector", ["a", "b"])]
+    assert len(store._ask_vector("q", ["a", "b"], lexical=True)) == 3
+    assert calls[-1] == ("lexical", "q")
+
+
+class _NamedCursor:
+    """a server side cursor that fetches `itersize` rows per round trip"""
+
+    def __init__(self, conn, name):
+        self.conn, self.name = conn, name
+        self.itersize = 2000
+        self.description = None
+        self.closed = False
+        conn.cursors.append(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.closed = True
+
+    def execute(self, query, data=None):
+        self.description = [("name",), ("n",)]
+
+    def __iter__(self):
+        for start in range(0, len(self.conn.rows), self.itersize):
+            self.conn.fetches.append(min(self.itersize, len(self.conn.rows) - start))
+            yield from self.conn.rows[start : start + self.itersize]
+
+
+class _StreamingConnection:
+    def __init__(self, dsn):
+        self.rows = [(f"p{i}", i) for i in range(25)]
+        self.cursors, self.fetches = [], []
+        self.closed = 0
+
+    def cursor(self, name=None):
+        return _NamedCursor(self, name)
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+    def get_transaction_status(self):
+        import psycopg2.extensions
+
+        return psycopg2.extensions.TRANSACTION_STATUS_IDLE
+
+
+def test_select_iter_streams_in_itersize_chunks_and_releases_the_connection():
+    from funkyprompt.services.data.pool import ConnectionPool
+
+    pool = ConnectionPool("fake", min_size=1, max_size=1, connect=_StreamingConnection)
+
+    class Streaming(PostgresService):
+        @property
+        def pool(self):
+            return pool
+
+    store = Streaming(Project)
+    rows = list(store.select_iter(itersize=10, as_model=False))
+    with pool.connection() as conn:
+        pass
+    assert rows[0] == {"name": "p0", "n": 0} and len(rows) == 25
+    assert conn.fetches == [10, 10, 5] and conn.cursors[0].name.startswith("funky_")
+
+    """closing the generator early closes the named cursor and returns the connection"""
+    stream = store.execute_iter("SELECT name, n FROM public.project", itersize=10)
+    assert next(stream) == {"name": "p0", "n": 0}
+    assert pool.stats()["in_use"] == 1
+    stream.close()
+    assert conn.cursors[-1].closed and pool.stats()["in_use"] == 0 and pool.stats()["idle"] == 1
+
+
+def test_parallel_strategies_first_respects_priority():
+    store = PostgresService(Project)
+    result = store._run_strategies_parallel(
+        {"graph": _slow(["graph"], 0.2), "sql": _slow([], 0.01), "vector": _slow(["vector"], 0.01)},
+        policy="first",
+    )
+    assert result == ["graph"], "a slow high priority strategy beats a fast low priority one"
+
+    """but not once it has timed out"""
+    result = store._run_strategies_parallel(
+        {"graph": _slow(["graph"], 1), "vector": _slow(["vector"], 0.01)},
+        policy="first",
+        timeouts={"graph": 0.1},
+    )
+    assert result == ["vector"]
+
+
+def test_migrating_to_the_embedding_table_forgets_the_cached_layout(monkeypatch):
+    from funkyprompt.services.data import embedding_queue
+
+    monkeypatch.setattr(embedding_queue, "_EMBEDDING_TABLES", {"public.project": False, "public.other": False})
+    store = PostgresService(Project)
+    monkeypatch.setattr(store, "execute", lambda *args, **kwargs: None)
+    monkeypatch.setattr(store, "create_vector_indexes", lambda *args, **kwargs: None)
+    store.migrate_to_embedding_table()
+    assert embedding_queue._EMBEDDING_TABLES == {"public.other": False}
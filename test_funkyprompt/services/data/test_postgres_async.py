@@ -0,0 +1,114 @@
+"""the async service is tested against a fake async pool so we do not need a database or an event loop plugin"""
+
+import json
+import asyncio
+from types import SimpleNamespace
+from funkyprompt.entities import Project
+from funkyprompt.services.data import postgres_async
+from funkyprompt.services.data.postgres_async import AsyncPostgresService
+
+
+class FakeAsyncCursor:
+    def __init__(self, conn):
+        self.conn = conn
+        self.description = None
+        self._sets = []
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        pass
+
+    def _load(self, rows):
+        self._rows = rows
+        self.description = [SimpleNamespace(name=k) for k in rows[0]] if rows else None
+
+    async def execute(self, query, data=None):
+        self.conn.log.append((query, data))
+        self._load(self.conn.results.pop(0) if self.conn.results else [])
+
+    async def executemany(self, query, data, returning=False):
+        """one result set per row like psycopg in a pipeline"""
+        self.conn.log.append((query, data))
+        self._sets = [[self.conn.returning(row)] for row in data]
+        self._load(self._sets.pop(0))
+
+    async def fetchall(self):
+        return [tuple(r.values()) for r in self._rows]
+
+    def nextset(self):
+        if not self._sets:
+            return None
+        self._load(self._sets.pop(0))
+        return True
+
+
+class FakeAsyncConnection:
+    def __init__(self):
+        self.log = []
+        self.results = []
+        self.returning = lambda row: {"id": row[0]}
+
+    def cursor(self):
+        return FakeAsyncCursor(self)
+
+
+class FakeAsyncPool:
+    def __init__(self):
+        self.conn = FakeAsyncConnection()
+
+    def connection(self):
+        pool = self
+
+        class _Checkout:
+            async def __aenter__(self):
+                return pool.conn
+
+            async def __aexit__(self, *args):
+                pass
+
+        return _Checkout()
+
+
+def _store(monkeypatch):
+    pool = FakeAsyncPool()
+
+    async def get_async_pool():
+        return pool
+
+    monkeypatch.setattr(postgres_async, "get_async_pool", get_async_pool)
+    return AsyncPostgresService(Project), pool.conn
+
+
+def test_aexecute_reads_every_returning_set_of_an_upsert(monkeypatch):
+    store, conn = _store(monkeypatch)
+    result = asyncio.run(store.aexecute_upsert("INSERT ... RETURNING id", [("a",), ("b",), ("c",)]))
+    assert result == [{"id": "a"}, {"id": "b"}, {"id": "c"}]
+
+    conn.results = [[{"name": "a", "id": 1}], []]
+    assert asyncio.run(store.aexecute("SELECT name, id FROM t WHERE name = %s", ("a",))) == [{"name": "a", "id": 1}]
+    assert asyncio.run(store.aexecute("UPDATE t SET x = 1")) is None
+
+
+def test_aquery_graph_binds_params_as_agtype(monkeypatch):
+    store, conn = _store(monkeypatch)
+    asyncio.run(store.aquery_graph("MATCH (n {name: $name}) RETURN n", params={"name": "a"}))
+    query, data = conn.log[-1]
+    assert "$$, %s) as (n0 agtype)" in query and "LOAD" not in query
+    assert data == (json.dumps({"name": "a"}),)
+
+
+def test_aupdate_records_upserts_queues_embeddings_and_merges_paths(monkeypatch):
+    store, conn = _store(monkeypatch)
+    queued = []
+    monkeypatch.setattr(store, "queue_update_embeddings", queued.append)
+
+    projects = [Project(name=f"p{i}", description="test", graph_paths=["Robotics/AI"]) for i in range(2)]
+    result = asyncio.run(store.aupdate_records(projects, defer_embeddings=True))
+
+    upsert, rows = conn.log[0]
+    assert "INSERT INTO public.project" in upsert and len(rows) == 2
+    assert len(result) == 2 and queued == [result]
+    graph, params = conn.log[1]
+    assert "UNWIND $rows AS r" in graph and [r["name"] for r in json.loads(params[0])["rows"]] == ["p0", "p1"]
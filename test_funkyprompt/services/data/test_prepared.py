@@ -0,0 +1,80 @@
+import pytest
+from psycopg2 import errors
+from funkyprompt.services.data.prepared import (
+    to_positional,
+    execute_prepared,
+    get_statement_cache,
+    PreparedStatementCache,
+)
+
+
+class FakeCursor:
+    def __init__(self, connection):
+        self.connection = connection
+
+    def execute(self, query, data=None):
+        self.connection.log.append((query, data))
+        if query.startswith("EXECUTE") and self.connection.fail:
+            raise self.connection.fail.pop(0)
+
+
+class FakeConnection:
+    def __init__(self):
+        self.log = []
+        """errors raised by the next EXECUTEs"""
+        self.fail = []
+
+    def cursor(self):
+        return FakeCursor(self)
+
+
+def test_to_positional():
+    assert to_positional("SELECT * FROM t WHERE a = %s AND b LIKE '5%%' AND c = ANY(%s)") == (
+        "SELECT * FROM t WHERE a = $1 AND b LIKE '5%' AND c = ANY($2)",
+        2,
+    )
+
+
+def test_statements_are_prepared_once_per_connection():
+    conn = FakeConnection()
+    q = "SELECT name FROM public.project WHERE name = %s limit 1"
+    execute_prepared(conn.cursor(), q, ("a",))
+    execute_prepared(conn.cursor(), q, ("b",))
+    prepares = [l for l in conn.log if l[0].startswith("PREPARE")]
+    assert len(prepares) == 1 and "$1" in prepares[0][0]
+    assert conn.log[-1] == ("EXECUTE funky_stmt_1 (%s)", ("b",))
+
+    """another connection prepares its own"""
+    other = FakeConnection()
+    execute_prepared(other.cursor(), q, ("c",))
+    assert other.log[0][0].startswith("PREPARE")
+
+
+def test_least_recently_used_statements_are_deallocated():
+    conn = FakeConnection()
+    cache = get_statement_cache(conn)
+    cache.max_size = 2
+    for q in ["SELECT 1", "SELECT 2", "SELECT 1", "SELECT 3"]:
+        execute_prepared(conn.cursor(), q)
+    assert ("DEALLOCATE funky_stmt_2", None) in conn.log
+    assert len(cache) == 2
+
+
+def test_failed_executes_only_forget_statements_that_are_gone():
+    conn = FakeConnection()
+    q = "INSERT INTO public.project (name) VALUES (%s) RETURNING id"
+    conn.fail = [errors.UniqueViolation("duplicate key")]
+
+    """a constraint error leaves the statement prepared on the server so we keep using it"""
+    with pytest.raises(errors.UniqueViolation):
+        execute_prepared(conn.cursor(), q, ("a",))
+    execute_prepared(conn.cursor(), q, ("b",))
+    assert len([l for l in conn.log if l[0].startswith("PREPARE")]) == 1
+    assert len(get_statement_cache(conn)) == 1
+
+    """a statement that no longer exists is prepared again"""
+    conn.fail = [errors.InvalidSqlStatementName("gone")]
+    with pytest.raises(errors.InvalidSqlStatementName):
+        execute_prepared(conn.cursor(), q, ("c",))
+    execute_prepared(conn.cursor(), q, ("c",))
+    assert [l[0] for l in conn.log if l[0].startswith("PREPARE")][-1].startswith("PREPARE funky_stmt_2")